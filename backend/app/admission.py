@@ -0,0 +1,218 @@
+"""
+Admission control: bounded concurrency per worker, per route class and per client.
+
+Each request is classed by route (auth, bulk, write or read) and admitted
+only while its class and the worker as a whole are below their in-flight
+limits. Otherwise it waits in a short queue of its class, at most
+ADMISSION_QUEUE_TIMEOUT_MS, and is turned away with 503 when the queue is
+full or the wait runs out. Freed slots go to waiting clients in rotation,
+so a client with many queued requests only gets every Nth slot, and a
+client that already has ADMISSION_MAX_IN_FLIGHT_PER_CLIENT requests running
+or queued gets 429 straight away. Clients are told apart by their bearer
+token, or by address before they log in.
+
+Limits are per worker, so the totals for a server are these times the
+number of uvicorn workers. A limit of 0 removes it.
+"""
+import asyncio
+import os
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Optional
+from starlette.responses import JSONResponse
+from app import metrics
+
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "true").lower() in ("1", "true", "yes")
+# Below the threadpool's 40 threads, so excess requests queue here rather than
+# in the threadpool, where requests holding pooled connections can end up
+# waiting for threads taken by requests that are waiting for a connection
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "32"))
+ADMISSION_MAX_IN_FLIGHT_PER_CLIENT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT_PER_CLIENT", "16"))
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "64"))
+ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_MS", "250")) / 1000
+
+# In-flight limit per route class. Logins and registrations are bounded
+# further by the password hasher's own pool.
+ROUTE_CLASS_LIMITS = {
+    "auth": int(os.getenv("ADMISSION_AUTH_MAX_IN_FLIGHT", "8")),
+    "bulk": int(os.getenv("ADMISSION_BULK_MAX_IN_FLIGHT", "2")),
+    "write": int(os.getenv("ADMISSION_WRITE_MAX_IN_FLIGHT", "16")),
+    "read": int(os.getenv("ADMISSION_READ_MAX_IN_FLIGHT", "32")),
+}
+
+ROUTE_CLASSES = {
+    ("POST", "/login"): "auth",
+    ("POST", "/register"): "auth",
+    ("GET", "/todos/export"): "bulk",
+    ("POST", "/todos/import"): "bulk",
+}
+
+# Long-lived or operational routes that are never queued or shed: change
+# streams have a per-user cap of their own and scrapes must work under load
+UNLIMITED_ROUTES = {"/todos/events", "/metrics"}
+
+RETRY_AFTER_SECONDS = "1"
+
+
+def route_class(method: str, route: str) -> Optional[str]:
+    """The class a request is limited under, or None for unlimited routes"""
+    if route in UNLIMITED_ROUTES:
+        return None
+    if (method, route) in ROUTE_CLASSES:
+        return ROUTE_CLASSES[(method, route)]
+    return "read" if method in ("GET", "HEAD") else "write"
+
+
+def client_key(scope) -> str:
+    """Who a request counts against for fairness: its token, else its address"""
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            return value.decode("latin-1")
+    client = scope.get("client")
+    return client[0] if client else ""
+
+
+class AdmissionController:
+    """Per-worker in-flight counters and fair wait queues; event loop only"""
+
+    def __init__(
+        self,
+        max_in_flight: int,
+        class_limits: Dict[str, int],
+        max_in_flight_per_client: int,
+        queue_size: int,
+        queue_timeout: float,
+    ):
+        self.max_in_flight = max_in_flight
+        self.class_limits = class_limits
+        self.max_in_flight_per_client = max_in_flight_per_client
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.class_in_flight = {name: 0 for name in class_limits}
+        # Running plus queued requests per client
+        self.client_requests: Dict[str, int] = {}
+        # Waiters per class, grouped by client; the first client is served next
+        self._queues: Dict[str, "OrderedDict[str, Deque[asyncio.Future]]"] = {
+            name: OrderedDict() for name in class_limits
+        }
+        self._queued = {name: 0 for name in class_limits}
+
+    def _has_slot(self, name: str) -> bool:
+        limit = self.class_limits[name]
+        return (
+            (self.max_in_flight <= 0 or self.in_flight < self.max_in_flight)
+            and (limit <= 0 or self.class_in_flight[name] < limit)
+        )
+
+    def _take_slot(self, name: str):
+        self.in_flight += 1
+        self.class_in_flight[name] += 1
+
+    def _forget_client(self, client: str):
+        self.client_requests[client] -= 1
+        if not self.client_requests[client]:
+            del self.client_requests[client]
+
+    async def acquire(self, name: str, client: str) -> Optional[int]:
+        """Take a slot, waiting briefly if needed; returns None or the status to reject with"""
+        if 0 < self.max_in_flight_per_client <= self.client_requests.get(client, 0):
+            metrics.ADMISSION_REJECTED.labels(name, "client_limit").inc()
+            return 429
+        if self._has_slot(name) and not self._queued[name]:
+            self._take_slot(name)
+            self.client_requests[client] = self.client_requests.get(client, 0) + 1
+            return None
+        if self._queued[name] >= self.queue_size:
+            metrics.ADMISSION_REJECTED.labels(name, "queue_full").inc()
+            return 503
+
+        waiter = asyncio.get_running_loop().create_future()
+        queue = self._queues[name]
+        queue.setdefault(client, deque()).append(waiter)
+        self._queued[name] += 1
+        self.client_requests[client] = self.client_requests.get(client, 0) + 1
+        try:
+            await asyncio.wait([waiter], timeout=self.queue_timeout)
+        except BaseException:
+            # Cancelled while waiting; give back whatever we hold
+            if waiter.done():
+                self.release(name, client)
+            else:
+                self._leave_queue(name, client, waiter)
+            raise
+        if not waiter.done():
+            self._leave_queue(name, client, waiter)
+            metrics.ADMISSION_REJECTED.labels(name, "queue_timeout").inc()
+            return 503
+        return None
+
+    def _leave_queue(self, name: str, client: str, waiter: asyncio.Future):
+        waiter.cancel()
+        queue = self._queues[name]
+        queue[client].remove(waiter)
+        if not queue[client]:
+            del queue[client]
+        self._queued[name] -= 1
+        self._forget_client(client)
+
+    def release(self, name: str, client: str):
+        self.in_flight -= 1
+        self.class_in_flight[name] -= 1
+        self._forget_client(client)
+        self._wake()
+
+    def _wake(self):
+        """Hand free slots to waiters, rotating through the clients of each class"""
+        for name, queue in self._queues.items():
+            while queue and self._has_slot(name):
+                client, waiters = next(iter(queue.items()))
+                waiter = waiters.popleft()
+                if waiters:
+                    queue.move_to_end(client)
+                else:
+                    del queue[client]
+                self._queued[name] -= 1
+                self._take_slot(name)
+                waiter.set_result(None)
+
+
+controller = AdmissionController(
+    ADMISSION_MAX_IN_FLIGHT,
+    ROUTE_CLASS_LIMITS,
+    ADMISSION_MAX_IN_FLIGHT_PER_CLIENT,
+    ADMISSION_QUEUE_SIZE,
+    ADMISSION_QUEUE_TIMEOUT_SECONDS,
+)
+
+
+def _rejection(status_code: int) -> JSONResponse:
+    detail = "Too many requests from this client" if status_code == 429 else "Server busy, please retry"
+    return JSONResponse({"detail": detail}, status_code=status_code, headers={"Retry-After": RETRY_AFTER_SECONDS})
+
+
+class AdmissionMiddleware:
+    """ASGI middleware that admits, queues or sheds requests through `controller`"""
+
+    def __init__(self, app, routes, controller: AdmissionController = controller):
+        self.app = app
+        self.routes = [route for route in routes if hasattr(route, "path")]
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if not ADMISSION_CONTROL or scope["type"] != "http" or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+        name = route_class(scope["method"], metrics.route_template(self.routes, scope))
+        if name is None:
+            await self.app(scope, receive, send)
+            return
+
+        client = client_key(scope)
+        rejected = await self.controller.acquire(name, client)
+        if rejected:
+            await _rejection(rejected)(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(name, client)
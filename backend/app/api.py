@@ -1,78 +1,400 @@
-from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi import APIRouter, HTTPException, status, Depends, Header, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
-from typing import List
 from sqlalchemy.orm import Session
-from app.models import Todo, TodoCreate, TodoUpdate, UserCreate, UserResponse, Token
-from app import db, auth
-from app.database import get_db
-from app.schema import User
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+from typing import List, Optional
+from app.models import (
+    ExportFormat, Priority, Todo, TodoBatchCreate, TodoBatchDelete, TodoBatchResponse, TodoBatchResult,
+    TodoBatchUpdate, TodoChanges, TodoCreate, TodoFilter, TodoSort, TodoStats, TodoUpdate, UserCreate, UserResponse, Token
+)
+from app import compression, database, db, db_async, auth, encoding, events, transfer
+from app.database import get_session
+from app.ids import canonical_id
 from datetime import timedelta
 
-router = APIRouter()
+# JSON responses are re-encoded as msgpack or columnar JSON when the Accept header asks
+router = APIRouter(route_class=encoding.NegotiatedRoute)
+
+# Clients may cache todo reads but must revalidate them with If-None-Match
+TODO_CACHE_CONTROL = "private, no-cache"
+
+HASHER_BUSY = HTTPException(
+    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+    detail="Too many login attempts in progress, please retry",
+    headers={"Retry-After": "1"},
+)
+
+MAX_PAGE_SIZE = 500
 
 @router.post("/register", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
-def register(user: UserCreate, db_session: Session = Depends(get_db)):
-    db_user = db.get_user_by_email(db_session, email=user.email)
+async def register(user: UserCreate, db_session=Depends(get_session)):
+    db_user = await db_async.get_user_by_email(db_session, email=user.email)
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
-    return db.create_user(db_session, user=user)
+    try:
+        password_hash = await auth.password_hasher.hash(user.password)
+    except auth.PasswordHasherBusyError:
+        raise HASHER_BUSY
+    return await db_async.create_user(db_session, user=user, password_hash=password_hash)
 
 @router.post("/login", response_model=Token)
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db_session: Session = Depends(get_db)):
-    user = db.get_user_by_email(db_session, email=form_data.username)
-    if not user or not auth.verify_password(form_data.password, user.password_hash):
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db_session=Depends(get_session)):
+    user = await db_async.get_user_by_email(db_session, email=form_data.username)
+    verified, new_hash = False, None
+    if user:
+        try:
+            verified, new_hash = await auth.password_hasher.verify_and_rehash(
+                form_data.password, user.password_hash
+            )
+        except auth.PasswordHasherBusyError:
+            raise HASHER_BUSY
+    if not verified:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    if new_hash:
+        # Hash parameters changed since this password was stored
+        await db_async.update_password_hash(db_session, user.id, new_hash)
     access_token_expires = timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = auth.create_access_token(
         data={"sub": user.email}, expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
+# Tells the representations of one todos version apart; app.compression
+# appends the content-coding, e.g. "30-msgpack-gzip"
+ETAG_MEDIA_TYPE_SUFFIXES = {encoding.COLUMNAR_JSON: "-columnar", encoding.MSGPACK: "-msgpack"}
+
+def _etag(version: int, media_type: str = encoding.JSON) -> str:
+    return f'"{version}{ETAG_MEDIA_TYPE_SUFFIXES.get(media_type, "")}"'
+
+def _matching_etag(header: Optional[str], etag: str) -> Optional[str]:
+    """The If-None-Match tag that weakly matches etag in any content-coding, if one does"""
+    if not header:
+        return None
+    if header.strip() == "*":
+        return etag
+    for tag in header.split(","):
+        tag = tag.strip()
+        if compression.etag_without_coding(tag.removeprefix("W/")) == etag:
+            return tag
+    return None
+
+def _parse_if_match(header: Optional[str]) -> Optional[int]:
+    """The todos version a client expects, from an If-Match header in any representation"""
+    if header is None or header.strip() == "*":
+        return None
+    # Proxies may hand our strong tags back weakened; the version is the same
+    tag = header.strip().removeprefix("W/")
+    try:
+        return int(tag.strip('"').split("-", 1)[0])
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED, detail="Invalid If-Match")
+
+async def _stream_from_own_session(bind, iter_sync, iter_async, *args, **kwargs):
+    """Stream chunks from a db iterator on a session owned by the stream itself.
+
+    The request's session may be closed before the body is sent, so the
+    stream opens its own, on bind: the engine the request's session used.
+    """
+    if database.USE_ASYNC_DB:
+        async with database.new_session(bind) as session:
+            async for chunk in iter_async(session, *args, **kwargs):
+                yield chunk
+        return
+    session = database.new_session(bind)
+    try:
+        async for chunk in iterate_in_threadpool(iter_sync(session, *args, **kwargs)):
+            yield chunk
+    finally:
+        await run_in_threadpool(session.close)
+
+def _not_modified(etag: str) -> Response:
+    """304 for the variant tagged etag, with the Vary its full response sends"""
+    return Response(
+        status_code=status.HTTP_304_NOT_MODIFIED,
+        headers={"ETag": etag, "Cache-Control": TODO_CACHE_CONTROL, "Vary": "Accept, Accept-Encoding"},
+    )
+
 @router.get("/todos", response_model=List[Todo])
-def get_todos(
-    db_session: Session = Depends(get_db),
-    current_user: User = Depends(auth.get_current_user)
+async def get_todos(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    completed: Optional[bool] = None,
+    category: Optional[str] = None,
+    priority: Optional[Priority] = None,
+    dueAfter: Optional[int] = None,
+    dueBefore: Optional[int] = None,
+    overdue: Optional[bool] = None,
+    sort: TodoSort = TodoSort.created_asc,
+    if_none_match: Optional[str] = Header(None),
+    accept: Optional[str] = Header(None),
+    db_session=Depends(auth.get_read_session),
+    current_user: auth.Principal = Depends(auth.get_current_user)
 ):
-    return db.get_todos(db_session, user_id=current_user.id)
+    media_type = encoding.negotiate(accept)
+    # Read the version before the rows so the ETag is never newer than the body
+    etag = _etag(await db_async.get_todos_version(db_session, user_id=current_user.id), media_type)
+    matched = _matching_etag(if_none_match, etag)
+    if matched:
+        return _not_modified(matched)
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = TODO_CACHE_CONTROL
+
+    filters = TodoFilter(
+        completed=completed,
+        category=category,
+        priority=priority,
+        dueAfter=dueAfter,
+        dueBefore=dueBefore,
+        overdue=overdue,
+    )
+    # Without limit/cursor the full list is returned, as before. It is encoded
+    # straight from column tuples, skipping ORM objects and response_model
+    # validation, and produces the same bytes as serializing List[Todo].
+    if limit is None and cursor is None:
+        # The stream reads on a session of its own; hand this one's connection
+        # back now rather than holding it, and a pool slot, until the body is sent
+        await database.run_db(db_session, Session.close)
+        return StreamingResponse(
+            _stream_from_own_session(
+                db_session.bind, db.iter_todos, db_async.iter_todos, current_user.id, media_type,
+                filters=filters, sort=sort,
+            ),
+            media_type=media_type,
+            headers={"ETag": etag, "Cache-Control": TODO_CACHE_CONTROL, "Vary": "Accept"},
+        )
+
+    if sort != TodoSort.created_asc:
+        raise HTTPException(status_code=400, detail="Pagination only supports sort=createdAt")
+    try:
+        todos, next_cursor = await db_async.get_todos_page(
+            db_session, user_id=current_user.id, limit=limit or MAX_PAGE_SIZE, cursor=cursor,
+            filters=filters,
+        )
+    except db.InvalidCursorError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return todos
 
 @router.post("/todos", response_model=Todo, status_code=status.HTTP_201_CREATED)
-def create_todo(
+async def create_todo(
     todo: TodoCreate, 
-    db_session: Session = Depends(get_db),
-    current_user: User = Depends(auth.get_current_user)
+    db_session=Depends(get_session),
+    current_user: auth.Principal = Depends(auth.get_current_user)
+):
+    return await db_async.create_todo(db_session, todo, user_id=current_user.id)
+
+@router.post("/todos/batch", response_model=TodoBatchResponse)
+async def create_todos_batch(
+    batch: TodoBatchCreate,
+    db_session=Depends(get_session),
+    current_user: auth.Principal = Depends(auth.get_current_user)
+):
+    todos = await db_async.create_todos(db_session, batch.items, user_id=current_user.id)
+    return TodoBatchResponse(
+        results=[TodoBatchResult(id=todo.id, status=status.HTTP_201_CREATED, todo=todo) for todo in todos]
+    )
+
+@router.patch("/todos/batch", response_model=TodoBatchResponse)
+async def update_todos_batch(
+    batch: TodoBatchUpdate,
+    db_session=Depends(get_session),
+    current_user: auth.Principal = Depends(auth.get_current_user)
+):
+    # Stored ids come back canonical, so match the request's in the same form
+    items = [item.model_copy(update={"id": canonical_id(item.id)}) for item in batch.items]
+    ids = [item.id for item in items]
+    if len(set(ids)) != len(ids):
+        raise HTTPException(status_code=400, detail="Duplicate ids in batch")
+    updated = await db_async.update_todos(db_session, items, user_id=current_user.id)
+    return TodoBatchResponse(results=[
+        TodoBatchResult(id=id, status=status.HTTP_200_OK, todo=updated[id]) if id in updated
+        else TodoBatchResult(id=id, status=status.HTTP_404_NOT_FOUND, error="Todo not found")
+        for id in ids
+    ])
+
+@router.delete("/todos/batch", response_model=TodoBatchResponse)
+async def delete_todos_batch(
+    batch: TodoBatchDelete,
+    db_session=Depends(get_session),
+    current_user: auth.Principal = Depends(auth.get_current_user)
+):
+    ids = [canonical_id(id) for id in batch.ids]
+    deleted = await db_async.delete_todos(db_session, ids, user_id=current_user.id)
+    return TodoBatchResponse(results=[
+        TodoBatchResult(id=id, status=status.HTTP_204_NO_CONTENT) if id in deleted
+        else TodoBatchResult(id=id, status=status.HTTP_404_NOT_FOUND, error="Todo not found")
+        for id in ids
+    ])
+
+@router.get("/todos/export")
+async def export_todos(
+    format: ExportFormat = ExportFormat.ndjson,
+    db_session=Depends(auth.get_read_session),
+    current_user: auth.Principal = Depends(auth.get_current_user)
+):
+    """All of the user's todos as NDJSON or CSV, streamed in constant memory"""
+    return StreamingResponse(
+        _stream_from_own_session(
+            db_session.bind, db.iter_todos_export, db_async.iter_todos_export, current_user.id, format
+        ),
+        media_type=transfer.EXPORT_CONTENT_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="todos.{format.value}"'},
+    )
+
+@router.post("/todos/import")
+async def import_todos(
+    request: Request,
+    content_type: Optional[str] = Header(None),
+    current_user: auth.Principal = Depends(auth.get_current_user)
+):
+    """Bulk import from an NDJSON or CSV body; progress and row errors are streamed back as NDJSON"""
+    import_format = transfer.import_format(content_type)
+    if import_format is None:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Upload application/x-ndjson or text/csv",
+        )
+    return transfer.ImportResponse(
+        transfer.import_todos(request.stream(), import_format, current_user.id),
+        media_type="application/x-ndjson",
+    )
+
+@router.get("/todos/changes", response_model=TodoChanges)
+async def get_todo_changes(
+    since: int = Query(0, ge=0),
+    db_session=Depends(auth.get_read_session),
+    current_user: auth.Principal = Depends(auth.get_current_user)
+):
+    try:
+        return await db_async.get_changes(db_session, user_id=current_user.id, since=since)
+    except db.ChangesPurgedError:
+        raise HTTPException(
+            status_code=status.HTTP_410_GONE,
+            detail="Changes since this revision are no longer available; reload all todos",
+        )
+
+@router.get("/todos/stats", response_model=TodoStats)
+async def get_todo_stats(
+    db_session=Depends(get_session),
+    current_user: auth.Principal = Depends(auth.get_current_user)
 ):
-    return db.create_todo(db_session, todo, user_id=current_user.id)
+    return await db_async.get_todo_stats(db_session, user_id=current_user.id)
+
+class ChangeStreamResponse(StreamingResponse):
+    """StreamingResponse that gives back its change feed slot however it ends.
+
+    The body generator's own cleanup never runs if the client leaves before
+    the first chunk, so the slot is released around the whole response.
+    """
+
+    def __init__(self, content, release, **kwargs):
+        super().__init__(content, **kwargs)
+        self.release = release
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.release()
+
+@router.get("/todos/events")
+async def get_todo_events(
+    since: Optional[int] = Query(None, ge=0),
+    last_event_id: Optional[str] = Header(None),
+    db_session=Depends(get_session),
+    current_user: auth.Principal = Depends(auth.get_current_user_for_stream)
+):
+    """Server-Sent Events stream of changes to the user's todos"""
+    if last_event_id and last_event_id.isdigit():
+        since = int(last_event_id)
+    if events.broker.connection_count(current_user.id) >= events.broker.max_connections_per_user:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many open change streams",
+            headers={"Retry-After": "5"},
+        )
+    # The stream can stay open for hours; don't pin the request's connection
+    await database.run_db(db_session, Session.close)
+    # Take the slot before answering: a stream that lost the last one to
+    # another request while the session closed gets a 503, not an empty 200
+    try:
+        wakeup = events.broker.subscribe(current_user.id)
+    except events.TooManyConnectionsError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many open change streams",
+            headers={"Retry-After": "5"},
+        )
+    return ChangeStreamResponse(
+        events.change_stream(current_user.id, since, wakeup),
+        release=lambda: events.broker.unsubscribe(current_user.id, wakeup),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.get("/todos/{id}", response_model=Todo)
+async def get_todo(
+    id: str,
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    accept: Optional[str] = Header(None),
+    db_session=Depends(auth.get_read_session),
+    current_user: auth.Principal = Depends(auth.get_current_user)
+):
+    etag = _etag(await db_async.get_todos_version(db_session, user_id=current_user.id), encoding.negotiate(accept))
+    matched = _matching_etag(if_none_match, etag)
+    if matched:
+        return _not_modified(matched)
+    todo = await db_async.get_todo(db_session, id, user_id=current_user.id)
+    if not todo:
+        raise HTTPException(status_code=404, detail="Todo not found")
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = TODO_CACHE_CONTROL
+    return todo
 
 @router.patch("/todos/{id}", response_model=Todo)
-def update_todo(
+async def update_todo(
     id: str, 
     todo_update: TodoUpdate, 
-    db_session: Session = Depends(get_db),
-    current_user: User = Depends(auth.get_current_user)
+    if_match: Optional[str] = Header(None),
+    db_session=Depends(get_session),
+    current_user: auth.Principal = Depends(auth.get_current_user)
 ):
-    updated_todo = db.update_todo(db_session, id, todo_update, user_id=current_user.id)
+    try:
+        updated_todo = await db_async.update_todo(
+            db_session, id, todo_update, user_id=current_user.id,
+            expected_version=_parse_if_match(if_match),
+        )
+    except db.VersionConflictError:
+        raise HTTPException(
+            status_code=status.HTTP_412_PRECONDITION_FAILED,
+            detail="Todos have changed since the If-Match version",
+        )
     if not updated_todo:
         raise HTTPException(status_code=404, detail="Todo not found")
     return updated_todo
 
 @router.delete("/todos/completed", status_code=status.HTTP_204_NO_CONTENT)
-def delete_completed_todos(
-    db_session: Session = Depends(get_db),
-    current_user: User = Depends(auth.get_current_user)
+async def delete_completed_todos(
+    db_session=Depends(get_session),
+    current_user: auth.Principal = Depends(auth.get_current_user)
 ):
-    db.delete_completed_todos(db_session, user_id=current_user.id)
+    await db_async.delete_completed_todos(db_session, user_id=current_user.id)
     return
 
 @router.delete("/todos/{id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_todo(
+async def delete_todo(
     id: str, 
-    db_session: Session = Depends(get_db),
-    current_user: User = Depends(auth.get_current_user)
+    db_session=Depends(get_session),
+    current_user: auth.Principal = Depends(auth.get_current_user)
 ):
-    if not db.delete_todo(db_session, id, user_id=current_user.id):
+    if not await db_async.delete_todo(db_session, id, user_id=current_user.id):
         raise HTTPException(status_code=404, detail="Todo not found")
     return
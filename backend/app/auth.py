@@ -1,22 +1,154 @@
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-from typing import Optional
-from fastapi import Depends, HTTPException, status
+from typing import Dict, Optional, Set, Tuple
+from fastapi import Depends, HTTPException, Query, status
 from fastapi.security import OAuth2PasswordBearer
 import jwt
 from jwt.exceptions import InvalidTokenError
 from passlib.context import CryptContext
+from sqlalchemy import event, inspect, select
 from sqlalchemy.orm import Session
-from app.database import get_db
+from app import database, metrics
+from app.database import get_session, run_db
 from app.schema import User
+import multiprocessing
 import os
+import threading
+import time
 
 # Configuration
 SECRET_KEY = os.getenv("SECRET_KEY", "09d25e094faa6ca2556c818166b7a9563b93f7099f6f0f4caa6cf63b88e8d3e7")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+PRINCIPAL_CACHE_TTL_SECONDS = float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "60"))
+PRINCIPAL_CACHE_MAX_SIZE = int(os.getenv("PRINCIPAL_CACHE_MAX_SIZE", "10000"))
 
-pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
+# Argon2 cost profiles. "production" matches passlib's defaults so existing
+# hashes stay valid; "fast" is for tests and local development only.
+PASSWORD_HASH_PROFILES = {
+    "production": {"argon2__rounds": 3, "argon2__memory_cost": 65536, "argon2__parallelism": 4},
+    "fast": {"argon2__rounds": 1, "argon2__memory_cost": 1024, "argon2__parallelism": 1},
+}
+PASSWORD_HASH_PROFILE = os.getenv("PASSWORD_HASH_PROFILE", "production")
+# Processes dedicated to hashing; 0 runs hashing in the threadpool instead
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+# Hash/verify calls allowed to wait or run at once before new ones are rejected
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "32"))
+
+pwd_context = CryptContext(
+    schemes=["argon2"], deprecated="auto", **PASSWORD_HASH_PROFILES[PASSWORD_HASH_PROFILE]
+)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
+oauth2_scheme_optional = OAuth2PasswordBearer(tokenUrl="login", auto_error=False)
+
+@dataclass(frozen=True)
+class Principal:
+    """The authenticated user, detached from any database session"""
+    id: str
+    email: str
+
+
+class PrincipalCache:
+    """Bounded LRU cache of verified principals keyed by access token.
+
+    Entries expire after the TTL or when the token itself expires, whichever
+    comes first. Safe to share between the threads serving sync routes.
+    """
+
+    def __init__(self, ttl_seconds: float, max_size: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, tuple[Principal, float]]" = OrderedDict()
+        self._tokens_by_email: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Optional[Principal]:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is not None:
+                principal, deadline = entry
+                if deadline > time.monotonic():
+                    self._entries.move_to_end(token)
+                    self.hits += 1
+                    return principal
+                self._remove(token)
+            self.misses += 1
+            return None
+
+    def put(self, token: str, principal: Principal, token_expires_at: float):
+        if self.ttl_seconds <= 0 or self.max_size <= 0:
+            return
+        lifetime = min(self.ttl_seconds, token_expires_at - time.time())
+        if lifetime <= 0:
+            return
+        with self._lock:
+            self._remove(token)
+            self._entries[token] = (principal, time.monotonic() + lifetime)
+            self._tokens_by_email.setdefault(principal.email, set()).add(token)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate_user(self, email: str):
+        """Drop every cached token for a user"""
+        with self._lock:
+            for token in list(self._tokens_by_email.get(email, ())):
+                self._remove(token)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tokens_by_email.clear()
+
+    def _remove(self, token: str):
+        entry = self._entries.pop(token, None)
+        if entry is None:
+            return
+        email = entry[0].email
+        tokens = self._tokens_by_email.get(email)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_email[email]
+
+
+principal_cache = PrincipalCache(PRINCIPAL_CACHE_TTL_SECONDS, PRINCIPAL_CACHE_MAX_SIZE)
+
+
+@event.listens_for(User, "after_delete")
+def _invalidate_deleted_user(mapper, connection, target):
+    principal_cache.invalidate_user(target.email)
+
+
+@event.listens_for(User, "after_update")
+def _invalidate_updated_user(mapper, connection, target):
+    state = inspect(target)
+    for attr in ("email", "password_hash"):
+        history = state.attrs[attr].history
+        if history.has_changes():
+            for email in list(history.deleted) + [target.email]:
+                principal_cache.invalidate_user(email)
+            return
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _invalidate_bulk_deleted_users(orm_execute_state):
+    """delete(User) statements don't fire after_delete, so drop their users here"""
+    if not orm_execute_state.is_delete or orm_execute_state.bind_mapper is not inspect(User):
+        return None
+    emails = select(User.email)
+    if orm_execute_state.statement.whereclause is not None:
+        emails = emails.where(orm_execute_state.statement.whereclause)
+    emails = orm_execute_state.session.execute(emails).scalars().all()
+    result = orm_execute_state.invoke_statement()
+    for email in emails:
+        principal_cache.invalidate_user(email)
+    return result
+
 
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
@@ -24,6 +156,69 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+def verify_and_rehash_password(plain_password, hashed_password) -> Tuple[bool, Optional[str]]:
+    """Verify a password and return a new hash if its parameters are outdated"""
+    if not pwd_context.verify(plain_password, hashed_password):
+        return False, None
+    if pwd_context.needs_update(hashed_password):
+        return True, pwd_context.hash(plain_password)
+    return True, None
+
+
+class PasswordHasherBusyError(Exception):
+    """Raised when too many hash/verify calls are already pending"""
+
+
+class PasswordHasher:
+    """Runs Argon2 work in a bounded process pool off the event loop.
+
+    At most max_pending calls may be queued or running; further calls fail
+    fast with PasswordHasherBusyError instead of piling up behind the pool.
+    """
+
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self._executor = None
+
+    def _get_executor(self):
+        if self.workers > 0 and self._executor is None:
+            # Forking this multi-threaded process could copy a lock held by
+            # another thread into the children, so start them from a forkserver,
+            # which imports this module once for all of them
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload([__name__])
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        return self._executor
+
+    async def _run(self, operation, fn, *args):
+        if self.pending >= self.max_pending:
+            metrics.PASSWORD_HASH_REJECTED.labels(operation).inc()
+            raise PasswordHasherBusyError()
+        self.pending += 1
+        start = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self.pending -= 1
+            metrics.PASSWORD_HASH_DURATION.labels(operation).observe(time.perf_counter() - start)
+
+    async def hash(self, password: str) -> str:
+        return await self._run("hash", get_password_hash, password)
+
+    async def verify_and_rehash(self, plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        return await self._run("verify", verify_and_rehash_password, plain_password, hashed_password)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+
+password_hasher = PasswordHasher(PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -34,12 +229,22 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+def _load_principal(db: Session, email: str) -> Optional[Principal]:
+    user = db.query(User).filter(User.email == email).first()
+    if user is None:
+        return None
+    return Principal(id=user.id, email=user.email)
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db=Depends(get_session)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return principal
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
@@ -48,7 +253,36 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
     except InvalidTokenError:
         raise credentials_exception
     
-    user = db.query(User).filter(User.email == email).first()
-    if user is None:
+    principal = None
+    bind = database.read_bind()
+    if bind is not None:
+        principal = await database.run_in_new_session(_load_principal, email, bind=bind)
+    if principal is None:
+        # An account registered moments ago may not have reached the replica yet
+        principal = await run_db(db, _load_principal, email)
+    if principal is None:
         raise credentials_exception
-    return user
+    principal_cache.put(token, principal, token_expires_at=payload.get("exp", 0))
+    return principal
+
+async def get_current_user_for_stream(
+    token: Optional[str] = Depends(oauth2_scheme_optional),
+    access_token: Optional[str] = Query(None),
+    db=Depends(get_session),
+):
+    """Like get_current_user, but also accepts ?access_token= because the
+    browser EventSource API cannot send an Authorization header"""
+    return await get_current_user(token or access_token or "", db)
+
+async def get_read_session(current_user: Principal = Depends(get_current_user), db=Depends(get_session)):
+    """Session for read-only routes: on a replica, unless the user wrote
+    recently or no replica is healthy, in which case the primary's"""
+    bind = database.read_bind(current_user.id)
+    if bind is None:
+        yield db
+        return
+    session = database.new_session(bind)
+    try:
+        yield session
+    finally:
+        await database.close_session(session)
@@ -0,0 +1,169 @@
+"""
+Response compression.
+
+Responses of at least RESPONSE_COMPRESSION_MIN_BYTES are compressed with
+brotli when the client accepts it and the brotli package (speedups extra)
+is installed, otherwise with gzip. Streamed responses are compressed chunk
+by chunk and flushed after each, so NDJSON progress lines aren't held back;
+Server-Sent Events are never compressed. A compressed response's strong
+ETag gets the content-coding appended, "30" becoming "30-gzip", so every
+variant of a resource has a validator of its own.
+"""
+import os
+import zlib
+from typing import Optional
+import anyio
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # optional; gzip is used instead
+    brotli = None
+
+RESPONSE_COMPRESSION = os.getenv("RESPONSE_COMPRESSION", "true").lower() in ("1", "true", "yes")
+RESPONSE_COMPRESSION_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESSION_MIN_BYTES", "1024"))
+# Levels for dynamic responses: most of the size win for a fraction of the maximum's CPU
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+
+# Chunks at least this large are compressed off the event loop
+THREAD_MIN_BYTES = 128 * 1024
+
+
+# Content-codings this middleware applies, as appended to ETags
+CODINGS = ("gzip", "br")
+
+# Never compressed: the change feed must reach clients event by event
+EXCLUDED_MEDIA_TYPES = {"text/event-stream"}
+
+
+def etag_without_coding(etag: str) -> str:
+    """etag as it was before compression appended a content-coding"""
+    for coding in CODINGS:
+        if etag.endswith(f'-{coding}"'):
+            return etag[:-len(coding) - 2] + '"'
+    return etag
+
+
+def accepts_encoding(accept_encoding: str, coding: str) -> bool:
+    """Whether an Accept-Encoding header allows coding, i.e. lists it without q=0"""
+    for part in accept_encoding.split(","):
+        name, *params = [item.strip() for item in part.split(";")]
+        if name.lower() != coding:
+            continue
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    return float(value) > 0
+                except ValueError:
+                    return False
+        return True
+
+    @staticmethod
+    async def _compress(coder, message: Message) -> bytes:
+        body, more_body = message.get("body", b""), message.get("more_body", False)
+        if len(body) >= THREAD_MIN_BYTES:
+            return await anyio.to_thread.run_sync(coder.compress, body, more_body)
+        return coder.compress(body, more_body)
+    return False
+
+
+class GzipCoder:
+    coding = "gzip"
+
+    def __init__(self):
+        self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, body: bytes, more_body: bool) -> bytes:
+        return self._compressor.compress(body) + self._compressor.flush(zlib.Z_SYNC_FLUSH if more_body else zlib.Z_FINISH)
+
+
+class BrotliCoder:
+    coding = "br"
+
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, body: bytes, more_body: bool) -> bytes:
+        compressed = self._compressor.process(body)
+        return compressed + (self._compressor.flush() if more_body else self._compressor.finish())
+
+
+def choose_coder(accept_encoding: str):
+    """A fresh coder for the best content-coding the client accepts, or None for identity"""
+    if brotli is not None and accepts_encoding(accept_encoding, "br"):
+        return BrotliCoder()
+    if accepts_encoding(accept_encoding, "gzip"):
+        return GzipCoder()
+    return None
+
+
+class CompressionMiddleware:
+    """Compresses response bodies by wrapping send, preferring brotli over gzip"""
+
+    def __init__(self, app: ASGIApp, minimum_size: int = RESPONSE_COMPRESSION_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        coder = choose_coder(Headers(scope=scope).get("accept-encoding", ""))
+        # The start message is held back until the first body chunk shows
+        # whether the response is worth compressing
+        start: Optional[Message] = None
+        compressing = False
+
+        async def send_compressed(message: Message):
+            nonlocal start, compressing
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                media_type = headers.get("content-type", "").partition(";")[0].strip().lower()
+                if "content-encoding" in headers or message["status"] == 206 or media_type in EXCLUDED_MEDIA_TYPES:
+                    await send(message)
+                else:
+                    start = message
+                return
+            if start is None:
+                if compressing and message["type"] == "http.response.body":
+                    message = {**message, "body": await self._compress(coder, message)}
+                await send(message)
+                return
+            first, start = start, None
+            if message["type"] == "http.response.body":
+                compressing = self._begin(first, coder, message)
+                if compressing:
+                    message = {**message, "body": await self._compress(coder, message)}
+                    if not message.get("more_body", False) and not first.get("trailers", False):
+                        MutableHeaders(raw=first["headers"])["Content-Length"] = str(len(message["body"]))
+            await send(first)
+            await send(message)
+
+        await self.app(scope, receive, send_compressed)
+
+    def _begin(self, start: Message, coder, message: Message) -> bool:
+        """Set start's headers for the response whose first chunk is message; whether to compress it"""
+        if len(message.get("body", b"")) < self.minimum_size and not message.get("more_body", False):
+            return False
+        headers = MutableHeaders(raw=start["headers"])
+        headers.add_vary_header("Accept-Encoding")
+        if coder is None:
+            return False
+        headers["Content-Encoding"] = coder.coding
+        if "content-length" in headers:
+            del headers["Content-Length"]
+        etag = headers.get("etag")
+        if etag and etag.startswith('"'):
+            headers["ETag"] = f'{etag[:-1]}-{coder.coding}"'
+        return True
+
+    @staticmethod
+    async def _compress(coder, message: Message) -> bytes:
+        body, more_body = message.get("body", b""), message.get("more_body", False)
+        if len(body) >= THREAD_MIN_BYTES:
+            return await anyio.to_thread.run_sync(coder.compress, body, more_body)
+        return coder.compress(body, more_body)
@@ -1,27 +1,155 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, DeclarativeBase
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.pool import QueuePool, StaticPool
+from sqlalchemy.orm import Session, sessionmaker, DeclarativeBase
+from starlette.concurrency import run_in_threadpool
+from typing import Optional
+import asyncio
 import os
+from app.replicas import ReplicaSet
 
 # Database URL - can be overridden for testing or Docker
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./todos.db")
 
-# Create engine
-connect_args = {}
-if SQLALCHEMY_DATABASE_URL.startswith("sqlite"):
-    connect_args = {"check_same_thread": False}
+# Serve requests through an AsyncSession (aiosqlite/asyncpg) instead of a
+# blocking Session run in the threadpool. Requires the "async" extra.
+USE_ASYNC_DB = os.getenv("USE_ASYNC_DB", "false").lower() in ("1", "true", "yes")
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, 
-    connect_args=connect_args
-)
+# SQLite connection tuning, applied to every new connection. WAL lets readers
+# run alongside the single writer and busy_timeout makes writers from other
+# workers wait for the lock instead of failing with "database is locked".
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "20000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", "10"))
+
+# Comma-separated URLs of read replicas of DATABASE_URL; read-only routes
+# are spread over them, everything else runs on the primary
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+# After a user's write commits, their reads stay on the primary this long.
+# Replicas lagging further behind than this are taken out of rotation.
+REPLICA_READ_YOUR_WRITES_SECONDS = float(os.getenv("REPLICA_READ_YOUR_WRITES_SECONDS", "5"))
+
+def is_sqlite_memory_url(url: str) -> bool:
+    return url.split("?")[0].rstrip("/") in ("sqlite:", "sqlite+aiosqlite:") or ":memory:" in url
+
+def configure_sqlite(sqlite_engine, in_memory: bool = False):
+    """Set the connection pragmas on every connection the engine opens"""
+    pragmas = [
+        f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}",
+        f"PRAGMA synchronous = {SQLITE_SYNCHRONOUS}",
+        # Negative cache_size is in KiB rather than pages
+        f"PRAGMA cache_size = -{SQLITE_CACHE_SIZE_KB}",
+        "PRAGMA temp_store = MEMORY",
+    ]
+    if not in_memory:
+        pragmas += [
+            f"PRAGMA journal_mode = {SQLITE_JOURNAL_MODE}",
+            f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE}",
+        ]
+
+    @event.listens_for(sqlite_engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+def create_db_engine(url: str):
+    """Create an engine, tuned for SQLite when the URL points at it"""
+    if not url.startswith("sqlite"):
+        return create_engine(url)
+    in_memory = is_sqlite_memory_url(url)
+    if in_memory:
+        # Every connection to :memory: is a separate database, so share one
+        sqlite_engine = create_engine(
+            url, connect_args={"check_same_thread": False}, poolclass=StaticPool
+        )
+    else:
+        sqlite_engine = create_engine(
+            url,
+            connect_args={"check_same_thread": False},
+            poolclass=QueuePool,
+            pool_size=SQLITE_POOL_SIZE,
+            max_overflow=0,
+        )
+    configure_sqlite(sqlite_engine, in_memory=in_memory)
+    return sqlite_engine
+
+# Create engine
+engine = create_db_engine(SQLALCHEMY_DATABASE_URL)
 
 # Create SessionLocal class for database sessions
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+replicas = ReplicaSet(
+    [create_db_engine(url) for url in DATABASE_REPLICA_URLS], REPLICA_READ_YOUR_WRITES_SECONDS
+)
+
+# Async engine and session factory, created on first use so the async
+# drivers are only imported when USE_ASYNC_DB is enabled
+async_engine = None
+AsyncSessionLocal = None
+
 # Base class for declarative models
 class Base(DeclarativeBase):
     pass
 
+def to_async_url(url: str) -> str:
+    """Map a sync database URL onto its async driver"""
+    if url.startswith("sqlite:"):
+        return url.replace("sqlite:", "sqlite+aiosqlite:", 1)
+    if url.startswith("postgresql:"):
+        return url.replace("postgresql:", "postgresql+asyncpg:", 1)
+    return url
+
+def create_async_db_engine(url: str):
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    new_async_engine = create_async_engine(url)
+    if url.startswith("sqlite"):
+        configure_sqlite(new_async_engine.sync_engine, in_memory=is_sqlite_memory_url(url))
+    return new_async_engine
+
+def get_async_sessionmaker():
+    if AsyncSessionLocal is None:
+        url = os.getenv("ASYNC_DATABASE_URL", to_async_url(SQLALCHEMY_DATABASE_URL))
+        configure_async_db(create_async_db_engine(url))
+    return AsyncSessionLocal
+
+def read_bind(user_id: Optional[str] = None):
+    """The engine for a read-only session: a replica's, or None for the primary.
+
+    With a user_id, reads stay on the primary for a while after that
+    user's own writes. The engine is an AsyncEngine when USE_ASYNC_DB is set.
+    """
+    replica = replicas.choose(user_id)
+    if replica is None:
+        return None
+    if not USE_ASYNC_DB:
+        return replica.engine
+    if replica.async_engine is None:
+        url = to_async_url(replica.engine.url.render_as_string(hide_password=False))
+        replica.async_engine = create_async_db_engine(url)
+        replicas.watch(replica, replica.async_engine.sync_engine)
+    return replica.async_engine
+
+def new_session(bind=None):
+    """A Session, or an AsyncSession when USE_ASYNC_DB is set, on bind or the primary"""
+    kwargs = {} if bind is None else {"bind": bind}
+    if USE_ASYNC_DB:
+        return get_async_sessionmaker()(**kwargs)
+    return SessionLocal(**kwargs)
+
+async def close_session(session):
+    if isinstance(session, Session):
+        await run_in_threadpool(session.close)
+    else:
+        await session.close()
+
 # Dependency to get database session
 def get_db():
     db = SessionLocal()
@@ -30,14 +158,80 @@ def get_db():
     finally:
         db.close()
 
-# Initialize database (create tables)
+# Dependency used by the API routes: an AsyncSession when USE_ASYNC_DB is
+# set, otherwise a regular Session
+async def get_session():
+    if USE_ASYNC_DB:
+        async with get_async_sessionmaker()() as session:
+            yield session
+        return
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        await run_in_threadpool(db.close)
+
+async def run_db(session, fn, *args, **kwargs):
+    """Run a sync db function without blocking the event loop.
+
+    On an AsyncSession the function runs through run_sync on the async
+    driver; on a regular Session it runs in the threadpool.
+    """
+    if isinstance(session, Session):
+        return await run_in_threadpool(fn, session, *args, **kwargs)
+    return await session.run_sync(fn, *args, **kwargs)
+
+async def run_in_new_session(fn, *args, bind=None, **kwargs):
+    """Run a sync db function on a short-lived session of its own.
+
+    For work outside a request's dependency-managed session, such as
+    long-lived streams that must not pin a pooled connection. The session
+    is on bind, see read_bind, or the primary. The work is shielded from
+    cancellation: a client disconnecting mid-query would otherwise leave
+    the session unclosed or, with aiosqlite, hand a half-terminated
+    connection back to the pool.
+    """
+    return await asyncio.shield(_run_in_new_session(fn, bind, *args, **kwargs))
+
+async def _run_in_new_session(fn, bind, *args, **kwargs):
+    session = new_session(bind)
+    try:
+        return await run_db(session, fn, *args, **kwargs)
+    finally:
+        await close_session(session)
+
+def sqlite_maintenance():
+    """Checkpoint the WAL and refresh planner statistics on a file database"""
+    if engine.dialect.name != "sqlite" or is_sqlite_memory_url(str(engine.url)):
+        return
+    with engine.connect() as conn:
+        # PASSIVE never blocks readers or writers, so every worker may run it
+        conn.execute(text("PRAGMA wal_checkpoint(PASSIVE)"))
+        conn.execute(text("PRAGMA optimize"))
+
+# Check on startup that the schema is current; init_db_script.py creates and migrates it
 def init_db():
-    Base.metadata.create_all(bind=engine)
+    from app import migrations
+
+    migrations.check_schema(engine)
 
 # Function to reconfigure database for testing
 def configure_test_db(test_engine):
     """Reconfigure the database to use a test engine"""
-    global SessionLocal
+    global engine, SessionLocal
+    from app import migrations
+
     print(f"DEBUG: Configuring test DB. Tables: {Base.metadata.tables.keys()}")
+    engine = test_engine
     SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=test_engine)
-    Base.metadata.create_all(bind=test_engine)
+    migrations.upgrade(test_engine)
+
+def configure_async_db(new_async_engine):
+    """Point the async session factory at a different async engine"""
+    global async_engine, AsyncSessionLocal
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+
+    async_engine = new_async_engine
+    AsyncSessionLocal = async_sessionmaker(
+        bind=new_async_engine, autocommit=False, autoflush=False, expire_on_commit=False
+    )
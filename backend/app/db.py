@@ -1,79 +1,203 @@
-from typing import List, Optional
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+from sqlalchemy import and_, case, delete, func, insert, literal, not_, or_, select, update
 from sqlalchemy.orm import Session
-from app.models import Todo, TodoCreate, TodoUpdate, UserCreate
-from app.schema import TodoModel, User
-from app.auth import get_password_hash
+from app.models import (
+    ExportFormat, Priority, Todo, TodoBatchUpdateItem, TodoCategoryStats, TodoChanges, TodoCreate, TodoFilter,
+    TodoImportItem, TodoPriorityStats, TodoSort, TodoStats, TodoUpdate, UserCreate
+)
+from app.schema import TodoModel, TodoStat, TodoTombstone, User
+from app.auth import get_password_hash, principal_cache
+from app.ids import NIL_ID, new_id
+from app.encoding import JSON, ListEncoder, dumps_json
+import base64
+import csv
+import io
 import time
-import uuid
 
 
-def get_user_by_email(db: Session, email: str):
-    return db.query(User).filter(User.email == email).first()
+class InvalidCursorError(ValueError):
+    """Raised when a pagination cursor cannot be decoded"""
 
-def create_user(db: Session, user: UserCreate):
-    hashed_password = get_password_hash(user.password)
-    db_user = User(
-        id=str(uuid.uuid4()),
-        email=user.email,
-        password_hash=hashed_password
-    )
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    return db_user
-
-def get_todos(db: Session, user_id: str) -> List[Todo]:
-    """Get all todos for a specific user"""
-    db_todos = db.query(TodoModel).filter(TodoModel.user_id == user_id).all()
-    return [
-        Todo(
-            id=todo.id,
-            text=todo.text,
-            completed=todo.completed,
-            createdAt=todo.created_at,
-            dueDate=todo.due_date,
-            priority=todo.priority,
-            category=todo.category,
-            user_id=todo.user_id
+
+class VersionConflictError(Exception):
+    """Raised when a write expects a todos version that is no longer current"""
+
+
+class ChangesPurgedError(Exception):
+    """Raised when the tombstones needed to sync from a revision were purged"""
+
+
+def encode_cursor(created_at: int, todo_id: str) -> str:
+    """Encode a (created_at, id) position as an opaque cursor string"""
+    raw = f"{created_at}:{todo_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[int, str]:
+    """Decode a cursor produced by encode_cursor"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, todo_id = base64.urlsafe_b64decode(padded).decode().split(":", 1)
+        return int(created_at), todo_id
+    except (ValueError, UnicodeDecodeError):
+        raise InvalidCursorError(cursor)
+
+
+PRIORITY_RANK = case(
+    {"low": 1, "medium": 2, "high": 3},
+    value=TodoModel.priority,
+    else_=None,
+)
+
+# Order of the byPriority stats; "" is todos without a priority
+PRIORITY_ORDER = ["low", "medium", "high", ""]
+
+SORT_COLUMNS = {
+    TodoSort.created_asc: [TodoModel.created_at.asc(), TodoModel.id.asc()],
+    TodoSort.created_desc: [TodoModel.created_at.desc(), TodoModel.id.desc()],
+    TodoSort.due_asc: [TodoModel.due_date.asc().nulls_last(), TodoModel.created_at, TodoModel.id],
+    TodoSort.due_desc: [TodoModel.due_date.desc().nulls_last(), TodoModel.created_at, TodoModel.id],
+    TodoSort.priority_asc: [PRIORITY_RANK.asc().nulls_last(), TodoModel.created_at, TodoModel.id],
+    TodoSort.priority_desc: [PRIORITY_RANK.desc().nulls_last(), TodoModel.created_at, TodoModel.id],
+}
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def _apply_filters(query, filters: Optional[TodoFilter]):
+    """Translate a TodoFilter into WHERE clauses on a Query or select()"""
+    if filters is None:
+        return query
+    if filters.completed is not None:
+        query = query.filter(TodoModel.completed == filters.completed)
+    if filters.category is not None:
+        query = query.filter(TodoModel.category == filters.category)
+    if filters.priority is not None:
+        query = query.filter(TodoModel.priority == filters.priority.value)
+    if filters.dueAfter is not None:
+        query = query.filter(TodoModel.due_date >= filters.dueAfter)
+    if filters.dueBefore is not None:
+        query = query.filter(TodoModel.due_date < filters.dueBefore)
+    if filters.overdue is not None:
+        is_overdue = and_(
+            TodoModel.completed == False,
+            TodoModel.due_date.is_not(None),
+            TodoModel.due_date < _now_ms(),
         )
-        for todo in db_todos
+        query = query.filter(is_overdue if filters.overdue else not_(is_overdue))
+    return query
+
+
+def _update_values(todo_update: TodoUpdate) -> dict:
+    """Column values for the fields set on a TodoUpdate"""
+    update_data = todo_update.model_dump(exclude_unset=True, exclude={"id"})
+
+    # Map Pydantic field names to database column names
+    if 'dueDate' in update_data:
+        update_data['due_date'] = update_data.pop('dueDate')
+    if 'priority' in update_data and update_data['priority'] is not None:
+        update_data['priority'] = update_data['priority'].value
+    return update_data
+
+
+# The columns _to_todo reads, for writes that return the rows they touch
+TODO_COLUMNS = (
+    TodoModel.id,
+    TodoModel.text,
+    TodoModel.completed,
+    TodoModel.created_at,
+    TodoModel.due_date,
+    TodoModel.priority,
+    TodoModel.category,
+    TodoModel.user_id,
+)
+
+# Fields whose changes move a todo between todo_stats rows
+COUNTED_FIELDS = {"completed", "category", "priority"}
+
+
+def _owned_todos(db: Session, todo_ids: List[str], user_id: str) -> Dict[str, dict]:
+    """The todos among todo_ids that belong to the user, as id -> TODO_COLUMNS values"""
+    rows = db.execute(
+        select(*TODO_COLUMNS).where(TodoModel.user_id == user_id, TodoModel.id.in_(set(todo_ids)))
+    )
+    return {row.id: row._asdict() for row in rows}
+
+
+def _count_todo(counts: Dict[Tuple[str, str], List[int]], completed, category, priority, amount: int = 1):
+    """Add amount to the todo_stats rows a todo with these values counts towards"""
+    index = 1 if completed else 0
+    for stat_key in (("all", ""), ("category", category or ""), ("priority", priority or "")):
+        counts.setdefault(stat_key, [0, 0])[index] += amount
+
+
+def _write_stats(db: Session, user_id: str, counts: Dict[Tuple[str, str], List[int]], increment: bool = True):
+    """Upsert todo_stats rows, adding counts to them or, with increment=False, replacing them"""
+    rows = [
+        dict(user_id=user_id, dimension=dimension, key=key, open_count=open_count, completed_count=completed_count)
+        for (dimension, key), (open_count, completed_count) in counts.items()
+        if open_count or completed_count or not increment
     ]
+    if not rows:
+        return
+    # Imported here so that only the configured database's dialect is ever loaded
+    if db.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    stmt = dialect_insert(TodoStat)
+    if increment:
+        new_values = {
+            "open_count": TodoStat.open_count + stmt.excluded.open_count,
+            "completed_count": TodoStat.completed_count + stmt.excluded.completed_count,
+        }
+    else:
+        new_values = {"open_count": stmt.excluded.open_count, "completed_count": stmt.excluded.completed_count}
+    db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[TodoStat.user_id, TodoStat.dimension, TodoStat.key], set_=new_values
+        ),
+        rows,
+    )
 
 
-def get_todo(db: Session, todo_id: str, user_id: str) -> Optional[Todo]:
-    """Get a single todo by ID and user"""
-    db_todo = db.query(TodoModel).filter(TodoModel.id == todo_id, TodoModel.user_id == user_id).first()
-    if not db_todo:
-        return None
-    
-    return Todo(
-        id=db_todo.id,
-        text=db_todo.text,
-        completed=db_todo.completed,
-        createdAt=db_todo.created_at,
-        dueDate=db_todo.due_date,
-        priority=db_todo.priority,
-        category=db_todo.category,
-        user_id=db_todo.user_id
+def _bump_todos_version(db: Session, user_id: str, expected_version: Optional[int] = None) -> int:
+    """Increment the user's todos version as part of the current transaction.
+
+    Returns the new version, which writes stamp on the rows they touch. The
+    row lock taken here orders concurrent writers, so revisions commit in order;
+    writes therefore bump first and read any old values they need after.
+    With expected_version, the bump only happens if the version still matches;
+    otherwise the transaction is rolled back and VersionConflictError raised.
+    """
+    stmt = (
+        update(User)
+        .where(User.id == user_id)
+        .values(todos_version=User.todos_version + 1)
+        .returning(User.todos_version)
     )
+    if expected_version is not None:
+        stmt = stmt.where(User.todos_version == expected_version)
+    version = db.execute(stmt).scalar()
+    if version is None and expected_version is not None:
+        db.rollback()
+        raise VersionConflictError(expected_version)
+    # Picked up by app.events after commit to notify live change feeds
+    db.info.setdefault("changed_user_ids", set()).add(user_id)
+    return version or 0
 
 
-def create_todo(db: Session, todo_create: TodoCreate, user_id: str) -> Todo:
-    """Create a new todo for a user"""
-    db_todo = TodoModel(
-        id=str(uuid.uuid4()),
-        text=todo_create.text,
-        completed=False,
-        created_at=int(time.time() * 1000),
-        due_date=todo_create.dueDate,
-        priority=todo_create.priority.value if todo_create.priority else None,
-        category=todo_create.category,
-        user_id=user_id
+def _tombstone_query(revision: int, todo_filter):
+    """INSERT ... SELECT leaving a tombstone for every todo matching todo_filter"""
+    return insert(TodoTombstone).from_select(
+        ["id", "user_id", "revision", "deleted_at"],
+        select(TodoModel.id, TodoModel.user_id, literal(revision), literal(_now_ms())).where(todo_filter),
     )
-    db.add(db_todo)
-    db.commit()
-    db.refresh(db_todo)
-    
+
+
+def _to_todo(db_todo: TodoModel) -> Todo:
     return Todo(
         id=db_todo.id,
         text=db_todo.text,
@@ -86,26 +210,188 @@ def create_todo(db: Session, todo_create: TodoCreate, user_id: str) -> Todo:
     )
 
 
-def update_todo(db: Session, todo_id: str, todo_update: TodoUpdate, user_id: str) -> Optional[Todo]:
-    """Update an existing todo for a user"""
+def _values_to_todo(values: dict) -> Todo:
+    """Todo from a dict of TodoModel column values, e.g. rows about to be inserted"""
+    return Todo(
+        id=values["id"],
+        text=values["text"],
+        completed=values["completed"],
+        createdAt=values["created_at"],
+        dueDate=values["due_date"],
+        priority=values["priority"],
+        category=values["category"],
+        user_id=values["user_id"],
+    )
+
+
+def get_user_by_email(db: Session, email: str):
+    return db.query(User).filter(User.email == email).first()
+
+def create_user(db: Session, user: UserCreate, password_hash: Optional[str] = None):
+    """Insert a user; the returned User is built from the values inserted, not read back"""
+    values = dict(
+        id=new_id(),
+        email=user.email,
+        password_hash=password_hash or get_password_hash(user.password),
+        todos_version=0,
+        purged_revision=0,
+    )
+    db.execute(insert(User), [values])
+    db.commit()
+    return User(**values)
+
+def update_password_hash(db: Session, user_id: str, password_hash: str):
+    """Store a new password hash for a user, e.g. after a rehash on login"""
+    email = db.execute(
+        update(User).where(User.id == user_id).values(password_hash=password_hash).returning(User.email)
+    ).scalar()
+    db.commit()
+    # Bulk UPDATEs skip the mapper events app.auth invalidates cached principals on
+    if email is not None:
+        principal_cache.invalidate_user(email)
+
+def get_todos_version(db: Session, user_id: str) -> int:
+    """Current version of a user's todos, without reading any todo rows"""
+    return db.execute(select(User.todos_version).where(User.id == user_id)).scalar() or 0
+
+def get_todos_versions(db: Session, user_ids: List[str]) -> Dict[str, int]:
+    """Current todos versions of many users in one query"""
+    rows = db.execute(select(User.id, User.todos_version).where(User.id.in_(user_ids)))
+    return {row.id: row.todos_version for row in rows}
+
+# Columns in the field order of models.Todo, so rows encode to the same JSON
+TODO_JSON_COLUMNS = (
+    ("text", TodoModel.text),
+    ("dueDate", TodoModel.due_date),
+    ("priority", TodoModel.priority),
+    ("category", TodoModel.category),
+    ("id", TodoModel.id),
+    ("completed", TodoModel.completed),
+    ("createdAt", TodoModel.created_at),
+    ("user_id", TodoModel.user_id),
+)
+
+
+def todos_json_select(
+    user_id: str, filters: Optional[TodoFilter] = None, sort: TodoSort = TodoSort.created_asc
+):
+    """Column-only select behind the full, unpaginated list of GET /todos"""
+    # Every row has the same user_id, so send it as a constant instead of decoding it per row
+    columns = [literal(user_id) if name == "user_id" else column for name, column in TODO_JSON_COLUMNS]
+    stmt = select(*columns).where(TodoModel.user_id == user_id)
+    return _apply_filters(stmt, filters).order_by(*SORT_COLUMNS[sort])
+
+
+def iter_todos(
+    db: Session,
+    user_id: str,
+    media_type: str = JSON,
+    filters: Optional[TodoFilter] = None,
+    sort: TodoSort = TodoSort.created_asc,
+    chunk_size: int = 1000,
+) -> Iterator[bytes]:
+    """Yield a user's todos encoded as media_type, in chunks, straight from column tuples.
+
+    Skips ORM objects and Pydantic models entirely and fetches rows with
+    yield_per, so memory stays flat however many todos the user has. The
+    JSON is the same bytes as serializing List[Todo].
+    """
+    stmt = todos_json_select(user_id, filters, sort).execution_options(yield_per=chunk_size)
+    encoder = ListEncoder(media_type, [name for name, _ in TODO_JSON_COLUMNS])
+    for rows in db.execute(stmt).partitions():
+        chunk = encoder.rows(rows)
+        if chunk:
+            yield chunk
+    yield encoder.end()
+
+
+# Columns of an export, in file order
+TODO_EXPORT_COLUMNS = (
+    ("id", TodoModel.id),
+    ("text", TodoModel.text),
+    ("completed", TodoModel.completed),
+    ("createdAt", TodoModel.created_at),
+    ("dueDate", TodoModel.due_date),
+    ("priority", TodoModel.priority),
+    ("category", TodoModel.category),
+)
+
+
+def todos_export_select(user_id: str):
+    """Column-only select of a user's todos for export, oldest first"""
+    stmt = select(*[column for _, column in TODO_EXPORT_COLUMNS]).where(TodoModel.user_id == user_id)
+    return stmt.order_by(*SORT_COLUMNS[TodoSort.created_asc])
+
+
+def export_header(export_format: ExportFormat) -> bytes:
+    """What an export starts with before the first row"""
+    if export_format == ExportFormat.csv:
+        return (",".join(name for name, _ in TODO_EXPORT_COLUMNS) + "\n").encode()
+    return b""
+
+
+def encode_export_rows(rows, export_format: ExportFormat) -> bytes:
+    """Encode column tuples as NDJSON lines or CSV records"""
+    names = [name for name, _ in TODO_EXPORT_COLUMNS]
+    if export_format == ExportFormat.csv:
+        out = io.StringIO()
+        writer = csv.writer(out, lineterminator="\n")
+        for row in rows:
+            writer.writerow(
+                "true" if value is True else "false" if value is False else "" if value is None else value
+                for value in row
+            )
+        return out.getvalue().encode()
+    return b"".join(dumps_json(dict(zip(names, row))) + b"\n" for row in rows)
+
+
+def iter_todos_export(
+    db: Session, user_id: str, export_format: ExportFormat, chunk_size: int = 1000
+) -> Iterator[bytes]:
+    """Yield all of a user's todos as NDJSON or CSV, fetched with yield_per"""
+    yield export_header(export_format)
+    stmt = todos_export_select(user_id).execution_options(yield_per=chunk_size)
+    for rows in db.execute(stmt).partitions():
+        yield encode_export_rows(rows, export_format)
+
+
+def get_todos_page(
+    db: Session,
+    user_id: str,
+    limit: int,
+    cursor: Optional[str] = None,
+    filters: Optional[TodoFilter] = None,
+) -> Tuple[List[Todo], Optional[str]]:
+    """Get one page of todos for a user ordered by (created_at, id).
+
+    Returns the page and the cursor for the next page, or None on the last page.
+    """
+    query = _apply_filters(db.query(TodoModel).filter(TodoModel.user_id == user_id), filters)
+    if cursor is not None:
+        created_at, todo_id = decode_cursor(cursor)
+        query = query.filter(
+            or_(
+                TodoModel.created_at > created_at,
+                and_(TodoModel.created_at == created_at, TodoModel.id > todo_id),
+            )
+        )
+    # Fetch one extra row to find out whether another page follows
+    db_todos = query.order_by(TodoModel.created_at, TodoModel.id).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(db_todos) > limit:
+        db_todos = db_todos[:limit]
+        last = db_todos[-1]
+        next_cursor = encode_cursor(last.created_at, last.id)
+    return [_to_todo(todo) for todo in db_todos], next_cursor
+
+
+def get_todo(db: Session, todo_id: str, user_id: str) -> Optional[Todo]:
+    """Get a single todo by ID and user"""
     db_todo = db.query(TodoModel).filter(TodoModel.id == todo_id, TodoModel.user_id == user_id).first()
     if not db_todo:
         return None
     
-    update_data = todo_update.model_dump(exclude_unset=True)
-    
-    # Map Pydantic field names to database column names
-    if 'dueDate' in update_data:
-        update_data['due_date'] = update_data.pop('dueDate')
-    if 'priority' in update_data and update_data['priority'] is not None:
-        update_data['priority'] = update_data['priority'].value
-    
-    for key, value in update_data.items():
-        setattr(db_todo, key, value)
-    
-    db.commit()
-    db.refresh(db_todo)
-    
     return Todo(
         id=db_todo.id,
         text=db_todo.text,
@@ -118,19 +404,336 @@ def update_todo(db: Session, todo_id: str, todo_update: TodoUpdate, user_id: str
     )
 
 
+def create_todo(db: Session, todo_create: TodoCreate, user_id: str) -> Todo:
+    """Create a new todo for a user"""
+    return create_todos(db, [todo_create], user_id)[0]
+
+
+def update_todo(
+    db: Session,
+    todo_id: str,
+    todo_update: TodoUpdate,
+    user_id: str,
+    expected_version: Optional[int] = None,
+) -> Optional[Todo]:
+    """Update an existing todo for a user with one UPDATE ... RETURNING.
+
+    The old values are only read when completed, category or priority
+    change, as todo_stats needs them. With expected_version, raises
+    VersionConflictError unless the user's todos are still at that version.
+    """
+    update_data = _update_values(todo_update)
+    revision = _bump_todos_version(db, user_id, expected_version)
+    owned = TodoModel.id == todo_id, TodoModel.user_id == user_id
+    old = None
+    if COUNTED_FIELDS & update_data.keys():
+        old = db.execute(select(TodoModel.completed, TodoModel.category, TodoModel.priority).where(*owned)).first()
+    db_todo = db.execute(
+        update(TodoModel).where(*owned).values(**update_data, revision=revision).returning(*TODO_COLUMNS)
+    ).first()
+    if db_todo is None:
+        db.rollback()
+        return None
+
+    if old is not None:
+        counts = {}
+        _count_todo(counts, *old, -1)
+        _count_todo(counts, db_todo.completed, db_todo.category, db_todo.priority)
+        _write_stats(db, user_id, counts)
+    db.commit()
+    return _to_todo(db_todo)
+
+
+def _delete_owned_todos(db: Session, todo_filter, user_id: str) -> list:
+    """Delete the user's todos matching todo_filter, leaving tombstones, and commit.
+
+    Returns the deleted rows' (id, completed, category, priority).
+    """
+    todo_filter = and_(TodoModel.user_id == user_id, todo_filter)
+    if not db.execute(_tombstone_query(_bump_todos_version(db, user_id), todo_filter)).rowcount:
+        # Nothing to delete; don't publish a version nobody can observe
+        db.rollback()
+        return []
+    rows = db.execute(
+        delete(TodoModel)
+        .where(todo_filter)
+        .returning(TodoModel.id, TodoModel.completed, TodoModel.category, TodoModel.priority)
+    ).all()
+    counts = {}
+    for row in rows:
+        _count_todo(counts, row.completed, row.category, row.priority, -1)
+    _write_stats(db, user_id, counts)
+    db.commit()
+    return rows
+
+
 def delete_todo(db: Session, todo_id: str, user_id: str) -> bool:
     """Delete a todo by ID and user"""
-    db_todo = db.query(TodoModel).filter(TodoModel.id == todo_id, TodoModel.user_id == user_id).first()
-    if not db_todo:
-        return False
-    
-    db.delete(db_todo)
-    db.commit()
-    return True
+    return bool(_delete_owned_todos(db, TodoModel.id == todo_id, user_id))
 
 
 def delete_completed_todos(db: Session, user_id: str) -> int:
     """Delete all completed todos for a user"""
-    result = db.query(TodoModel).filter(TodoModel.completed == True, TodoModel.user_id == user_id).delete()
+    return len(_delete_owned_todos(db, TodoModel.completed == True, user_id))
+
+
+def _insert_todos(db: Session, rows: List[dict], user_id: str):
+    """Insert todo rows with one executemany INSERT, count them in todo_stats and commit"""
+    db.execute(insert(TodoModel), rows)
+    counts = {}
+    for row in rows:
+        _count_todo(counts, row["completed"], row["category"], row["priority"])
+    _write_stats(db, user_id, counts)
+    db.commit()
+
+
+def create_todos(db: Session, todos_create: List[TodoCreate], user_id: str) -> List[Todo]:
+    """Create many todos for a user with one executemany INSERT and one commit"""
+    now = _now_ms()
+    revision = _bump_todos_version(db, user_id)
+    rows = [
+        dict(
+            id=new_id(),
+            text=todo_create.text,
+            completed=False,
+            # Offset by position so the batch keeps its order in (created_at, id)
+            created_at=now + index,
+            due_date=todo_create.dueDate,
+            priority=todo_create.priority.value if todo_create.priority else None,
+            category=todo_create.category,
+            user_id=user_id,
+            revision=revision,
+        )
+        for index, todo_create in enumerate(todos_create)
+    ]
+    _insert_todos(db, rows, user_id)
+    return [_values_to_todo(row) for row in rows]
+
+
+def import_todos(db: Session, items: List[TodoImportItem], user_id: str) -> int:
+    """Insert one chunk of an import in a single transaction; returns how many were inserted"""
+    now = _now_ms()
+    revision = _bump_todos_version(db, user_id)
+    rows = [
+        dict(
+            id=new_id(),
+            text=item.text,
+            completed=item.completed,
+            created_at=item.createdAt if item.createdAt is not None else now + index,
+            due_date=item.dueDate,
+            priority=item.priority.value if item.priority else None,
+            category=item.category,
+            user_id=user_id,
+            revision=revision,
+        )
+        for index, item in enumerate(items)
+    ]
+    _insert_todos(db, rows, user_id)
+    return len(rows)
+
+
+def update_todos(db: Session, todo_updates: List[TodoBatchUpdateItem], user_id: str) -> Dict[str, Todo]:
+    """Apply many partial updates in one transaction.
+
+    Returns the updated todos keyed by id; ids the user does not own are absent.
+    The todos are read once, under the version bump's lock, and the response
+    is built from those rows and the values written rather than read back.
+    """
+    revision = _bump_todos_version(db, user_id)
+    current = _owned_todos(db, [item.id for item in todo_updates], user_id)
+    counts = {}
+    rows = []
+    for item in todo_updates:
+        values = _update_values(item)
+        if item.id in current and values:
+            rows.append({"id": item.id, **values})
+            todo = current[item.id]
+            _count_todo(counts, todo["completed"], todo["category"], todo["priority"], -1)
+            todo.update(values)
+            _count_todo(counts, todo["completed"], todo["category"], todo["priority"])
+    if not rows:
+        db.rollback()
+        return {todo_id: _values_to_todo(todo) for todo_id, todo in current.items()}
+    # ORM bulk UPDATE by primary key, batched by the set of columns changed
+    db.execute(update(TodoModel), [{**row, "revision": revision} for row in rows])
+    _write_stats(db, user_id, counts)
     db.commit()
-    return result
+    return {todo_id: _values_to_todo(todo) for todo_id, todo in current.items()}
+
+
+def delete_todos(db: Session, todo_ids: List[str], user_id: str) -> Set[str]:
+    """Delete many todos in one statement; returns the ids actually deleted"""
+    return {row.id for row in _delete_owned_todos(db, TodoModel.id.in_(set(todo_ids)), user_id)}
+
+
+def get_changes(db: Session, user_id: str, since: int) -> TodoChanges:
+    """Todos created, changed or deleted after revision `since`.
+
+    Raises ChangesPurgedError if tombstones newer than `since` were purged,
+    in which case the client has to reload the full list.
+    """
+    # Read the high-water mark first so it never runs ahead of the rows returned
+    user = db.execute(
+        select(User.todos_version, User.purged_revision).where(User.id == user_id)
+    ).first()
+    revision, purged_revision = (user.todos_version, user.purged_revision) if user else (0, 0)
+    if since < purged_revision:
+        raise ChangesPurgedError(since)
+
+    db_todos = (
+        db.query(TodoModel)
+        .filter(TodoModel.user_id == user_id, TodoModel.revision > since)
+        .order_by(TodoModel.revision, TodoModel.id)
+        .all()
+    )
+    deleted = db.execute(
+        select(TodoTombstone.id)
+        .where(TodoTombstone.user_id == user_id, TodoTombstone.revision > since)
+        .order_by(TodoTombstone.revision, TodoTombstone.id)
+    ).scalars().all()
+    return TodoChanges(changed=[_to_todo(todo) for todo in db_todos], deleted=deleted, revision=revision)
+
+
+def purge_tombstones(db: Session, older_than: int, batch_size: int = 1000) -> int:
+    """Delete tombstones with deleted_at before `older_than`, one batch per transaction.
+
+    Records the highest purged revision per user so get_changes can tell when
+    a client's sync point is no longer covered. Returns the number purged.
+    """
+    purged = 0
+    while True:
+        batch = db.execute(
+            select(TodoTombstone.id, TodoTombstone.user_id, TodoTombstone.revision)
+            .where(TodoTombstone.deleted_at < older_than)
+            .order_by(TodoTombstone.deleted_at)
+            .limit(batch_size)
+        ).all()
+        if not batch:
+            return purged
+
+        floors: Dict[str, int] = {}
+        for row in batch:
+            floors[row.user_id] = max(floors.get(row.user_id, 0), row.revision)
+        for floor_user_id, floor in floors.items():
+            db.execute(
+                update(User)
+                .where(User.id == floor_user_id, User.purged_revision < floor)
+                .values(purged_revision=floor)
+            )
+        db.execute(delete(TodoTombstone).where(TodoTombstone.id.in_([row.id for row in batch])))
+        db.commit()
+        purged += len(batch)
+        if len(batch) < batch_size:
+            return purged
+
+
+def _recount_todo_stats(db: Session, user_id: str):
+    """A user's todo counts from a GROUP BY over their todos, and as stored in todo_stats"""
+    expected = {("all", ""): [0, 0]}
+    for row in db.execute(
+        select(TodoModel.completed, TodoModel.category, TodoModel.priority, func.count().label("count"))
+        .where(TodoModel.user_id == user_id)
+        .group_by(TodoModel.completed, TodoModel.category, TodoModel.priority)
+    ):
+        _count_todo(expected, row.completed, row.category, row.priority, row.count)
+    stored = {
+        (row.dimension, row.key): [row.open_count, row.completed_count]
+        for row in db.execute(
+            select(TodoStat.dimension, TodoStat.key, TodoStat.open_count, TodoStat.completed_count)
+            .where(TodoStat.user_id == user_id)
+        )
+    }
+    return expected, stored
+
+
+def reconcile_todo_stats(db: Session, user_id: str) -> int:
+    """Recount a user's todos with GROUP BY and repair their todo_stats rows.
+
+    Returns the number of rows whose stored counts were wrong.
+    """
+    expected, stored = _recount_todo_stats(db, user_id)
+    if all(stored.get(key) == counts for key, counts in expected.items()) and all(
+        counts == [0, 0] for key, counts in stored.items() if key not in expected
+    ):
+        # The usual case: nothing to repair, so nothing to lock
+        db.commit()
+        return 0
+    # A no-op write takes the user's row lock, the same one every todo write
+    # takes first, so no write can commit between the recount and the repair
+    db.execute(update(User).where(User.id == user_id).values(todos_version=User.todos_version))
+    expected, stored = _recount_todo_stats(db, user_id)
+
+    _write_stats(
+        db, user_id, {key: counts for key, counts in expected.items() if stored.get(key) != counts}, increment=False
+    )
+    # Rows for categories or priorities no longer in use
+    stale = [key for key in stored if key not in expected]
+    for dimension, key in stale:
+        db.execute(delete(TodoStat).where(
+            TodoStat.user_id == user_id, TodoStat.dimension == dimension, TodoStat.key == key
+        ))
+    db.commit()
+    drifted = [key for key, counts in expected.items() if stored.get(key, [0, 0]) != counts]
+    return len(drifted) + sum(1 for key in stale if stored[key] != [0, 0])
+
+
+def reconcile_all_todo_stats(db: Session, batch_size: int = 500) -> int:
+    """Run reconcile_todo_stats for every user, one transaction per user"""
+    repaired = 0
+    last_id = NIL_ID
+    while True:
+        user_ids = db.execute(
+            select(User.id).where(User.id > last_id).order_by(User.id).limit(batch_size)
+        ).scalars().all()
+        for user_id in user_ids:
+            repaired += reconcile_todo_stats(db, user_id)
+        if len(user_ids) < batch_size:
+            return repaired
+        last_id = user_ids[-1]
+
+
+def get_todo_stats(db: Session, user_id: str) -> TodoStats:
+    """A user's todo counts, read from todo_stats rather than the todos"""
+    # Plain rows rather than entities, so a backfill below is never hidden by the identity map
+    stmt = select(TodoStat.dimension, TodoStat.key, TodoStat.open_count, TodoStat.completed_count).where(
+        TodoStat.user_id == user_id
+    )
+    stats = db.execute(stmt).all()
+    if not any(stat.dimension == "all" for stat in stats):
+        # Todos created before todo_stats existed; count them once
+        reconcile_todo_stats(db, user_id)
+        stats = db.execute(stmt).all()
+    # The one clock-dependent figure: an index-only range count over open todos
+    overdue = db.execute(
+        select(func.count()).select_from(TodoModel).where(
+            TodoModel.user_id == user_id,
+            TodoModel.completed == False,
+            TodoModel.due_date < _now_ms(),
+        )
+    ).scalar()
+
+    total = next(stat for stat in stats if stat.dimension == "all")
+    by_category = sorted(
+        (stat for stat in stats if stat.dimension == "category" and (stat.open_count or stat.completed_count)),
+        key=lambda stat: (stat.key == "", stat.key),
+    )
+    by_priority = sorted(
+        (stat for stat in stats if stat.dimension == "priority" and (stat.open_count or stat.completed_count)),
+        key=lambda stat: PRIORITY_ORDER.index(stat.key),
+    )
+    return TodoStats(
+        total=total.open_count + total.completed_count,
+        open=total.open_count,
+        completed=total.completed_count,
+        overdue=overdue,
+        byCategory=[
+            TodoCategoryStats(category=stat.key or None, open=stat.open_count, completed=stat.completed_count)
+            for stat in by_category
+        ],
+        byPriority=[
+            TodoPriorityStats(
+                priority=Priority(stat.key) if stat.key else None, open=stat.open_count, completed=stat.completed_count
+            )
+            for stat in by_priority
+        ],
+    )
@@ -0,0 +1,74 @@
+"""
+Awaitable versions of the functions in app.db.
+
+Each wrapper takes either an AsyncSession or a regular Session as its first
+argument and runs the matching sync function through database.run_db, so
+the query logic lives in one place and never blocks the event loop.
+"""
+import functools
+from sqlalchemy.orm import Session
+from app import db, group_commit
+from app.database import run_db
+from app.encoding import JSON, ListEncoder
+from app.models import ExportFormat, TodoSort
+
+
+def _awaitable(fn):
+    @functools.wraps(fn)
+    async def wrapper(session, *args, **kwargs):
+        return await run_db(session, fn, *args, **kwargs)
+    return wrapper
+
+
+def _awaitable_write(fn):
+    """Like _awaitable, but coalesced with concurrent writes when GROUP_COMMIT is on"""
+    @functools.wraps(fn)
+    async def wrapper(session, *args, **kwargs):
+        if group_commit.GROUP_COMMIT:
+            if session.in_transaction():
+                # Don't sit on a pooled connection while the batch waits for one
+                await run_db(session, Session.close)
+            return await group_commit.committer.submit(fn, *args, **kwargs)
+        return await run_db(session, fn, *args, **kwargs)
+    return wrapper
+
+
+get_user_by_email = _awaitable(db.get_user_by_email)
+create_user = _awaitable_write(db.create_user)
+update_password_hash = _awaitable_write(db.update_password_hash)
+get_todos_version = _awaitable(db.get_todos_version)
+get_todos_page = _awaitable(db.get_todos_page)
+get_todo = _awaitable(db.get_todo)
+create_todo = _awaitable_write(db.create_todo)
+update_todo = _awaitable_write(db.update_todo)
+delete_todo = _awaitable_write(db.delete_todo)
+delete_completed_todos = _awaitable_write(db.delete_completed_todos)
+create_todos = _awaitable_write(db.create_todos)
+import_todos = _awaitable_write(db.import_todos)
+update_todos = _awaitable_write(db.update_todos)
+delete_todos = _awaitable_write(db.delete_todos)
+get_changes = _awaitable(db.get_changes)
+get_todo_stats = _awaitable(db.get_todo_stats)
+
+
+async def iter_todos(
+    session, user_id, media_type=JSON, filters=None, sort=TodoSort.created_asc, chunk_size=1000
+):
+    """Async counterpart of db.iter_todos for an AsyncSession"""
+    stmt = db.todos_json_select(user_id, filters, sort).execution_options(yield_per=chunk_size)
+    encoder = ListEncoder(media_type, [name for name, _ in db.TODO_JSON_COLUMNS])
+    result = await session.stream(stmt)
+    async for rows in result.partitions():
+        chunk = encoder.rows(rows)
+        if chunk:
+            yield chunk
+    yield encoder.end()
+
+
+async def iter_todos_export(session, user_id, export_format: ExportFormat, chunk_size=1000):
+    """Async counterpart of db.iter_todos_export for an AsyncSession"""
+    yield db.export_header(export_format)
+    stmt = db.todos_export_select(user_id).execution_options(yield_per=chunk_size)
+    result = await session.stream(stmt)
+    async for rows in result.partitions():
+        yield db.encode_export_rows(rows, export_format)
@@ -0,0 +1,149 @@
+"""
+Response encodings, chosen per request from the Accept header.
+
+JSON is the default. Two more compact encodings are offered:
+
+- application/vnd.calmly-list.columnar+json: JSON in which every
+  non-empty array of objects is sent as {"fields": [...], "rows": [[...]]},
+  so field names appear once per array instead of once per todo.
+- application/msgpack: the same document as the JSON, in MessagePack.
+  Needs the msgpack extra; without it the header is ignored.
+
+Routes of a router with route_class=NegotiatedRoute have their JSON
+responses re-encoded; the GET /todos stream encodes rows directly through
+ListEncoder. Errors are always JSON.
+"""
+import json
+from typing import List, Optional
+from fastapi.responses import StreamingResponse
+from fastapi.routing import APIRoute
+
+try:
+    import orjson
+except ImportError:  # optional speedup; the stdlib encoder gives identical bytes
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # optional; without it application/msgpack isn't offered
+    msgpack = None
+
+JSON = "application/json"
+COLUMNAR_JSON = "application/vnd.calmly-list.columnar+json"
+MSGPACK = "application/msgpack"
+
+# Other spellings clients send for the offered types
+ALIASES = {"application/x-msgpack": MSGPACK}
+
+OFFERED = (JSON, COLUMNAR_JSON) + ((MSGPACK,) if msgpack is not None else ())
+
+
+def dumps_json(obj) -> bytes:
+    """Compact UTF-8 JSON, byte-for-byte what FastAPI's JSON responses produce"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def loads_json(data: bytes):
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def negotiate(accept: Optional[str]) -> str:
+    """The offered media type the Accept header ranks highest, the first listed on ties.
+
+    JSON when the header offers none of them, wildcards included.
+    """
+    best, best_q = JSON, 0.0
+    for part in (accept or "").split(","):
+        media_type, *params = [item.strip() for item in part.split(";")]
+        media_type = ALIASES.get(media_type.lower(), media_type.lower())
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if media_type in OFFERED and q > best_q:
+            best, best_q = media_type, q
+    return best
+
+
+def to_columns(data):
+    """data with every non-empty array of objects turned into {"fields", "rows"}"""
+    if isinstance(data, dict):
+        return {key: to_columns(value) for key, value in data.items()}
+    if isinstance(data, list):
+        if data and all(isinstance(item, dict) for item in data):
+            fields = list(dict.fromkeys(key for item in data for key in item))
+            return {"fields": fields, "rows": [[to_columns(item.get(field)) for field in fields] for item in data]}
+        return [to_columns(item) for item in data]
+    return data
+
+
+def encode(data, media_type: str) -> bytes:
+    """Encode JSON-compatible data as media_type"""
+    if media_type == MSGPACK:
+        return msgpack.packb(data)
+    if media_type == COLUMNAR_JSON:
+        return dumps_json(to_columns(data))
+    return dumps_json(data)
+
+
+class ListEncoder:
+    """Encodes a list of objects, given in chunks of row tuples, as media_type.
+
+    JSON and columnar JSON are written as the rows arrive. MessagePack puts
+    the array's length first, so it is only written by end().
+    """
+
+    def __init__(self, media_type: str, fields: List[str]):
+        self.media_type = media_type
+        self.fields = list(fields)
+        self.count = 0
+        self._packed = []
+
+    def rows(self, rows) -> bytes:
+        first = self.count == 0
+        self.count += len(rows)
+        if self.media_type == MSGPACK:
+            self._packed.extend(msgpack.packb(dict(zip(self.fields, row))) for row in rows)
+            return b""
+        if self.media_type == COLUMNAR_JSON:
+            chunk = dumps_json([tuple(row) for row in rows])[1:-1]
+            if first:
+                return b'{"fields":' + dumps_json(self.fields) + b',"rows":[' + chunk
+            return b"," + chunk
+        chunk = dumps_json([dict(zip(self.fields, row)) for row in rows])[1:-1]
+        return b"[" + chunk if first else b"," + chunk
+
+    def end(self) -> bytes:
+        if self.media_type == MSGPACK:
+            return msgpack.Packer().pack_array_header(self.count) + b"".join(self._packed)
+        if self.count == 0:
+            return b"[]"
+        return b"]}" if self.media_type == COLUMNAR_JSON else b"]"
+
+
+class NegotiatedRoute(APIRoute):
+    """Route whose JSON responses are re-encoded as the request's Accept header prefers"""
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def negotiated_handler(request):
+            response = await handler(request)
+            if isinstance(response, StreamingResponse) or response.media_type != JSON or not response.body:
+                return response
+            response.headers.add_vary_header("Accept")
+            media_type = negotiate(request.headers.get("accept"))
+            if media_type != JSON:
+                response.body = encode(loads_json(response.body), media_type)
+                response.media_type = media_type
+                response.headers["Content-Type"] = media_type
+                response.headers["Content-Length"] = str(len(response.body))
+            return response
+
+        return negotiated_handler
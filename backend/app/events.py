@@ -0,0 +1,179 @@
+"""
+Live change feed for a user's todos.
+
+Writes in app/db.py tag their session with the users whose todos changed;
+after the commit, ChangeBroker wakes that user's open streams in this
+worker. Writes made by other workers are picked up by a relay task that
+polls users.todos_version for every subscribed user in one query, so the
+database itself is the cross-worker channel. Streams then send whatever
+db.get_changes reports since the last revision they delivered, which also
+makes resuming from Last-Event-ID exact.
+"""
+import asyncio
+import contextvars
+import logging
+import os
+import threading
+from typing import Dict, Optional, Set
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app import database, db
+
+logger = logging.getLogger(__name__)
+
+CHANGE_FEED_HEARTBEAT_SECONDS = float(os.getenv("CHANGE_FEED_HEARTBEAT_SECONDS", "15"))
+CHANGE_FEED_RELAY_INTERVAL_SECONDS = float(os.getenv("CHANGE_FEED_RELAY_INTERVAL_SECONDS", "1"))
+CHANGE_FEED_MAX_CONNECTIONS_PER_USER = int(os.getenv("CHANGE_FEED_MAX_CONNECTIONS_PER_USER", "5"))
+
+
+class TooManyConnectionsError(Exception):
+    """Raised when a user already has the maximum number of open streams"""
+
+
+class ChangeBroker:
+    """In-process pub/sub of "this user's todos changed" notifications"""
+
+    def __init__(self, max_connections_per_user: int, relay_interval_seconds: float):
+        self.max_connections_per_user = max_connections_per_user
+        self.relay_interval_seconds = relay_interval_seconds
+        self._subscribers: Dict[str, Set[asyncio.Event]] = {}
+        self._known_versions: Dict[str, int] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._relay_task: Optional[asyncio.Task] = None
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id: str) -> asyncio.Event:
+        """Register a stream; must be called from the event loop"""
+        with self._lock:
+            subscribers = self._subscribers.setdefault(user_id, set())
+            if len(subscribers) >= self.max_connections_per_user:
+                raise TooManyConnectionsError(user_id)
+            wakeup = asyncio.Event()
+            subscribers.add(wakeup)
+        self._loop = asyncio.get_running_loop()
+        if self.relay_interval_seconds > 0 and (self._relay_task is None or self._relay_task.done()):
+            # Fresh context, so the relay's queries aren't counted against this request
+            self._relay_task = asyncio.create_task(self._relay(), context=contextvars.Context())
+        return wakeup
+
+    def unsubscribe(self, user_id: str, wakeup: asyncio.Event):
+        with self._lock:
+            subscribers = self._subscribers.get(user_id)
+            if subscribers is None:
+                return
+            subscribers.discard(wakeup)
+            if not subscribers:
+                del self._subscribers[user_id]
+                self._known_versions.pop(user_id, None)
+            idle = not self._subscribers
+        if idle and self._relay_task is not None:
+            self._relay_task.cancel()
+            self._relay_task = None
+
+    def connection_count(self, user_id: str) -> int:
+        with self._lock:
+            return len(self._subscribers.get(user_id, ()))
+
+    def publish(self, user_id: str):
+        """Wake the user's streams; safe to call from any thread"""
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        with self._lock:
+            if user_id not in self._subscribers:
+                return
+        loop.call_soon_threadsafe(self._wake, user_id)
+
+    def _wake(self, user_id: str):
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+        for wakeup in subscribers:
+            wakeup.set()
+
+    async def _relay(self):
+        """Notice writes committed by other workers"""
+        while True:
+            await asyncio.sleep(self.relay_interval_seconds)
+            with self._lock:
+                user_ids = list(self._subscribers)
+            if not user_ids:
+                continue
+            try:
+                versions = await database.run_in_new_session(db.get_todos_versions, user_ids)
+            except Exception:
+                logger.exception("Change feed relay poll failed")
+                continue
+            for user_id, version in versions.items():
+                if version != self._known_versions.get(user_id):
+                    self._known_versions[user_id] = version
+                    self._wake(user_id)
+
+    def stop(self):
+        if self._relay_task is not None:
+            self._relay_task.cancel()
+            self._relay_task = None
+
+
+broker = ChangeBroker(CHANGE_FEED_MAX_CONNECTIONS_PER_USER, CHANGE_FEED_RELAY_INTERVAL_SECONDS)
+
+
+def changes_committed(user_ids):
+    """Keep the users' reads on the primary for a while and wake their change streams"""
+    for user_id in user_ids:
+        database.replicas.mark_write(user_id)
+        broker.publish(user_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_committed_changes(session):
+    changed_user_ids = session.info.pop("changed_user_ids", ())
+    deferred = session.info.get("publish_after_commit")
+    if deferred is not None:
+        # Only a savepoint of a group commit was released; see app.group_commit
+        deferred.update(changed_user_ids)
+        return
+    changes_committed(changed_user_ids)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rolled_back_changes(session):
+    session.info.pop("changed_user_ids", None)
+
+
+def _format_event(event_type: str, data: str, event_id: Optional[int] = None) -> bytes:
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event_type}")
+    lines.append(f"data: {data}")
+    return ("\n".join(lines) + "\n\n").encode()
+
+
+async def change_stream(user_id: str, since: Optional[int], wakeup: asyncio.Event):
+    """Server-Sent Events for one subscribed stream.
+
+    Sends a "changes" event (a TodoChanges payload, id = revision) whenever
+    the user's todos move past the last revision delivered, a "reset" event
+    when the resume point is too old to replay, and a comment line as
+    heartbeat when nothing happened for CHANGE_FEED_HEARTBEAT_SECONDS.
+    """
+    if since is None:
+        since = await database.run_in_new_session(db.get_todos_version, user_id)
+    # Tell the client where the stream starts so it can resume from here
+    yield b"retry: 3000\n" + _format_event("ready", str(since), event_id=since)
+    while True:
+        try:
+            changes = await database.run_in_new_session(db.get_changes, user_id, since)
+        except db.ChangesPurgedError:
+            since = await database.run_in_new_session(db.get_todos_version, user_id)
+            yield _format_event("reset", str(since), event_id=since)
+            continue
+        if changes.revision > since:
+            since = changes.revision
+            yield _format_event("changes", changes.model_dump_json(), event_id=since)
+
+        try:
+            await asyncio.wait_for(wakeup.wait(), timeout=CHANGE_FEED_HEARTBEAT_SECONDS)
+        except asyncio.TimeoutError:
+            yield b": heartbeat\n\n"
+        wakeup.clear()
@@ -0,0 +1,148 @@
+"""
+Group commit: coalesce concurrent writes into shared transactions.
+
+With GROUP_COMMIT enabled, the write wrappers in app.db_async hand their
+db function to GroupCommitter instead of running it on the request's
+session. Writes arriving within GROUP_COMMIT_MAX_DELAY_MS of the first one
+in a batch, up to GROUP_COMMIT_MAX_BATCH_SIZE of them, run one after another
+on a single connection, each in a SAVEPOINT of its own, and are made
+durable by one COMMIT. The db functions are unchanged: their commit()
+only releases their savepoint and a failing write rolls back to it, so
+each request still gets its own result or error, once the whole batch is
+committed. If that final COMMIT fails, every write in the batch fails with
+it.
+
+This mostly pays off on SQLite, where every commit is an fsync and writers
+take turns on one database lock anyway. Batches run one at a time per
+worker, so the next batch fills while the current one commits.
+"""
+import asyncio
+import os
+import time
+from typing import List, Optional, Set
+from starlette.concurrency import run_in_threadpool
+from app import database, events, metrics
+
+GROUP_COMMIT = os.getenv("GROUP_COMMIT", "false").lower() in ("1", "true", "yes")
+GROUP_COMMIT_MAX_DELAY_SECONDS = float(os.getenv("GROUP_COMMIT_MAX_DELAY_MS", "2")) / 1000
+GROUP_COMMIT_MAX_BATCH_SIZE = int(os.getenv("GROUP_COMMIT_MAX_BATCH_SIZE", "64"))
+
+
+class _Write:
+    __slots__ = ("fn", "args", "kwargs", "future", "ok", "result")
+
+    def __init__(self, fn, args, kwargs, future: asyncio.Future):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future = future
+        self.ok = False
+        self.result = None
+
+
+class GroupCommitter:
+    """Queues sync db write functions and commits them in batches"""
+
+    def __init__(self, max_delay: float, max_batch_size: int):
+        self.max_delay = max_delay
+        self.max_batch_size = max_batch_size
+        self._pending: List[_Write] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def submit(self, fn, *args, **kwargs):
+        """Run fn(session, *args, **kwargs) in the next batch and return its result once committed"""
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._loop is not loop:
+            self._loop = loop
+            self._pending = []
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+        write = _Write(fn, args, kwargs, loop.create_future())
+        self._pending.append(write)
+        self._wakeup.set()
+        # The batch carries on without us if the request goes away
+        return await asyncio.shield(write.future)
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            # Give other writes up to max_delay to join the first one
+            deadline = time.monotonic() + self.max_delay
+            while len(self._pending) < self.max_batch_size:
+                self._wakeup.clear()
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            self._wakeup.clear()
+            while self._pending:
+                batch = self._pending[:self.max_batch_size]
+                del self._pending[:self.max_batch_size]
+                await self._commit(batch)
+
+    async def _commit(self, batch: List[_Write]):
+        metrics.GROUP_COMMIT_BATCH_SIZE.observe(len(batch))
+        try:
+            if database.USE_ASYNC_DB:
+                database.get_async_sessionmaker()
+                async with database.async_engine.connect() as connection:
+                    await connection.run_sync(_run_batch, batch)
+            else:
+                await run_in_threadpool(_run_batch_on_new_connection, batch)
+        except Exception as e:
+            for write in batch:
+                write.ok, write.result = False, e
+        for write in batch:
+            if write.future.done():
+                continue
+            if write.ok:
+                write.future.set_result(write.result)
+            else:
+                write.future.set_exception(write.result)
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+def _run_batch_on_new_connection(batch: List[_Write]):
+    with database.SessionLocal.kw["bind"].connect() as connection:
+        _run_batch(connection, batch)
+
+
+def _run_batch(connection, batch: List[_Write]):
+    """Run each write in a savepoint on connection, then commit them all"""
+    changed_user_ids: Set[str] = set()
+    connection.begin()
+    if connection.dialect.name == "sqlite":
+        # pysqlite only opens a transaction before DML; a SAVEPOINT outside
+        # one would start its own and commit on RELEASE. IMMEDIATE takes
+        # the write lock up front rather than upgrading to it mid-batch.
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+    # Lock users rows in one order, so batches from different workers can't deadlock
+    for write in sorted(batch, key=lambda write: write.kwargs.get("user_id") or ""):
+        session = database.SessionLocal(
+            bind=connection,
+            join_transaction_mode="create_savepoint",
+            # app.events publishes these once the batch commits, not per savepoint
+            info={"publish_after_commit": changed_user_ids},
+        )
+        try:
+            write.result = write.fn(session, *write.args, **write.kwargs)
+            write.ok = True
+        except Exception as e:
+            session.rollback()
+            write.result = e
+        finally:
+            session.close()
+    connection.commit()
+    events.changes_committed(changed_user_ids)
+
+
+committer = GroupCommitter(GROUP_COMMIT_MAX_DELAY_SECONDS, GROUP_COMMIT_MAX_BATCH_SIZE)
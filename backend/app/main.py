@@ -1,7 +1,11 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from app import admission, compression, group_commit, metrics, profiling
 from app.api import router
+from app.auth import password_hasher
 from app.database import init_db
+from app.events import broker
+from app.tasks import start_background_tasks, stop_background_tasks
 
 app = FastAPI(
     title="Calmly List API",
@@ -9,6 +13,9 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# Innermost, so requests it turns away still get CORS headers and are measured
+app.add_middleware(admission.AdmissionMiddleware, routes=[*app.routes, *router.routes, *metrics.router.routes])
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -16,11 +23,34 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "X-Profile-Id"],
 )
 
+if compression.RESPONSE_COMPRESSION:
+    # Inside profiling and metrics, so compression time shows up in both
+    app.add_middleware(compression.CompressionMiddleware)
+
+app.add_middleware(profiling.ProfilingMiddleware)
+
+# Outermost, so recorded latency covers every other middleware
+app.add_middleware(metrics.MetricsMiddleware, routes=[*app.routes, *router.routes, *metrics.router.routes])
+
 # Initialize database on startup
 @app.on_event("startup")
 def startup_event():
     init_db()
 
+@app.on_event("startup")
+async def start_tasks():
+    start_background_tasks()
+
+@app.on_event("shutdown")
+def shutdown_event():
+    stop_background_tasks()
+    group_commit.committer.stop()
+    broker.stop()
+    password_hasher.shutdown()
+    metrics.mark_process_dead()
+
 app.include_router(router)
+app.include_router(metrics.router)
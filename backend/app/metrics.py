@@ -0,0 +1,183 @@
+"""
+Prometheus metrics for requests, database queries and password hashing.
+
+Every request is timed per route template by MetricsMiddleware, which also
+collects the database queries it ran through the engine cursor hooks
+below. With several workers, point PROMETHEUS_MULTIPROC_DIR at an empty
+directory shared by all of them before they start: each worker then writes
+its samples there and /metrics on any worker reports the aggregate.
+"""
+import os
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Optional
+from fastapi import APIRouter, Response
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess,
+)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.concurrency import run_in_threadpool
+from starlette.routing import Match
+
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+# Label for requests that match no route, so unknown paths can't blow up cardinality
+UNMATCHED_ROUTE = "<unmatched>"
+
+REQUEST_DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+QUERIES_PER_REQUEST_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+PASSWORD_HASH_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "HTTP requests by route and status", ["method", "route", "status"]
+)
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Time to send the complete response",
+    ["method", "route"], buckets=REQUEST_DURATION_BUCKETS,
+)
+HTTP_REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "Requests currently being served",
+    ["method", "route"], multiprocess_mode="livesum",
+)
+DB_QUERY_DURATION = Histogram(
+    "db_query_duration_seconds", "Time per database query; route is empty outside requests",
+    ["route"], buckets=QUERY_DURATION_BUCKETS,
+)
+DB_QUERIES_PER_REQUEST = Histogram(
+    "db_queries_per_request", "Database queries run while serving one request",
+    ["route"], buckets=QUERIES_PER_REQUEST_BUCKETS,
+)
+DB_TIME_PER_REQUEST = Histogram(
+    "db_time_per_request_seconds", "Time spent in database queries while serving one request",
+    ["route"], buckets=REQUEST_DURATION_BUCKETS,
+)
+PASSWORD_HASH_DURATION = Histogram(
+    "password_hash_duration_seconds", "Argon2 hash or verify time, including the wait for the pool",
+    ["operation"], buckets=PASSWORD_HASH_BUCKETS,
+)
+PASSWORD_HASH_REJECTED = Counter(
+    "password_hash_rejected_total", "Hash or verify calls refused because the pool was full", ["operation"]
+)
+GROUP_COMMIT_BATCH_SIZE = Histogram(
+    "group_commit_batch_size", "Writes committed together by one group commit",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256),
+)
+ADMISSION_REJECTED = Counter(
+    "admission_rejected_total", "Requests turned away by admission control", ["route_class", "reason"]
+)
+DB_READ_ROUTING = Counter(
+    "db_read_routing_total", "Read-only sessions by where they were routed, when replicas are configured",
+    ["target", "reason"],
+)
+
+
+@dataclass
+class RequestStats:
+    route: str
+    queries: int = 0
+    query_seconds: float = 0.0
+
+
+# Set for the duration of a request; copied into threadpool calls and tasks it starts
+_request_stats: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started_at", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _record_query_time(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started_at"].pop()
+    stats = _request_stats.get()
+    DB_QUERY_DURATION.labels(stats.route if stats else "").observe(elapsed)
+    if stats is not None:
+        stats.queries += 1
+        stats.query_seconds += elapsed
+
+
+@event.listens_for(Engine, "handle_error")
+def _discard_query_timer(exception_context):
+    connection = exception_context.connection
+    if connection is not None and connection.info.get("query_started_at"):
+        connection.info["query_started_at"].pop()
+
+
+def route_template(routes, scope) -> str:
+    """The path template of the route serving scope, e.g. /todos/{id}"""
+    partial = None
+    for route in routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+        if match == Match.PARTIAL and partial is None:
+            partial = route.path
+    return partial or UNMATCHED_ROUTE
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording count, latency and in-flight requests per route.
+
+    The route is resolved up front against `routes` so the in-flight gauge
+    can be labelled before the request is handed on.
+    """
+
+    def __init__(self, app, routes):
+        self.app = app
+        self.routes = [route for route in routes if hasattr(route, "path")]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = route_template(self.routes, scope)
+        stats = RequestStats(route=route)
+        token = _request_stats.set(stats)
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        in_progress = HTTP_REQUESTS_IN_PROGRESS.labels(method, route)
+        in_progress.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            HTTP_REQUEST_DURATION.labels(method, route).observe(time.perf_counter() - start)
+            HTTP_REQUESTS.labels(method, route, str(status_code)).inc()
+            DB_QUERIES_PER_REQUEST.labels(route).observe(stats.queries)
+            DB_TIME_PER_REQUEST.labels(route).observe(stats.query_seconds)
+            in_progress.dec()
+            _request_stats.reset(token)
+
+
+def render_metrics() -> bytes:
+    """All metrics in Prometheus text format, summed over workers in multiprocess mode"""
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+def mark_process_dead(pid: Optional[int] = None):
+    """Drop a worker's live gauges, this one's by default, from the shared multiprocess directory"""
+    if PROMETHEUS_MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid or os.getpid())
+
+
+router = APIRouter()
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(await run_in_threadpool(render_metrics), media_type=CONTENT_TYPE_LATEST)
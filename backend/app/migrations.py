@@ -0,0 +1,324 @@
+"""
+Versioned schema migrations.
+
+The schema version is kept in the one-row schema_version table. On
+startup each worker only reads it (check_schema) and refuses to start if
+it is behind; `python init_db_script.py` (upgrade) brings the database up
+to date, holding a lock so that concurrent runs wait for each other: an
+advisory lock on Postgres, a lock file next to the database on SQLite.
+
+A new database is created from the models and stamped with the latest
+version. An existing one runs every migration above its version, each in
+a transaction of its own that also records the new version. Migrations
+carry their own DDL and SQL rather than using the models or app.db, so
+that they keep doing the same thing as those change. Migrations
+that rewrite many rows should use backfill(), which commits after each
+batch so the app's writes can interleave; such a migration must cope with
+being run again after an interruption.
+"""
+import fcntl
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+from sqlalchemy import (
+    BigInteger, Boolean, Column, ForeignKey, Index, Integer, LargeBinary, MetaData, String, Table, Uuid,
+    case, delete, func, insert, inspect, literal, select, union_all, update,
+)
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.schema import CreateColumn
+from app.ids import CompactUUID
+from app.schema import Base
+
+schema_version = Table("schema_version", MetaData(), Column("version", Integer, nullable=False))
+
+# The tables as migrations 1-3 leave them. Frozen: a later change to the
+# models comes with a migration of its own, which must find the schema
+# exactly as these made it.
+v3 = MetaData()
+v3_users = Table(
+    "users", v3,
+    Column("id", CompactUUID, primary_key=True),
+    Column("email", String, nullable=False),
+    Column("password_hash", String, nullable=False),
+    Column("todos_version", BigInteger, nullable=False, server_default="0"),
+    Column("purged_revision", BigInteger, nullable=False, server_default="0"),
+    Index("ix_users_email", "email", unique=True),
+)
+v3_todos = Table(
+    "todos", v3,
+    Column("id", CompactUUID, primary_key=True),
+    Column("text", String, nullable=False),
+    Column("completed", Boolean, nullable=False),
+    Column("created_at", BigInteger, nullable=False),
+    Column("due_date", BigInteger),
+    Column("priority", String),
+    Column("category", String),
+    Column("user_id", CompactUUID, ForeignKey("users.id")),
+    Column("revision", BigInteger, nullable=False, server_default="0"),
+    Index("ix_todos_user_created", "user_id", "created_at", "id"),
+    Index("ix_todos_user_completed", "user_id", "completed"),
+    Index("ix_todos_user_due", "user_id", "due_date"),
+    Index("ix_todos_user_category", "user_id", "category"),
+    Index("ix_todos_user_revision", "user_id", "revision"),
+    Index("ix_todos_user_open_due", "user_id", "completed", "due_date"),
+)
+Table(
+    "todo_tombstones", v3,
+    Column("id", CompactUUID, primary_key=True),
+    Column("user_id", CompactUUID, ForeignKey("users.id"), nullable=False),
+    Column("revision", BigInteger, nullable=False),
+    Column("deleted_at", BigInteger, nullable=False),
+    Index("ix_todo_tombstones_user_revision", "user_id", "revision"),
+    Index("ix_todo_tombstones_deleted_at", "deleted_at"),
+)
+v3_todo_stats = Table(
+    "todo_stats", v3,
+    Column("user_id", CompactUUID, ForeignKey("users.id"), primary_key=True),
+    Column("dimension", String, primary_key=True),
+    Column("key", String, primary_key=True),
+    Column("open_count", BigInteger, nullable=False, server_default="0"),
+    Column("completed_count", BigInteger, nullable=False, server_default="0"),
+)
+
+# Any constant shared by every process running migrations against the database
+POSTGRES_LOCK_KEY = 7_254_118_339
+
+
+@dataclass
+class Migration:
+    version: int
+    description: str
+    upgrade: Callable[..., None]  # called with a Connection inside a transaction
+
+
+def backfill(connection, key_column, apply: Callable[..., None], batch_size: int = 500):
+    """Call apply(connection, keys) for batches of key_column values in order, committing after each.
+
+    Short transactions keep the table writable by the app while a large
+    backfill runs. The transaction is open again when this returns.
+    """
+    last_key = None
+    while True:
+        query = select(key_column).order_by(key_column).limit(batch_size)
+        if last_key is not None:
+            query = query.where(key_column > last_key)
+        keys = connection.execute(query).scalars().all()
+        if keys:
+            apply(connection, keys)
+        connection.commit()
+        _begin(connection)
+        if len(keys) < batch_size:
+            return
+        last_key = keys[-1]
+
+
+def _columns(inspector, table) -> List[str]:
+    """Names of the table's columns that the database has"""
+    existing = {column["name"] for column in inspector.get_columns(table.name)}
+    return [column.name for column in table.columns if column.name in existing]
+
+
+def _id_columns(inspector, table) -> List[str]:
+    return [name for name in _columns(inspector, table) if isinstance(table.c[name].type, CompactUUID)]
+
+
+def _uuid_blob(value):
+    return value if value is None or isinstance(value, bytes) else uuid.UUID(value).bytes
+
+
+def _compact_ids(connection):
+    """Convert text ids to CompactUUID columns, keeping their values.
+
+    Runs first, so that later migrations create tables whose foreign keys
+    match users.id. SQLite can't change a column's type, so its tables are
+    rebuilt; the old tables' pages are reused as the database grows, or
+    given back to the filesystem by a VACUUM. Postgres columns are altered
+    to uuid.
+    """
+    inspector = inspect(connection)
+    id_type = next(column["type"] for column in inspector.get_columns("users") if column["name"] == "id")
+    if isinstance(id_type, (LargeBinary, Uuid)):
+        return
+    tables = [table for table in v3.sorted_tables if inspector.has_table(table.name)]
+
+    if connection.dialect.name == "postgresql":
+        # Both sides of a foreign key must change type together, so drop and re-add them
+        foreign_keys = [(table.name, fk) for table in tables for fk in inspector.get_foreign_keys(table.name)]
+        for table_name, fk in foreign_keys:
+            connection.exec_driver_sql(f'ALTER TABLE "{table_name}" DROP CONSTRAINT "{fk["name"]}"')
+        for table in tables:
+            alterations = [
+                f'ALTER COLUMN "{name}" TYPE uuid USING "{name}"::uuid' for name in _id_columns(inspector, table)
+            ]
+            connection.exec_driver_sql(f'ALTER TABLE "{table.name}" {", ".join(alterations)}')
+        for table_name, fk in foreign_keys:
+            columns = ", ".join(f'"{name}"' for name in fk["constrained_columns"])
+            referred = ", ".join(f'"{name}"' for name in fk["referred_columns"])
+            connection.exec_driver_sql(
+                f'ALTER TABLE "{table_name}" ADD CONSTRAINT "{fk["name"]}" '
+                f'FOREIGN KEY ({columns}) REFERENCES "{fk["referred_table"]}" ({referred})'
+            )
+        return
+
+    connection.connection.driver_connection.create_function("uuid_blob", 1, _uuid_blob, deterministic=True)
+    columns = {table.name: _columns(inspector, table) for table in tables}
+    id_columns = {table.name: set(_id_columns(inspector, table)) for table in tables}
+    for table in tables:
+        # Index names are global, so the new tables' indexes need them back
+        for index in inspector.get_indexes(table.name):
+            connection.exec_driver_sql(f'DROP INDEX "{index["name"]}"')
+        connection.exec_driver_sql(f'ALTER TABLE "{table.name}" RENAME TO "{table.name}_legacy"')
+    # Columns the old tables lack take their server defaults
+    v3.create_all(connection, tables=tables)
+    for table in tables:
+        names = ", ".join(f'"{name}"' for name in columns[table.name])
+        values = ", ".join(
+            f'uuid_blob("{name}")' if name in id_columns[table.name] else f'"{name}"' for name in columns[table.name]
+        )
+        connection.exec_driver_sql(f'INSERT INTO "{table.name}" ({names}) SELECT {values} FROM "{table.name}_legacy"')
+    for table in reversed(tables):
+        connection.exec_driver_sql(f'DROP TABLE "{table.name}_legacy"')
+
+
+def _complete_legacy_schema(connection):
+    """Add the tables, columns and indexes create_all never added to databases made by older releases"""
+    inspector = inspect(connection)
+    for table in v3.sorted_tables:
+        if not inspector.has_table(table.name):
+            table.create(connection)
+            continue
+        columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in columns:
+                ddl = CreateColumn(column).compile(dialect=connection.dialect)
+                connection.exec_driver_sql(f'ALTER TABLE "{table.name}" ADD COLUMN {ddl}')
+        indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in indexes:
+                index.create(connection)
+
+
+def _backfill_todo_stats(connection):
+    """Count every user's todos into todo_stats now rather than on their first /todos/stats.
+
+    Each user gets an ("all", "") row, zero if they have no todos, and a
+    row per category and priority in use, "" standing for none.
+    """
+    todos = v3_todos
+    completed_count = func.coalesce(func.sum(case((todos.c.completed, 1), else_=0)), 0)
+    # count(id) skips the NULL row a user without todos joins to
+    open_count = func.count(todos.c.id) - completed_count
+
+    def recount(connection, user_ids):
+        overall = (
+            select(v3_users.c.id, literal("all"), literal(""), open_count, completed_count)
+            .select_from(v3_users.outerjoin(todos, todos.c.user_id == v3_users.c.id))
+            .where(v3_users.c.id.in_(user_ids))
+            .group_by(v3_users.c.id)
+        )
+        by_value = [
+            select(todos.c.user_id, literal(dimension), func.coalesce(column, ""), open_count, completed_count)
+            .where(todos.c.user_id.in_(user_ids))
+            .group_by(todos.c.user_id, func.coalesce(column, ""))
+            for dimension, column in (("category", todos.c.category), ("priority", todos.c.priority))
+        ]
+        connection.execute(delete(v3_todo_stats).where(v3_todo_stats.c.user_id.in_(user_ids)))
+        connection.execute(insert(v3_todo_stats).from_select(
+            ["user_id", "dimension", "key", "open_count", "completed_count"], union_all(overall, *by_value)
+        ))
+
+    backfill(connection, v3_users.c.id, recount)
+
+
+def _drop_redundant_completed_index(connection):
+    """(user_id, completed) is a prefix of ix_todos_user_open_due, so it only slowed writes down"""
+    connection.exec_driver_sql("DROP INDEX IF EXISTS ix_todos_user_completed")
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "Store ids as compact UUIDs", _compact_ids),
+    Migration(2, "Complete schemas created by create_all", _complete_legacy_schema),
+    Migration(3, "Backfill todo_stats", _backfill_todo_stats),
+    Migration(4, "Drop ix_todos_user_completed", _drop_redundant_completed_index),
+]
+
+HEAD = MIGRATIONS[-1].version
+
+
+def _begin(connection):
+    if not connection.in_transaction():
+        connection.begin()
+    if connection.dialect.name == "sqlite":
+        # pysqlite would otherwise run DDL outside the transaction
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+def current_version(connection) -> Optional[int]:
+    """The recorded schema version, or None if the database has none yet"""
+    if not inspect(connection).has_table(schema_version.name):
+        return None
+    return connection.execute(select(schema_version.c.version)).scalar()
+
+
+def check_schema(engine):
+    """Raise unless the database is at the schema version this release expects; one query"""
+    with engine.connect() as connection:
+        try:
+            version = connection.execute(select(schema_version.c.version)).scalar()
+        except DBAPIError:
+            version = None
+    # A newer schema is accepted, so the previous release's workers can restart during a rollout
+    if version is None or version < HEAD:
+        raise RuntimeError(
+            f"Database schema is at version {version or 0}, this release needs {HEAD}; "
+            "run `python init_db_script.py` first"
+        )
+
+
+@contextmanager
+def _migration_lock(engine):
+    if engine.dialect.name == "postgresql":
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            connection.execute(select(func.pg_advisory_lock(POSTGRES_LOCK_KEY)))
+            try:
+                yield
+            finally:
+                connection.execute(select(func.pg_advisory_unlock(POSTGRES_LOCK_KEY)))
+    elif engine.dialect.name == "sqlite" and engine.url.database not in (None, "", ":memory:"):
+        with open(f"{engine.url.database}.migrate-lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+    else:
+        yield
+
+
+def upgrade(engine, log: Callable[[str], None] = lambda message: None) -> int:
+    """Create or migrate the database up to HEAD; returns the number of migrations run"""
+    with _migration_lock(engine), engine.connect() as connection:
+        _begin(connection)
+        version = current_version(connection)
+        if version is None:
+            schema_version.create(connection)
+            if not inspect(connection).has_table(v3_users.name):
+                Base.metadata.create_all(connection)
+                connection.execute(schema_version.insert().values(version=HEAD))
+                connection.commit()
+                log(f"Created schema version {HEAD}")
+                return 0
+            # Made by create_all before there were migrations
+            connection.execute(schema_version.insert().values(version=0))
+            version = 0
+        connection.commit()
+
+        applied = 0
+        for migration in MIGRATIONS:
+            if migration.version <= version:
+                continue
+            _begin(connection)
+            migration.upgrade(connection)
+            connection.execute(update(schema_version).values(version=migration.version))
+            connection.commit()
+            applied += 1
+            log(f"Migrated to version {migration.version}: {migration.description}")
+        return applied
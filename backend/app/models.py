@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import List, Optional
 from pydantic import BaseModel, Field, ConfigDict
 from enum import Enum
 
@@ -7,6 +7,26 @@ class Priority(str, Enum):
     medium = "medium"
     high = "high"
 
+class TodoSort(str, Enum):
+    created_asc = "createdAt"
+    created_desc = "-createdAt"
+    due_asc = "dueDate"
+    due_desc = "-dueDate"
+    priority_asc = "priority"
+    priority_desc = "-priority"
+
+class ExportFormat(str, Enum):
+    ndjson = "ndjson"
+    csv = "csv"
+
+class TodoFilter(BaseModel):
+    completed: Optional[bool] = None
+    category: Optional[str] = None
+    priority: Optional[Priority] = None
+    dueAfter: Optional[int] = Field(None, description="Inclusive lower bound, timestamp in milliseconds")
+    dueBefore: Optional[int] = Field(None, description="Exclusive upper bound, timestamp in milliseconds")
+    overdue: Optional[bool] = None
+
 class TodoBase(BaseModel):
     text: str
     dueDate: Optional[int] = Field(None, description="Timestamp in milliseconds")
@@ -16,6 +36,11 @@ class TodoBase(BaseModel):
 class TodoCreate(TodoBase):
     pass
 
+class TodoImportItem(TodoCreate):
+    """One todo in an import file; imported todos always get new ids"""
+    completed: bool = False
+    createdAt: Optional[int] = Field(None, description="Timestamp in milliseconds, defaults to the import time")
+
 class TodoUpdate(BaseModel):
     text: Optional[str] = None
     completed: Optional[bool] = None
@@ -31,6 +56,55 @@ class Todo(TodoBase):
 
     model_config = ConfigDict(from_attributes=True)
 
+MAX_BATCH_SIZE = 500
+
+class TodoBatchCreate(BaseModel):
+    items: List[TodoCreate] = Field(..., min_length=1, max_length=MAX_BATCH_SIZE)
+
+class TodoBatchUpdateItem(TodoUpdate):
+    id: str
+
+class TodoBatchUpdate(BaseModel):
+    items: List[TodoBatchUpdateItem] = Field(..., min_length=1, max_length=MAX_BATCH_SIZE)
+
+class TodoBatchDelete(BaseModel):
+    ids: List[str] = Field(..., min_length=1, max_length=MAX_BATCH_SIZE)
+
+class TodoBatchResult(BaseModel):
+    """Outcome of one item in a batch request, in request order"""
+    id: Optional[str] = None
+    status: int
+    todo: Optional[Todo] = None
+    error: Optional[str] = None
+
+class TodoBatchResponse(BaseModel):
+    results: List[TodoBatchResult]
+
+class TodoChanges(BaseModel):
+    """Todos created or changed, and ids deleted, since a revision"""
+    changed: List[Todo]
+    deleted: List[str]
+    revision: int = Field(..., description="Pass as `since` on the next call")
+
+class TodoStatCounts(BaseModel):
+    open: int
+    completed: int
+
+class TodoCategoryStats(TodoStatCounts):
+    category: Optional[str] = None
+
+class TodoPriorityStats(TodoStatCounts):
+    priority: Optional[Priority] = None
+
+class TodoStats(BaseModel):
+    """Counts of a user's todos, overall and by category and priority"""
+    total: int
+    open: int
+    completed: int
+    overdue: int = Field(..., description="Open todos whose due date has passed")
+    byCategory: List[TodoCategoryStats]
+    byPriority: List[TodoPriorityStats]
+
 class UserBase(BaseModel):
     email: str
 
@@ -0,0 +1,182 @@
+"""
+On-demand profiling of single requests.
+
+A request is profiled when it carries `X-Profile: <PROFILING_TOKEN>` or,
+with PROFILE_SAMPLE_EVERY set to N, when it is the Nth request this worker
+has seen. A sampler thread then records the call stacks of the event loop
+thread and of every thread that runs one of the request's queries, and the
+cursor hooks below record each SQL statement with its duration. Two files
+are written to PROFILE_DIR and named in the X-Profile-Id response header:
+`<id>.folded`, collapsed stacks for flamegraph.pl or speedscope, and
+`<id>.json`, the request and its SQL. Only the newest PROFILE_MAX_PROFILES
+are kept.
+
+Other requests served concurrently on the event loop show up in its
+samples too, so profile on a quiet worker when the details matter.
+Unprofiled requests pay for a header lookup and a contextvar read per
+query.
+"""
+import hmac
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Set
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.concurrency import run_in_threadpool
+
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN", "")
+PROFILE_SAMPLE_EVERY = int(os.getenv("PROFILE_SAMPLE_EVERY", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "./profiles")
+PROFILE_MAX_PROFILES = int(os.getenv("PROFILE_MAX_PROFILES", "50"))
+PROFILE_INTERVAL_SECONDS = float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000
+# Keep pathological requests from producing huge artifacts
+PROFILE_MAX_STATEMENTS = 1000
+
+PROFILE_HEADER = b"x-profile"
+
+
+class RequestProfile:
+    """Stack samples and SQL statements collected for one request"""
+
+    def __init__(self, method: str, path: str, interval: float):
+        self.id = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.method = method
+        self.path = path
+        self.interval = interval
+        self.status_code: Optional[int] = None
+        self.started_at = time.time()
+        self.duration = 0.0
+        self.stacks: Counter = Counter()
+        self.statements: List[Dict] = []
+        self.thread_ids: Set[int] = {threading.get_ident()}
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, name=f"profiler-{self.id}", daemon=True)
+
+    def start(self):
+        self._sampler.start()
+
+    def stop(self):
+        self._stop.set()
+        self._sampler.join()
+        self.duration = time.time() - self.started_at
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id in list(self.thread_ids):
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    self.stacks[_fold(frame)] += 1
+
+    def record_statement(self, statement: str, seconds: float):
+        self.thread_ids.add(threading.get_ident())
+        if len(self.statements) < PROFILE_MAX_STATEMENTS:
+            self.statements.append({"sql": statement, "ms": round(seconds * 1000, 3)})
+
+    def save(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"{self.id}.folded"), "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        with open(os.path.join(directory, f"{self.id}.json"), "w") as f:
+            json.dump({
+                "id": self.id,
+                "method": self.method,
+                "path": self.path,
+                "status": self.status_code,
+                "started_at": self.started_at,
+                "duration_ms": round(self.duration * 1000, 3),
+                "interval_ms": self.interval * 1000,
+                "samples": sum(self.stacks.values()),
+                "sql_ms": round(sum(s["ms"] for s in self.statements), 3),
+                "statements": self.statements,
+            }, f, indent=2)
+        prune_profiles(directory, PROFILE_MAX_PROFILES)
+
+
+def _fold(frame) -> str:
+    """One stack in collapsed format, outermost frame first"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names)).replace(" ", "_")
+
+
+def prune_profiles(directory: str, keep: int):
+    """Delete all but the newest `keep` profiles in directory"""
+    written_at: Dict[str, float] = {}
+    for entry in os.scandir(directory):
+        profile_id, _, suffix = entry.name.rpartition(".")
+        if suffix in ("folded", "json"):
+            written_at[profile_id] = max(written_at.get(profile_id, 0.0), entry.stat().st_mtime)
+    for profile_id in sorted(written_at, key=written_at.get, reverse=True)[keep:]:
+        for suffix in (".folded", ".json"):
+            try:
+                os.remove(os.path.join(directory, profile_id + suffix))
+            except FileNotFoundError:
+                pass
+
+
+_active_profile: ContextVar[Optional[RequestProfile]] = ContextVar("active_profile", default=None)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_statement_timer(conn, cursor, statement, parameters, context, executemany):
+    if _active_profile.get() is not None:
+        context._profile_started_at = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _record_statement(conn, cursor, statement, parameters, context, executemany):
+    profile = _active_profile.get()
+    if profile is not None and hasattr(context, "_profile_started_at"):
+        profile.record_statement(statement, time.perf_counter() - context._profile_started_at)
+
+
+class ProfilingMiddleware:
+    """ASGI middleware that profiles requests selected by header or sampling"""
+
+    def __init__(self, app):
+        self.app = app
+        self._requests = itertools.count(1)
+
+    def _should_profile(self, scope) -> bool:
+        if PROFILE_SAMPLE_EVERY > 0 and next(self._requests) % PROFILE_SAMPLE_EVERY == 0:
+            return True
+        if not PROFILING_TOKEN:
+            return False
+        for name, value in scope["headers"]:
+            if name == PROFILE_HEADER:
+                return hmac.compare_digest(value, PROFILING_TOKEN.encode())
+        return False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope["method"], scope["path"], PROFILE_INTERVAL_SECONDS)
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                profile.status_code = message["status"]
+                message = {**message, "headers": [*message.get("headers", []), (b"x-profile-id", profile.id.encode())]}
+            await send(message)
+
+        token = _active_profile.set(profile)
+        profile.start()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            _active_profile.reset(token)
+            profile.stop()
+            await run_in_threadpool(profile.save, PROFILE_DIR)
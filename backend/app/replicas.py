@@ -0,0 +1,146 @@
+"""
+Read replicas of the primary database.
+
+Read-only work can run on a replica instead of the primary. ReplicaSet
+hands out the healthy replicas round-robin, and marks a replica unhealthy
+when a health check fails, when it lags behind by more than the
+read-your-writes window, or when a connection to it drops mid-request.
+
+After a user's write commits, that user's reads go to the primary for
+the read-your-writes window, so they always see their own changes. The
+time of each user's last write is kept in memory shared with the workers
+that app.serve forks. With `uvicorn --workers` each worker only knows
+about the writes it made itself.
+"""
+import itertools
+import logging
+import mmap
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from typing import Any, List, Optional
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+# How far behind the primary a Postgres replica is. Zero when it has replayed
+# everything it received, so an idle primary doesn't look like lag.
+POSTGRES_LAG_QUERY = text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+
+class WriteMarks:
+    """When each user last wrote, in a table shared with forked workers.
+
+    Monotonic timestamps live in an anonymous shared mapping, created at
+    import, before app.serve forks. Users are assigned a slot by a hash of
+    their id; users that share a slot only send each other's reads to the
+    primary a little more often.
+    """
+
+    def __init__(self, slots: int = 65536):
+        self.slots = slots
+        self._memory = mmap.mmap(-1, slots * 8)
+        self._times = memoryview(self._memory).cast("d")
+
+    def _slot(self, key: str) -> int:
+        return zlib.crc32(key.encode()) % self.slots
+
+    def mark(self, key: str):
+        self._times[self._slot(key)] = time.monotonic()
+
+    def seconds_since(self, key: str) -> float:
+        return time.monotonic() - self._times[self._slot(key)]
+
+
+@dataclass
+class Replica:
+    engine: Engine
+    healthy: bool = True
+    # The AsyncEngine for USE_ASYNC_DB, created by app.database on first use
+    async_engine: Any = None
+
+    @property
+    def name(self) -> str:
+        return self.engine.url.render_as_string(hide_password=True)
+
+
+def replication_lag_seconds(engine: Engine) -> float:
+    """Seconds the database behind engine lags its primary; 0 for anything but a Postgres standby"""
+    with engine.connect() as connection:
+        if engine.dialect.name != "postgresql":
+            connection.execute(text("SELECT 1"))
+            return 0.0
+        if not connection.execute(text("SELECT pg_is_in_recovery()")).scalar():
+            return 0.0
+        return float(connection.execute(POSTGRES_LAG_QUERY).scalar())
+
+
+class ReplicaSet:
+    """Chooses where read-only work runs: a healthy replica, or None for the primary"""
+
+    def __init__(self, engines: List[Engine], read_your_writes_seconds: float):
+        self.replicas = [Replica(engine) for engine in engines]
+        self.read_your_writes_seconds = read_your_writes_seconds
+        self.write_marks = WriteMarks()
+        self._turn = itertools.count()
+        self._lock = threading.Lock()
+        for replica in self.replicas:
+            self.watch(replica, replica.engine)
+
+    def __bool__(self) -> bool:
+        return bool(self.replicas)
+
+    def watch(self, replica: Replica, engine: Engine):
+        """Take replica out of rotation when one of engine's connections drops"""
+        @event.listens_for(engine, "handle_error")
+        def mark_unhealthy(context):
+            if context.is_disconnect:
+                self._set_health(replica, False, "connection lost")
+
+    def _set_health(self, replica: Replica, healthy: bool, reason: str = ""):
+        if replica.healthy != healthy:
+            if healthy:
+                logger.info("Replica %s is healthy again", replica.name)
+            else:
+                logger.warning("Replica %s is unhealthy (%s); reading from the others", replica.name, reason)
+        replica.healthy = healthy
+
+    def mark_write(self, user_id: str):
+        """Send the user's reads to the primary for the read-your-writes window"""
+        if self.replicas:
+            self.write_marks.mark(user_id)
+
+    def choose(self, user_id: Optional[str] = None) -> Optional[Replica]:
+        """The replica for the next read by user_id, or None to read from the primary"""
+        if not self.replicas:
+            return None
+        if user_id is not None and self.write_marks.seconds_since(user_id) < self.read_your_writes_seconds:
+            metrics.DB_READ_ROUTING.labels(target="primary", reason="recent_write").inc()
+            return None
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            metrics.DB_READ_ROUTING.labels(target="primary", reason="no_healthy_replica").inc()
+            return None
+        with self._lock:
+            turn = next(self._turn)
+        metrics.DB_READ_ROUTING.labels(target="replica", reason="round_robin").inc()
+        return healthy[turn % len(healthy)]
+
+    def check_health(self):
+        """Probe every replica, taking those that fail or lag too far out of rotation"""
+        for replica in self.replicas:
+            try:
+                lag = replication_lag_seconds(replica.engine)
+            except Exception as e:
+                self._set_health(replica, False, f"{type(e).__name__}: {e}")
+                continue
+            if lag > self.read_your_writes_seconds:
+                self._set_health(replica, False, f"{lag:.1f}s behind")
+            else:
+                self._set_health(replica, True)
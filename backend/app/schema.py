@@ -1,14 +1,18 @@
-from sqlalchemy import Column, String, Boolean, Integer, ForeignKey, BigInteger
+from sqlalchemy import Column, String, Boolean, Integer, ForeignKey, BigInteger, Index
 from sqlalchemy.orm import relationship
 from app.database import Base
-import uuid
+from app.ids import CompactUUID, new_id
 
 class User(Base):
     __tablename__ = "users"
     
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    id = Column(CompactUUID, primary_key=True, default=new_id)
     email = Column(String, unique=True, index=True, nullable=False)
     password_hash = Column(String, nullable=False)
+    # Bumped by every write to the user's todos; used as the ETag of todo reads
+    todos_version = Column(BigInteger, nullable=False, default=0, server_default="0")
+    # Highest revision whose tombstones have been purged; older sync points are gone
+    purged_revision = Column(BigInteger, nullable=False, default=0, server_default="0")
     
     todos = relationship("TodoModel", back_populates="owner")
 
@@ -16,13 +20,55 @@ class TodoModel(Base):
     """SQLAlchemy model for Todo items"""
     __tablename__ = "todos"
     
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    id = Column(CompactUUID, primary_key=True, default=new_id)
     text = Column(String, nullable=False)
     completed = Column(Boolean, default=False, nullable=False)
     created_at = Column(BigInteger, nullable=False)  # Timestamp in milliseconds
     due_date = Column(BigInteger, nullable=True)  # Timestamp in milliseconds
     priority = Column(String, nullable=True)  # "low", "medium", "high"
     category = Column(String, nullable=True)
-    user_id = Column(String, ForeignKey("users.id"), nullable=True)
+    user_id = Column(CompactUUID, ForeignKey("users.id"), nullable=True)
+    # Owner's todos_version at the last write to this row
+    revision = Column(BigInteger, nullable=False, default=0, server_default="0")
     
     owner = relationship("User", back_populates="todos")
+
+    # Every query is scoped to one user, so each index leads with user_id.
+    # (user_id, created_at, id) also serves the default ordering and keyset pagination.
+    __table_args__ = (
+        Index("ix_todos_user_created", "user_id", "created_at", "id"),
+        Index("ix_todos_user_due", "user_id", "due_date"),
+        Index("ix_todos_user_category", "user_id", "category"),
+        Index("ix_todos_user_revision", "user_id", "revision"),
+        # Counting overdue todos for /todos/stats is a range scan of this index
+        # only; its (user_id, completed) prefix also serves the completed filter
+        Index("ix_todos_user_open_due", "user_id", "completed", "due_date"),
+    )
+
+class TodoTombstone(Base):
+    """Marker left behind by a deleted todo so delta sync can report it"""
+    __tablename__ = "todo_tombstones"
+
+    id = Column(CompactUUID, primary_key=True)  # id of the deleted todo
+    user_id = Column(CompactUUID, ForeignKey("users.id"), nullable=False)
+    revision = Column(BigInteger, nullable=False)
+    deleted_at = Column(BigInteger, nullable=False)  # Timestamp in milliseconds
+
+    __table_args__ = (
+        Index("ix_todo_tombstones_user_revision", "user_id", "revision"),
+        Index("ix_todo_tombstones_deleted_at", "deleted_at"),
+    )
+
+class TodoStat(Base):
+    """Open and completed todo counts per user, overall and by category/priority.
+
+    Kept in step by every write in app/db.py; dimension is "all", "category"
+    or "priority" and key the category or priority value ("" for none).
+    """
+    __tablename__ = "todo_stats"
+
+    user_id = Column(CompactUUID, ForeignKey("users.id"), primary_key=True)
+    dimension = Column(String, primary_key=True)
+    key = Column(String, primary_key=True)
+    open_count = Column(BigInteger, nullable=False, default=0, server_default="0")
+    completed_count = Column(BigInteger, nullable=False, default=0, server_default="0")
@@ -0,0 +1,123 @@
+"""
+Preforking server: python -m app.serve --workers 4
+
+`uvicorn --workers` starts each worker as a fresh interpreter that imports
+FastAPI, SQLAlchemy, passlib and the app all over again. This imports
+app.main once, checks the schema, then forks the workers from that
+process: they start without importing anything and share the imported
+modules' memory copy-on-write. A worker that dies is replaced by a new
+fork; SIGTERM or SIGINT stops every worker gracefully.
+
+Nothing that must not cross a fork (threads, pooled connections, the
+password hashing processes) exists before the workers start, so each
+worker creates its own.
+"""
+import argparse
+import gc
+import os
+import signal
+import sys
+import time
+import uvicorn
+
+STOP_SIGNALS = {signal.SIGINT, signal.SIGTERM}
+
+# A worker that exits with an error this soon after it was forked is
+# failing to boot, and replacing it would only fail again
+BOOT_FAILURE_SECONDS = 5.0
+
+
+def _run_worker(config: uvicorn.Config, sock):
+    """Serve in a forked worker until told to stop; never returns"""
+    status = 1
+    try:
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, STOP_SIGNALS)
+        gc.enable()
+        uvicorn.Server(config).run(sockets=[sock])
+        status = 0
+    finally:
+        # Skip the parent's atexit handlers and buffers, which it still owns
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(status)
+
+
+def serve(host: str, port: int, workers: int, log_level: str = "info") -> int:
+    from app import database, metrics
+    from app.main import app
+
+    config = uvicorn.Config(app, host=host, port=port, log_level=log_level)
+    # Refuse to fork workers that would each fail the same check
+    database.init_db()
+    database.engine.dispose()
+    sock = config.bind_socket()
+
+    # Keep the collector from touching, and so copying, the shared objects
+    gc.disable()
+    gc.freeze()
+
+    children = {}
+    stopping = False
+
+    def spawn():
+        # Until the child has reset its handlers, a stop signal would run the
+        # parent's stop() in it, so hold them back over the fork
+        signal.pthread_sigmask(signal.SIG_BLOCK, STOP_SIGNALS)
+        try:
+            pid = os.fork()
+            if pid == 0:
+                _run_worker(config, sock)
+            children[pid] = time.monotonic()
+        finally:
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, STOP_SIGNALS)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        if stopping:
+            return
+        stopping = True
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    for _ in range(workers):
+        spawn()
+    print(f"Forked {workers} workers from process {os.getpid()}", file=sys.stderr)
+
+    status = 0
+    while children:
+        pid, wait_status = os.wait()
+        started = children.pop(pid, None)
+        if started is None:
+            continue
+        metrics.mark_process_dead(pid)
+        if stopping:
+            continue
+        exit_code = os.waitstatus_to_exitcode(wait_status)
+        if exit_code > 0 and time.monotonic() - started < BOOT_FAILURE_SECONDS:
+            print(f"Worker {pid} failed to start (exit code {exit_code}), stopping", file=sys.stderr)
+            status = 1
+            stop(signal.SIGTERM, None)
+            continue
+        print(f"Worker {pid} exited (exit code {exit_code}), forking a new one", file=sys.stderr)
+        spawn()
+    sock.close()
+    metrics.mark_process_dead()
+    return status
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.serve", description="Serve the API from forked workers")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "1")))
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args(argv)
+    return serve(args.host, args.port, args.workers, log_level=args.log_level)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
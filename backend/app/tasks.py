@@ -0,0 +1,148 @@
+"""
+Periodic maintenance jobs run in the background of each worker.
+
+Jobs are plain sync functions run in the threadpool; every job must be safe
+to run concurrently from several workers. Jobs whose work covers every user
+only run in the worker holding a WorkerLease, so it isn't repeated per worker.
+"""
+import asyncio
+import fcntl
+import logging
+import os
+import time
+from sqlalchemy import func, select
+from sqlalchemy.exc import DBAPIError
+from starlette.concurrency import run_in_threadpool
+from app import database, db
+
+logger = logging.getLogger(__name__)
+
+TOMBSTONE_RETENTION_DAYS = float(os.getenv("TOMBSTONE_RETENTION_DAYS", "30"))
+# Seconds between tombstone purges; 0 disables the job
+TOMBSTONE_PURGE_INTERVAL_SECONDS = float(os.getenv("TOMBSTONE_PURGE_INTERVAL_SECONDS", "3600"))
+# Seconds between SQLite WAL checkpoints and PRAGMA optimize; 0 disables the job
+SQLITE_MAINTENANCE_INTERVAL_SECONDS = float(os.getenv("SQLITE_MAINTENANCE_INTERVAL_SECONDS", "300"))
+# Seconds between recounts of the /todos/stats counters; 0 disables the job
+TODO_STATS_RECONCILE_INTERVAL_SECONDS = float(os.getenv("TODO_STATS_RECONCILE_INTERVAL_SECONDS", "3600"))
+# Seconds between health and lag checks of DATABASE_REPLICA_URLS; 0 disables the job
+REPLICA_HEALTH_CHECK_INTERVAL_SECONDS = float(os.getenv("REPLICA_HEALTH_CHECK_INTERVAL_SECONDS", "5"))
+
+_running_tasks = []
+
+
+class WorkerLease:
+    """Held by one of the workers sharing the database, until that worker exits.
+
+    On Postgres, a session advisory lock on a connection kept open for it;
+    on a SQLite file, a lock on a file next to the database. Either is let go
+    by the operating system or the server when the holder dies, and another
+    worker takes over at its next attempt. An in-memory database belongs to
+    one process, which always holds the lease.
+    """
+
+    def __init__(self, name: str, postgres_key: int):
+        self.name = name
+        self.postgres_key = postgres_key
+        self._connection = None
+        self._lock_file = None
+
+    def held(self) -> bool:
+        """Whether this worker holds the lease, taking it if nobody does"""
+        engine = database.engine
+        if engine.dialect.name == "postgresql":
+            return self._hold_advisory_lock(engine)
+        if engine.dialect.name == "sqlite" and engine.url.database not in (None, "", ":memory:"):
+            return self._hold_lock_file(f"{engine.url.database}.{self.name}-lock")
+        return True
+
+    def _hold_advisory_lock(self, engine) -> bool:
+        if self._connection is not None:
+            try:
+                self._connection.execute(select(1))
+                return True
+            except DBAPIError:
+                # The lock went with the connection
+                self.release()
+        connection = engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+        if connection.execute(select(func.pg_try_advisory_lock(self.postgres_key))).scalar():
+            self._connection = connection
+            return True
+        connection.close()
+        return False
+
+    def _hold_lock_file(self, path: str) -> bool:
+        if self._lock_file is not None:
+            return True
+        lock_file = open(path, "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def release(self):
+        if self._connection is not None:
+            try:
+                self._connection.close()
+            except DBAPIError:
+                pass
+            self._connection = None
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+
+# The advisory lock key is any constant distinct from app.migrations'
+todo_stats_lease = WorkerLease("reconcile", postgres_key=7_254_118_340)
+
+
+def purge_expired_tombstones():
+    cutoff = int((time.time() - TOMBSTONE_RETENTION_DAYS * 86400) * 1000)
+    session = database.SessionLocal()
+    try:
+        purged = db.purge_tombstones(session, older_than=cutoff)
+    finally:
+        session.close()
+    if purged:
+        logger.info("Purged %d todo tombstones", purged)
+
+
+def reconcile_todo_stats():
+    if not todo_stats_lease.held():
+        return
+    session = database.SessionLocal()
+    try:
+        repaired = db.reconcile_all_todo_stats(session)
+    finally:
+        session.close()
+    if repaired:
+        logger.warning("Repaired %d drifted todo stats counters", repaired)
+
+
+async def run_periodically(interval_seconds: float, job):
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            await run_in_threadpool(job)
+        except Exception:
+            logger.exception("Background job %s failed", job.__name__)
+
+
+def start_background_tasks():
+    jobs = [
+        (TOMBSTONE_PURGE_INTERVAL_SECONDS, purge_expired_tombstones),
+        (SQLITE_MAINTENANCE_INTERVAL_SECONDS, database.sqlite_maintenance),
+        (TODO_STATS_RECONCILE_INTERVAL_SECONDS, reconcile_todo_stats),
+        (REPLICA_HEALTH_CHECK_INTERVAL_SECONDS if database.replicas else 0, database.replicas.check_health),
+    ]
+    for interval_seconds, job in jobs:
+        if interval_seconds > 0:
+            _running_tasks.append(asyncio.create_task(run_periodically(interval_seconds, job)))
+
+
+def stop_background_tasks():
+    while _running_tasks:
+        _running_tasks.pop().cancel()
+    todo_stats_lease.release()
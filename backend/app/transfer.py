@@ -0,0 +1,195 @@
+"""
+Bulk import of todos from NDJSON or CSV uploads.
+
+The upload is parsed line by line as it arrives and valid rows are inserted
+IMPORT_CHUNK_SIZE at a time, each chunk in one transaction on a session of
+its own, so memory stays flat however large the file is. The response is
+NDJSON written while the upload is still being read: an `error` line for
+every row that was skipped, an `imported` count after every chunk, and a
+final line with `"done": true`, or `false` when the import stopped early.
+Chunks committed before a failure stay imported.
+
+CSV files start with a header naming their columns, as an export does.
+"""
+import csv
+import json
+import os
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from pydantic import ValidationError
+from starlette.requests import ClientDisconnect
+from starlette.responses import StreamingResponse
+from app import database, db
+from app.models import ExportFormat, TodoImportItem
+
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "1000"))
+# Longest line (or multi-line CSV record) accepted before the import is stopped
+IMPORT_MAX_LINE_BYTES = int(os.getenv("IMPORT_MAX_LINE_BYTES", str(64 * 1024)))
+
+IMPORT_CONTENT_TYPES = {
+    "application/x-ndjson": ExportFormat.ndjson,
+    "application/ndjson": ExportFormat.ndjson,
+    "application/jsonl": ExportFormat.ndjson,
+    "text/csv": ExportFormat.csv,
+}
+
+EXPORT_CONTENT_TYPES = {
+    ExportFormat.ndjson: "application/x-ndjson",
+    ExportFormat.csv: "text/csv; charset=utf-8",
+}
+
+
+class ImportAbortedError(Exception):
+    """Raised when an upload cannot be read any further"""
+
+
+def import_format(content_type: Optional[str]) -> Optional[ExportFormat]:
+    """The import format for a Content-Type header, or None if unsupported"""
+    if not content_type:
+        return None
+    return IMPORT_CONTENT_TYPES.get(content_type.split(";")[0].strip().lower())
+
+
+async def iter_lines(chunks: AsyncIterator[bytes], max_line_bytes: int) -> AsyncIterator[Tuple[int, bytes]]:
+    """Split a byte stream into numbered lines, without their line endings"""
+    buffer = b""
+    line_number = 0
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            line_number += 1
+            yield line_number, line.removesuffix(b"\r")
+        if len(buffer) > max_line_bytes:
+            raise ImportAbortedError(f"Line {line_number + 1} is longer than {max_line_bytes} bytes")
+    if buffer.strip():
+        yield line_number + 1, buffer.removesuffix(b"\r")
+
+
+def _item(fields: Dict) -> TodoImportItem:
+    try:
+        return TodoImportItem.model_validate(fields)
+    except ValidationError as e:
+        error = e.errors()[0]
+        field = ".".join(str(part) for part in error["loc"])
+        raise ValueError(f"{field}: {error['msg']}" if field else error["msg"])
+
+
+def _decode(line: bytes, line_number: int) -> str:
+    try:
+        # A BOM is common at the start of CSV files saved by spreadsheets
+        return line.decode("utf-8-sig" if line_number == 1 else "utf-8")
+    except UnicodeDecodeError:
+        raise ValueError("Not valid UTF-8")
+
+
+def _ndjson_item(line: bytes, line_number: int) -> TodoImportItem:
+    try:
+        fields = json.loads(_decode(line, line_number))
+    except json.JSONDecodeError:
+        raise ValueError("Invalid JSON")
+    if not isinstance(fields, dict):
+        raise ValueError("Expected a JSON object")
+    return _item(fields)
+
+
+async def iter_ndjson_items(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, object]]:
+    """Yield (line number, TodoImportItem or ValueError) for each non-blank line"""
+    async for line_number, line in iter_lines(chunks, IMPORT_MAX_LINE_BYTES):
+        if not line.strip():
+            continue
+        try:
+            item = _ndjson_item(line, line_number)
+        except ValueError as e:
+            item = e
+        yield line_number, item
+
+
+async def iter_csv_items(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, object]]:
+    """Yield (line number, TodoImportItem or ValueError) for each CSV record after the header.
+
+    Quoted fields may span lines: lines are joined while the record has an
+    odd number of quotes, which escaped quotes ("") never change.
+    """
+    header: Optional[List[str]] = None
+    record, record_line = "", 0
+    async for line_number, line in iter_lines(chunks, IMPORT_MAX_LINE_BYTES):
+        try:
+            text = _decode(line, line_number)
+        except ValueError as e:
+            record = ""
+            yield line_number, e
+            continue
+        if not record:
+            record_line = line_number
+        record = f"{record}\n{text}" if record else text
+        if record.count('"') % 2:
+            if len(record) > IMPORT_MAX_LINE_BYTES:
+                raise ImportAbortedError(f"Record at line {record_line} is longer than {IMPORT_MAX_LINE_BYTES} bytes")
+            continue
+        values, record = next(csv.reader([record]), []), ""
+        if not any(value.strip() for value in values):
+            continue
+        if header is None:
+            header = [name.strip() for name in values]
+            if "text" not in header:
+                raise ImportAbortedError("The CSV header has no text column")
+            continue
+        if len(values) != len(header):
+            yield record_line, ValueError(f"Expected {len(header)} fields, got {len(values)}")
+            continue
+        try:
+            # Empty cells are missing values, as in an export
+            item = _item({name: value for name, value in zip(header, values) if value != ""})
+        except ValueError as e:
+            item = e
+        yield record_line, item
+    if record:
+        yield record_line, ValueError("Unterminated quoted field")
+
+
+def _progress(**fields) -> bytes:
+    return json.dumps(fields, separators=(",", ":")).encode() + b"\n"
+
+
+async def import_todos(chunks: AsyncIterator[bytes], import_format: ExportFormat, user_id: str):
+    """Import an upload for a user, yielding NDJSON progress lines"""
+    parse = iter_csv_items if import_format == ExportFormat.csv else iter_ndjson_items
+    imported = failed = 0
+    pending: List[TodoImportItem] = []
+
+    async def flush():
+        nonlocal imported
+        imported += await database.run_in_new_session(db.import_todos, list(pending), user_id)
+        pending.clear()
+
+    try:
+        async for line_number, item in parse(chunks):
+            if isinstance(item, ValueError):
+                failed += 1
+                yield _progress(line=line_number, error=str(item))
+                continue
+            pending.append(item)
+            if len(pending) >= IMPORT_CHUNK_SIZE:
+                await flush()
+                yield _progress(imported=imported, failed=failed)
+        if pending:
+            await flush()
+    except ImportAbortedError as e:
+        yield _progress(imported=imported, failed=failed, done=False, error=str(e))
+        return
+    except ClientDisconnect:
+        # Nobody is left to read the response; chunks already committed stay
+        return
+    yield _progress(imported=imported, failed=failed, done=True)
+
+
+class ImportResponse(StreamingResponse):
+    """StreamingResponse for a body that reads the request while it is sent.
+
+    StreamingResponse normally calls receive() in the background to notice
+    disconnects, which would take upload chunks away from the import. Here
+    the import's own reads see the disconnect instead.
+    """
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
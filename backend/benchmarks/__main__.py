@@ -0,0 +1,163 @@
+"""Command line entry point: python -m benchmarks [run|compare|startup] ...
+
+    python -m benchmarks run --output baseline.json
+    python -m benchmarks run --database-url postgresql://localhost/bench --compare baseline.json
+    python -m benchmarks compare baseline.json current.json
+    python -m benchmarks startup --workers 4 --output startup.json
+"""
+import argparse
+import asyncio
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import report
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def _print_regressions(regressions, threshold) -> int:
+    if not regressions:
+        print(f"No regressions beyond {threshold:.0%}")
+        return 0
+    print(f"{len(regressions)} regression(s) beyond {threshold:.0%}:")
+    for regression in regressions:
+        print(f"  {regression['key']}: {'; '.join(regression['reasons'])}")
+    return 1
+
+
+def run(args) -> int:
+    # app.database reads these at import time, so set them before importing the suite
+    database_url = args.database_url
+    if database_url is None:
+        database_url = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='calmly-bench-'), 'bench.db')}"
+    os.environ["DATABASE_URL"] = database_url
+    os.environ["USE_ASYNC_DB"] = "true" if args.async_db else "false"
+    if args.hash_profile:
+        os.environ["PASSWORD_HASH_PROFILE"] = args.hash_profile
+    # Every simulated user shares one token, so the per-client cap would throttle the suite itself
+    os.environ.setdefault("ADMISSION_MAX_IN_FLIGHT_PER_CLIENT", "0")
+
+    from app import auth, database, migrations
+    from benchmarks import suite
+
+    migrations.upgrade(database.engine)
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    started = time.time()
+    try:
+        results = asyncio.run(suite.run_suite(
+            sizes,
+            requests=args.requests,
+            heavy_requests=args.heavy_requests,
+            concurrency=args.concurrency,
+            endpoints=args.endpoint,
+            log=lambda message: print(message, file=sys.stderr),
+        ))
+    finally:
+        auth.password_hasher.shutdown()
+
+    result = {
+        "meta": {
+            "started_at": started,
+            "duration_seconds": round(time.time() - started, 1),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "dialect": database.engine.dialect.name,
+            "async_db": args.async_db,
+            "password_hash_profile": auth.PASSWORD_HASH_PROFILE,
+            "sizes": sizes,
+            "requests": args.requests,
+            "heavy_requests": args.heavy_requests,
+            "concurrency": args.concurrency,
+        },
+        "results": results,
+    }
+    print(report.format_table(result))
+    if args.output:
+        report.save(result, args.output)
+    if args.compare:
+        return _print_regressions(report.compare(report.load(args.compare), result, args.threshold), args.threshold)
+    return 0
+
+
+def compare(args) -> int:
+    current = report.load(args.current)
+    print(report.format_table(current))
+    return _print_regressions(report.compare(report.load(args.baseline), current, args.threshold), args.threshold)
+
+
+def startup_report(args) -> int:
+    from benchmarks import startup
+
+    started = time.time()
+    results = startup.run_startup(args.workers, args.repeats, log=lambda message: print(message, file=sys.stderr))
+    result = {
+        "meta": {
+            "started_at": started,
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "workers": args.workers,
+            "repeats": args.repeats,
+        },
+        "results": results,
+    }
+    print(startup.format_table(result))
+    if args.output:
+        report.save(result, args.output)
+    if args.compare:
+        return _print_regressions(
+            startup.compare(report.load(args.compare), result, args.threshold), args.threshold
+        )
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Calmly List API benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Seed data and benchmark every endpoint")
+    run_parser.add_argument("--database-url", help="Defaults to a fresh SQLite file in a temp directory")
+    run_parser.add_argument("--async-db", action="store_true", help="Serve through AsyncSession (USE_ASYNC_DB)")
+    run_parser.add_argument("--sizes", default="10,1000,100000", help="Comma-separated todos per seeded user")
+    run_parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint and size")
+    run_parser.add_argument("--heavy-requests", type=int, default=20, help="Cap for full-list reads")
+    run_parser.add_argument("--concurrency", type=int, default=10)
+    run_parser.add_argument("--endpoint", action="append", help="Only run this endpoint; repeatable")
+    run_parser.add_argument("--hash-profile", help="PASSWORD_HASH_PROFILE for register/login")
+    run_parser.add_argument("--output", help="Write results as JSON to this file")
+    run_parser.add_argument("--compare", metavar="BASELINE", help="Exit 1 if results regress against this file")
+    run_parser.add_argument("--threshold", type=float, default=report.DEFAULT_THRESHOLD)
+    run_parser.set_defaults(handler=run)
+
+    compare_parser = commands.add_parser("compare", help="Compare two result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=report.DEFAULT_THRESHOLD)
+    compare_parser.set_defaults(handler=compare)
+
+    startup_parser = commands.add_parser("startup", help="Time server startup and measure its memory")
+    startup_parser.add_argument("--workers", type=int, default=4)
+    startup_parser.add_argument("--repeats", type=int, default=3, help="Startups per mode; the median is reported")
+    startup_parser.add_argument("--output", help="Write results as JSON to this file")
+    startup_parser.add_argument("--compare", metavar="BASELINE", help="Exit 1 if results regress against this file")
+    startup_parser.add_argument("--threshold", type=float, default=report.DEFAULT_THRESHOLD)
+    startup_parser.set_defaults(handler=startup_report)
+
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
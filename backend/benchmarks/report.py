@@ -0,0 +1,83 @@
+import json
+import math
+from typing import Dict, List, Optional
+
+# A result regresses when p95 latency grows, or throughput drops, by more
+# than this fraction of the baseline
+DEFAULT_THRESHOLD = 0.2
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(endpoint: str, size: Optional[int], latencies: List[float], errors: int, elapsed: float) -> dict:
+    """Reduce raw per-request latencies (seconds) to one result entry"""
+    ordered = sorted(latencies)
+    requests = len(ordered)
+    return {
+        "endpoint": endpoint,
+        "size": size,
+        "requests": requests,
+        "errors": errors,
+        "throughput_rps": round(requests / elapsed, 2) if elapsed > 0 else 0.0,
+        "mean_ms": round(sum(ordered) / requests * 1000, 3) if requests else 0.0,
+        "p50_ms": round(percentile(ordered, 50) * 1000, 3),
+        "p95_ms": round(percentile(ordered, 95) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 99) * 1000, 3),
+    }
+
+
+def result_key(result: dict) -> str:
+    size = result["size"]
+    return result["endpoint"] if size is None else f"{result['endpoint']} [{size}]"
+
+
+def compare(baseline: dict, current: dict, threshold: float = DEFAULT_THRESHOLD) -> List[dict]:
+    """List the results in current that regressed against baseline.
+
+    Entries only present in one of the two runs are ignored, so a baseline
+    recorded with fewer sizes or endpoints still compares cleanly.
+    """
+    baseline_results: Dict[str, dict] = {result_key(r): r for r in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        key = result_key(result)
+        before = baseline_results.get(key)
+        if before is None:
+            continue
+        reasons = []
+        if before["p95_ms"] > 0 and result["p95_ms"] > before["p95_ms"] * (1 + threshold):
+            reasons.append(f"p95 {before['p95_ms']:.2f}ms -> {result['p95_ms']:.2f}ms")
+        if before["throughput_rps"] > 0 and result["throughput_rps"] < before["throughput_rps"] * (1 - threshold):
+            reasons.append(f"throughput {before['throughput_rps']:.1f} -> {result['throughput_rps']:.1f} req/s")
+        if result["errors"] > before["errors"]:
+            reasons.append(f"errors {before['errors']} -> {result['errors']}")
+        if reasons:
+            regressions.append({"key": key, "reasons": reasons})
+    return regressions
+
+
+def format_table(report: dict) -> str:
+    lines = [f"{'endpoint':<50} {'req/s':>10} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'errors':>7}"]
+    for result in report["results"]:
+        lines.append(
+            f"{result_key(result):<50} {result['throughput_rps']:>10.1f} {result['p50_ms']:>10.2f}"
+            f" {result['p95_ms']:>10.2f} {result['p99_ms']:>10.2f} {result['errors']:>7}"
+        )
+    return "\n".join(lines)
+
+
+def load(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def save(report: dict, path: str):
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+        f.write("\n")
@@ -0,0 +1,195 @@
+"""Startup time and memory of the serving modes, for python -m benchmarks startup.
+
+Each mode is started as a real server on a fresh SQLite file and timed
+until every worker has logged that its application started. Memory is
+then summed over the server's whole process tree: RSS counts pages that
+workers share once per worker, PSS splits them between the processes
+sharing them, so PSS is what the server actually costs. Memory figures
+come from /proc and are only available on Linux.
+"""
+import os
+import queue
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+READY_LINE = "Application startup complete."
+READY_TIMEOUT_SECONDS = 60
+
+IMPORT_SCRIPT = (
+    "import time; started = time.perf_counter(); import app.main; "
+    "print(time.perf_counter() - started)"
+)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _children(pid: int) -> List[int]:
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name in parentheses may contain spaces
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == pid:
+            children.append(int(entry))
+    return children
+
+
+def _process_tree(pid: int) -> List[int]:
+    tree = [pid]
+    for child in _children(pid):
+        tree.extend(_process_tree(child))
+    return tree
+
+
+def _memory_kb(pid: int) -> Dict[str, int]:
+    """Rss and Pss of one process in KiB, from /proc/<pid>/smaps_rollup"""
+    memory = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if name in ("Rss", "Pss"):
+                    memory[name] = int(value.split()[0])
+    except OSError:
+        pass
+    return memory
+
+
+def tree_memory_mb(pid: int) -> Dict[str, Optional[float]]:
+    """Summed RSS and PSS, in MiB, of a process and all its descendants"""
+    processes = _process_tree(pid)
+    usage = [_memory_kb(process) for process in processes]
+    totals = {}
+    for name in ("Rss", "Pss"):
+        values = [memory[name] for memory in usage if name in memory]
+        totals[f"{name.lower()}_mb"] = round(sum(values) / 1024, 1) if values else None
+    return {"processes": len(processes), **totals}
+
+
+def measure_import(repeats: int) -> dict:
+    """Median time for a fresh interpreter to import app.main"""
+    times = []
+    for _ in range(repeats):
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_SCRIPT], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout
+        times.append(float(output.strip().splitlines()[-1]))
+    return {"mode": "import app.main", "workers": None, "ready_s": round(statistics.median(times), 3)}
+
+
+def measure_server(mode: str, command: List[str], workers: int, env: Dict[str, str]) -> dict:
+    """Start a server, wait until all its workers are ready, then measure its process tree"""
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        command, cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+    )
+    lines: "queue.Queue[str]" = queue.Queue()
+
+    def read_stderr():
+        for line in process.stderr:
+            lines.put(line)
+
+    # A thread, so that a worker that never gets ready can't block the timeout
+    threading.Thread(target=read_stderr, daemon=True).start()
+    try:
+        ready = 0
+        while ready < workers:
+            remaining = READY_TIMEOUT_SECONDS - (time.perf_counter() - started)
+            try:
+                line = lines.get(timeout=max(remaining, 0))
+            except queue.Empty:
+                raise RuntimeError(f"{mode}: {ready} of {workers} workers ready after {READY_TIMEOUT_SECONDS}s")
+            ready += READY_LINE in line
+        ready_s = time.perf_counter() - started
+        return {"mode": mode, "workers": workers, "ready_s": round(ready_s, 3), **tree_memory_mb(process.pid)}
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def run_startup(workers: int, repeats: int, log=lambda message: None) -> List[dict]:
+    """Import time, then uvicorn --workers against app.serve, each on a fresh database"""
+    from app import migrations
+    from app.database import create_db_engine
+
+    results = []
+    log("Timing import app.main")
+    results.append(measure_import(repeats))
+    modes = {
+        "uvicorn --workers": ["-m", "uvicorn", "app.main:app", "--workers", str(workers)],
+        "app.serve (preload)": ["-m", "app.serve", "--workers", str(workers)],
+    }
+    for mode, arguments in modes.items():
+        runs = []
+        for _ in range(repeats):
+            directory = tempfile.mkdtemp(prefix="calmly-startup-")
+            database_url = f"sqlite:///{os.path.join(directory, 'startup.db')}"
+            engine = create_db_engine(database_url)
+            migrations.upgrade(engine)
+            engine.dispose()
+            os.mkdir(os.path.join(directory, "prometheus"))
+            env = {
+                **os.environ,
+                "DATABASE_URL": database_url,
+                "PROMETHEUS_MULTIPROC_DIR": os.path.join(directory, "prometheus"),
+            }
+            log(f"Starting {mode} with {workers} workers")
+            command = [sys.executable, *arguments, "--port", str(_free_port())]
+            runs.append(measure_server(mode, command, workers, env))
+        # The run with the median startup time, so its memory figures belong to a real run
+        runs.sort(key=lambda run: run["ready_s"])
+        results.append(runs[len(runs) // 2])
+    return results
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> List[dict]:
+    """List the modes in current that start slower or use more memory (PSS) than in baseline"""
+    baseline_results = {result["mode"]: result for result in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        before = baseline_results.get(result["mode"])
+        if before is None or before["workers"] != result["workers"]:
+            continue
+        reasons = []
+        if result["ready_s"] > before["ready_s"] * (1 + threshold):
+            reasons.append(f"startup {before['ready_s']:.2f}s -> {result['ready_s']:.2f}s")
+        if before.get("pss_mb") and result.get("pss_mb") and result["pss_mb"] > before["pss_mb"] * (1 + threshold):
+            reasons.append(f"PSS {before['pss_mb']:.1f}MB -> {result['pss_mb']:.1f}MB")
+        if reasons:
+            regressions.append({"key": result["mode"], "reasons": reasons})
+    return regressions
+
+
+def format_table(report: dict) -> str:
+    def column(value, width, spec=""):
+        return f"{'-':>{width}}" if value is None else f"{value:>{width}{spec}}"
+
+    lines = [f"{'mode':<24} {'workers':>7} {'ready s':>8} {'procs':>6} {'RSS MB':>8} {'PSS MB':>8}"]
+    for result in report["results"]:
+        lines.append(
+            f"{result['mode']:<24} {column(result['workers'], 7)} {result['ready_s']:>8.2f}"
+            f" {column(result.get('processes'), 6)} {column(result.get('rss_mb'), 8, '.1f')}"
+            f" {column(result.get('pss_mb'), 8, '.1f')}"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,396 @@
+"""Benchmark scenarios for every route in app/api.py, run in-process over ASGI.
+
+The database is whatever app.database was configured with, so the runner in
+__main__ sets DATABASE_URL / USE_ASYNC_DB before importing this module.
+"""
+import asyncio
+import json
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, List, Optional
+
+import httpx
+from starlette.concurrency import run_in_threadpool
+
+from app import admission, auth, database, db, events
+from app.main import app
+from app.models import Priority, TodoBatchUpdateItem, TodoCreate, UserCreate
+from benchmarks.report import summarize
+
+PASSWORD = "benchmark-password"
+SEED_CHUNK_SIZE = 5000
+BATCH_SIZE = 50
+PAGE_SIZE = 50
+IMPORT_SIZE = 1000
+EVENT_STREAM_TIMEOUT_SECONDS = 10
+
+PRIORITIES = [Priority.low, Priority.medium, Priority.high, None]
+CATEGORIES = ["work", "home", "errands", None]
+
+
+@dataclass
+class Dataset:
+    """A benchmark user and the ids of the todos seeded for them"""
+    size: Optional[int]
+    email: str
+    user_id: str
+    token: str
+    todo_ids: List[str] = field(default_factory=list)
+
+    @property
+    def headers(self) -> dict:
+        return {"Authorization": f"Bearer {self.token}"}
+
+
+@dataclass
+class Scenario:
+    endpoint: str
+    # Sends one request and returns its status code; only this call is timed
+    call: Callable[[httpx.AsyncClient, Dataset, int, object], Awaitable[int]]
+    # Untimed setup, given the dataset and request count, run before the batch
+    prepare: Optional[Callable[[Dataset, int], object]] = None
+    ok: tuple = (200,)
+    # Scales with the dataset: runs once per size rather than once overall
+    sized: bool = True
+    # Reads the whole list; capped at heavy_requests per size
+    heavy: bool = False
+    max_concurrency: Optional[int] = None
+
+
+def _todo_create(index: int) -> TodoCreate:
+    return TodoCreate(
+        text=f"Benchmark todo {index}",
+        dueDate=1_700_000_000_000 + index * 60_000 if index % 2 else None,
+        priority=PRIORITIES[index % len(PRIORITIES)],
+        category=CATEGORIES[index % len(CATEGORIES)],
+    )
+
+
+def _new_user(session, password_hash: Optional[str] = None):
+    email = f"bench-{uuid.uuid4().hex[:16]}@example.com"
+    return db.create_user(session, UserCreate(email=email, password=PASSWORD), password_hash=password_hash)
+
+
+def _token(email: str) -> str:
+    return auth.create_access_token(data={"sub": email})
+
+
+def _add_todos(session, user_id: str, count: int, start: int = 0) -> List[str]:
+    ids = []
+    for offset in range(start, start + count, SEED_CHUNK_SIZE):
+        chunk = [_todo_create(i) for i in range(offset, min(offset + SEED_CHUNK_SIZE, start + count))]
+        ids.extend(todo.id for todo in db.create_todos(session, chunk, user_id))
+    return ids
+
+
+def _complete_todos(session, user_id: str, todo_ids: List[str]):
+    """Mark todos completed through the app's batch update, which keeps todo_stats and the version in step"""
+    for offset in range(0, len(todo_ids), SEED_CHUNK_SIZE):
+        chunk = todo_ids[offset:offset + SEED_CHUNK_SIZE]
+        db.update_todos(session, [TodoBatchUpdateItem(id=todo_id, completed=True) for todo_id in chunk], user_id)
+
+
+def seed_dataset(size: Optional[int]) -> Dataset:
+    """Create a user with `size` todos, a third of them completed"""
+    session = database.SessionLocal()
+    try:
+        user = _new_user(session)
+        todo_ids = _add_todos(session, user.id, size or 0)
+        _complete_todos(session, user.id, todo_ids[::3])
+        return Dataset(size=size, email=user.email, user_id=user.id, token=_token(user.email), todo_ids=todo_ids)
+    finally:
+        session.close()
+
+
+def _with_session(fn, *args):
+    session = database.SessionLocal()
+    try:
+        return fn(session, *args)
+    finally:
+        session.close()
+
+
+def _pick(dataset: Dataset, i: int) -> str:
+    # Deterministic spread over the dataset so runs are comparable
+    return dataset.todo_ids[(i * 7919) % len(dataset.todo_ids)]
+
+
+# Reads
+
+async def get_todos(client, dataset, i, data):
+    return (await client.get("/todos", headers=dataset.headers)).status_code
+
+
+async def get_todos_filtered(client, dataset, i, data):
+    params = {"completed": "false", "sort": "-priority"}
+    return (await client.get("/todos", params=params, headers=dataset.headers)).status_code
+
+
+async def get_todos_page(client, dataset, i, data):
+    return (await client.get("/todos", params={"limit": PAGE_SIZE}, headers=dataset.headers)).status_code
+
+
+def prepare_etag(dataset, count):
+    return f'"{_with_session(db.get_todos_version, dataset.user_id)}"'
+
+
+async def get_todos_not_modified(client, dataset, i, etag):
+    headers = {**dataset.headers, "If-None-Match": etag}
+    return (await client.get("/todos", headers=headers)).status_code
+
+
+async def get_todo(client, dataset, i, data):
+    return (await client.get(f"/todos/{_pick(dataset, i)}", headers=dataset.headers)).status_code
+
+
+def prepare_recent_changes(dataset, count):
+    """Make ten separate writes and return the revision from before them"""
+    def write(session):
+        since = db.get_todos_version(session, dataset.user_id)
+        for n in range(10):
+            _add_todos(session, dataset.user_id, 1, start=n)
+        return since
+    return _with_session(write)
+
+
+async def get_changes(client, dataset, i, since):
+    return (await client.get("/todos/changes", params={"since": since}, headers=dataset.headers)).status_code
+
+
+async def get_todo_stats(client, dataset, i, data):
+    return (await client.get("/todos/stats", headers=dataset.headers)).status_code
+
+
+async def export_todos(client, dataset, i, data):
+    params = {"format": "ndjson"}
+    return (await client.get("/todos/export", params=params, headers=dataset.headers)).status_code
+
+
+async def open_event_stream(client, dataset, i, data):
+    """Time from request to the first SSE event, then disconnect.
+
+    Calls the ASGI app directly: httpx's ASGITransport waits for the whole
+    response body, which never ends for an event stream.
+    """
+    first_chunk = asyncio.Event()
+    started = False
+    status_code = 0
+
+    async def receive():
+        nonlocal started
+        if not started:
+            started = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await first_chunk.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status_code
+        if message["type"] == "http.response.start":
+            status_code = message["status"]
+        elif message["type"] == "http.response.body" and (message.get("body") or not message.get("more_body")):
+            first_chunk.set()
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/todos/events",
+        "raw_path": b"/todos/events",
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"host", b"benchmark"), (b"authorization", f"Bearer {dataset.token}".encode())],
+        "client": ("127.0.0.1", 0),
+        "server": ("benchmark", 80),
+    }
+    app_task = asyncio.ensure_future(app(scope, receive, send))
+    try:
+        await asyncio.wait_for(first_chunk.wait(), EVENT_STREAM_TIMEOUT_SECONDS)
+    finally:
+        first_chunk.set()
+        # Let the stream notice the disconnect and unsubscribe before returning
+        await asyncio.wait_for(app_task, EVENT_STREAM_TIMEOUT_SECONDS)
+    return status_code
+
+
+# Writes
+
+async def create_todo(client, dataset, i, data):
+    body = _todo_create(i).model_dump(mode="json")
+    return (await client.post("/todos", json=body, headers=dataset.headers)).status_code
+
+
+async def update_todo(client, dataset, i, data):
+    body = {"completed": bool(i % 2)}
+    return (await client.patch(f"/todos/{_pick(dataset, i)}", json=body, headers=dataset.headers)).status_code
+
+
+def prepare_import(dataset, count):
+    lines = (json.dumps(_todo_create(n).model_dump(mode="json")) for n in range(IMPORT_SIZE))
+    return "\n".join(lines).encode()
+
+
+async def import_todos(client, dataset, i, body):
+    headers = {**dataset.headers, "Content-Type": "application/x-ndjson"}
+    response = await client.post("/todos/import", content=body, headers=headers)
+    # Row errors still answer 200; the last progress line says whether all of them went in
+    progress = json.loads(response.text.splitlines()[-1]) if response.status_code == 200 else {}
+    if progress and (not progress["done"] or progress["failed"]):
+        return 500
+    return response.status_code
+
+
+def prepare_deletable(dataset, count):
+    return _with_session(_add_todos, dataset.user_id, count)
+
+
+async def delete_todo(client, dataset, i, ids):
+    return (await client.delete(f"/todos/{ids[i]}", headers=dataset.headers)).status_code
+
+
+async def create_todos_batch(client, dataset, i, data):
+    items = [_todo_create(i * BATCH_SIZE + n).model_dump(mode="json") for n in range(BATCH_SIZE)]
+    return (await client.post("/todos/batch", json={"items": items}, headers=dataset.headers)).status_code
+
+
+async def update_todos_batch(client, dataset, i, data):
+    ids = {_pick(dataset, i * BATCH_SIZE + n) for n in range(BATCH_SIZE)}
+    items = [{"id": todo_id, "completed": bool(i % 2)} for todo_id in ids]
+    return (await client.patch("/todos/batch", json={"items": items}, headers=dataset.headers)).status_code
+
+
+def prepare_deletable_batches(dataset, count):
+    ids = _with_session(_add_todos, dataset.user_id, count * BATCH_SIZE)
+    return [ids[n:n + BATCH_SIZE] for n in range(0, len(ids), BATCH_SIZE)]
+
+
+async def delete_todos_batch(client, dataset, i, batches):
+    # httpx only sends a body with DELETE through the generic request()
+    response = await client.request("DELETE", "/todos/batch", json={"ids": batches[i]}, headers=dataset.headers)
+    return response.status_code
+
+
+def prepare_completed_users(dataset, count):
+    """One user per request, each with a few completed todos to clear"""
+    def create(session):
+        tokens = []
+        for _ in range(count):
+            user = _new_user(session, password_hash="unused")
+            _complete_todos(session, user.id, _add_todos(session, user.id, 10))
+            tokens.append(_token(user.email))
+        return tokens
+    return _with_session(create)
+
+
+async def delete_completed_todos(client, dataset, i, tokens):
+    headers = {"Authorization": f"Bearer {tokens[i]}"}
+    return (await client.delete("/todos/completed", headers=headers)).status_code
+
+
+# Auth
+
+async def register(client, dataset, i, data):
+    body = {"email": f"bench-{uuid.uuid4().hex[:16]}@example.com", "password": PASSWORD}
+    return (await client.post("/register", json=body)).status_code
+
+
+async def login(client, dataset, i, data):
+    form = {"username": dataset.email, "password": PASSWORD}
+    return (await client.post("/login", data=form)).status_code
+
+
+# Reads come first so the writes don't change what they measure
+SCENARIOS = [
+    Scenario("GET /todos", get_todos, heavy=True),
+    Scenario("GET /todos?completed=false&sort=-priority", get_todos_filtered, heavy=True),
+    Scenario("GET /todos?limit=50", get_todos_page),
+    Scenario("GET /todos (If-None-Match)", get_todos_not_modified, prepare=prepare_etag, ok=(304,)),
+    Scenario("GET /todos/{id}", get_todo),
+    Scenario("GET /todos/changes", get_changes, prepare=prepare_recent_changes),
+    Scenario("GET /todos/stats", get_todo_stats),
+    Scenario(
+        "GET /todos/export", export_todos, heavy=True,
+        max_concurrency=admission.ROUTE_CLASS_LIMITS["bulk"],
+    ),
+    Scenario(
+        "GET /todos/events", open_event_stream,
+        max_concurrency=events.CHANGE_FEED_MAX_CONNECTIONS_PER_USER,
+    ),
+    Scenario("POST /todos", create_todo, ok=(201,)),
+    Scenario("PATCH /todos/{id}", update_todo),
+    Scenario("DELETE /todos/{id}", delete_todo, prepare=prepare_deletable, ok=(204,)),
+    Scenario("POST /todos/batch", create_todos_batch),
+    Scenario("PATCH /todos/batch", update_todos_batch),
+    Scenario("DELETE /todos/batch", delete_todos_batch, prepare=prepare_deletable_batches),
+    Scenario(
+        "POST /todos/import", import_todos, prepare=prepare_import, heavy=True,
+        max_concurrency=admission.ROUTE_CLASS_LIMITS["bulk"],
+    ),
+    Scenario("DELETE /todos/completed", delete_completed_todos, prepare=prepare_completed_users, ok=(204,), sized=False),
+    Scenario("POST /register", register, ok=(201,), sized=False),
+    Scenario("POST /login", login, sized=False),
+]
+
+
+async def run_scenario(
+    client: httpx.AsyncClient, scenario: Scenario, dataset: Dataset, requests: int, concurrency: int
+) -> dict:
+    """Send `requests` requests from `concurrency` concurrent workers"""
+    data = await run_in_threadpool(scenario.prepare, dataset, requests) if scenario.prepare else None
+    if scenario.max_concurrency:
+        concurrency = min(concurrency, scenario.max_concurrency)
+    latencies: List[float] = []
+    errors = 0
+    indexes = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        # The workers share one iterator, so each index is sent exactly once
+        for i in indexes:
+            start = time.perf_counter()
+            try:
+                status_code = await scenario.call(client, dataset, i, data)
+            except Exception:
+                status_code = None
+            latencies.append(time.perf_counter() - start)
+            if status_code not in scenario.ok:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(max(1, min(concurrency, requests)))))
+    elapsed = time.perf_counter() - start
+    return summarize(scenario.endpoint, dataset.size if scenario.sized else None, latencies, errors, elapsed)
+
+
+async def run_suite(
+    sizes: List[int],
+    requests: int = 200,
+    heavy_requests: int = 20,
+    concurrency: int = 10,
+    endpoints: Optional[List[str]] = None,
+    log: Callable[[str], None] = lambda message: None,
+) -> List[dict]:
+    """Seed one dataset per size and run every scenario against it"""
+    scenarios = [s for s in SCENARIOS if endpoints is None or s.endpoint in endpoints]
+    results = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        for size in sizes:
+            log(f"Seeding {size} todos")
+            dataset = await run_in_threadpool(seed_dataset, size)
+            for scenario in scenarios:
+                if not scenario.sized:
+                    continue
+                count = min(requests, heavy_requests) if scenario.heavy else requests
+                log(f"  {scenario.endpoint}")
+                results.append(await run_scenario(client, scenario, dataset, count, concurrency))
+        unsized = [s for s in scenarios if not s.sized]
+        if unsized:
+            dataset = await run_in_threadpool(seed_dataset, None)
+            for scenario in unsized:
+                log(f"  {scenario.endpoint}")
+                results.append(await run_scenario(client, scenario, dataset, requests, concurrency))
+    return results
@@ -1,6 +1,7 @@
-from app.database import init_db
-from app.schema import User, TodoModel
+"""Create the database, or migrate it to the current schema; run before starting the app"""
+from app import migrations
+from app.database import engine
 
-print("Initializing database...")
-init_db()
-print("Database initialized.")
+print("Migrating database...")
+applied = migrations.upgrade(engine, log=print)
+print(f"Database at schema version {migrations.HEAD} ({applied} migrations applied).")
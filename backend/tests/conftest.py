@@ -1,8 +1,14 @@
+import os
 import pytest
 from sqlalchemy import create_engine
+from sqlalchemy.pool import StaticPool
 
-from app.database import configure_test_db, SessionLocal, Base
-from app.schema import TodoModel, User  # Import to register models
+# Cheap Argon2 parameters keep the suite fast; must be set before app.auth is imported
+os.environ.setdefault("PASSWORD_HASH_PROFILE", "fast")
+
+from app import auth, database
+from app.database import configure_test_db, Base
+from app.schema import TodoModel, TodoStat, TodoTombstone, User  # Import to register models
 from fastapi.testclient import TestClient
 from app.main import app
 
@@ -14,7 +20,8 @@ def setup_test_database():
     """Configure test database once for all tests"""
     test_engine = create_engine(
         SQLALCHEMY_TEST_DATABASE_URL,
-        connect_args={"check_same_thread": False}
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
     )
     print(f"DEBUG: setup_test_database calling configure_test_db. Tables: {Base.metadata.tables.keys()}")
     configure_test_db(test_engine)
@@ -23,13 +30,16 @@ def setup_test_database():
 @pytest.fixture(scope="function", autouse=True)
 def clear_db():
     """Clear database before each test"""
-    db = SessionLocal()
+    db = database.SessionLocal()
     try:
         db.query(TodoModel).delete()
+        db.query(TodoTombstone).delete()
+        db.query(TodoStat).delete()
         db.query(User).delete()
         db.commit()
     finally:
         db.close()
+    auth.principal_cache.clear()
     yield
 
 @pytest.fixture(scope="module")
@@ -0,0 +1,132 @@
+import asyncio
+
+import pytest
+
+from app import admission
+from app.admission import AdmissionController
+from tests.test_api import create_test_user, get_auth_token
+
+
+def _controller(max_in_flight=0, read=1, write=0, per_client=0, queue_size=8, queue_timeout=1.0):
+    return AdmissionController(max_in_flight, {"read": read, "write": write}, per_client, queue_size, queue_timeout)
+
+
+def test_waiters_are_admitted_in_turn_or_shed_when_queue_is_full():
+    async def scenario():
+        controller = _controller(queue_size=1)
+        assert await controller.acquire("read", "a") is None
+        waiting = asyncio.ensure_future(controller.acquire("read", "b"))
+        await asyncio.sleep(0)
+        assert await controller.acquire("read", "c") == 503
+        assert await controller.acquire("write", "c") is None  # other classes are unaffected
+        controller.release("read", "a")
+        assert await waiting is None
+        assert controller.class_in_flight == {"read": 1, "write": 1}
+
+    asyncio.run(scenario())
+
+
+def test_queued_requests_time_out_with_503():
+    async def scenario():
+        controller = _controller(queue_timeout=0.01)
+        assert await controller.acquire("read", "a") is None
+        assert await controller.acquire("read", "b") == 503
+        assert controller.client_requests == {"a": 1}
+        controller.release("read", "a")
+        assert controller.in_flight == 0 and controller.client_requests == {}
+
+    asyncio.run(scenario())
+
+
+def test_freed_slots_rotate_between_clients():
+    async def scenario():
+        controller = _controller()
+        admitted = []
+
+        async def request(client):
+            await controller.acquire("read", client)
+            admitted.append(client)
+
+        await controller.acquire("read", "first")
+        tasks = [asyncio.ensure_future(request(client)) for client in ("greedy", "greedy", "greedy", "polite")]
+        await asyncio.sleep(0)
+        for client in ["first", "greedy", "polite", "greedy"]:
+            controller.release("read", client)
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        assert admitted == ["greedy", "polite", "greedy", "greedy"]
+
+    asyncio.run(scenario())
+
+
+def test_per_client_limit_answers_429():
+    async def scenario():
+        controller = _controller(read=0, per_client=2)
+        assert await controller.acquire("read", "a") is None
+        assert await controller.acquire("read", "a") is None
+        assert await controller.acquire("read", "a") == 429
+        assert await controller.acquire("read", "b") is None
+
+    asyncio.run(scenario())
+
+
+def test_worker_limit_applies_across_classes():
+    async def scenario():
+        controller = _controller(max_in_flight=1, read=0, queue_timeout=1.0)
+        assert await controller.acquire("read", "a") is None
+        waiting = asyncio.ensure_future(controller.acquire("write", "b"))
+        await asyncio.sleep(0)
+        assert not waiting.done()
+        controller.release("read", "a")
+        assert await waiting is None
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        controller = _controller()
+        await controller.acquire("read", "a")
+        waiting = asyncio.ensure_future(controller.acquire("read", "b"))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        controller.release("read", "a")
+        assert controller.in_flight == 0 and controller.client_requests == {}
+
+    asyncio.run(scenario())
+
+
+def test_route_classes():
+    assert admission.route_class("POST", "/login") == "auth"
+    assert admission.route_class("POST", "/todos/import") == "bulk"
+    assert admission.route_class("GET", "/todos/{id}") == "read"
+    assert admission.route_class("PATCH", "/todos/{id}") == "write"
+    assert admission.route_class("GET", "/todos/events") is None
+
+
+@pytest.fixture
+def saturated_reads(monkeypatch):
+    """Every read slot of the app's controller taken, with a near-instant queue timeout"""
+    controller = admission.controller
+    monkeypatch.setitem(controller.class_limits, "read", 1)
+    monkeypatch.setattr(controller, "queue_timeout", 0.01)
+    controller.in_flight += 1
+    controller.class_in_flight["read"] += 1
+    yield
+    controller.in_flight -= 1
+    controller.class_in_flight["read"] -= 1
+
+
+def test_saturated_class_sheds_with_retry_after(client, saturated_reads):
+    create_test_user(client)
+    headers = {"Authorization": f"Bearer {get_auth_token(client)}"}
+
+    response = client.get("/todos", headers=headers)
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert response.json() == {"detail": "Server busy, please retry"}
+    # Writes, auth and metrics have slots of their own
+    assert client.post("/todos", json={"text": "Still works"}, headers=headers).status_code == 201
+    assert 'admission_rejected_total{reason="queue_timeout",route_class="read"}' in client.get("/metrics").text
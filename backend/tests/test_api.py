@@ -210,3 +210,731 @@ def test_token_isolation_between_users(client):
     todos = response.json()
     assert len(todos) == 1
     assert todos[0]["text"] == "User 2 todo"
+
+
+def test_get_todos_paginated(client):
+    """Test cursor pagination walks every todo exactly once"""
+    create_test_user(client)
+    token = get_auth_token(client)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    for i in range(5):
+        client.post("/todos", json={"text": f"Todo {i}"}, headers=headers)
+
+    seen = []
+    response = client.get("/todos?limit=2", headers=headers)
+    assert response.status_code == 200
+    assert len(response.json()) == 2
+    seen.extend(todo["text"] for todo in response.json())
+
+    while "X-Next-Cursor" in response.headers:
+        cursor = response.headers["X-Next-Cursor"]
+        response = client.get(f"/todos?limit=2&cursor={cursor}", headers=headers)
+        assert response.status_code == 200
+        seen.extend(todo["text"] for todo in response.json())
+
+    assert sorted(seen) == [f"Todo {i}" for i in range(5)]
+
+
+def test_get_todos_unpaginated_has_no_cursor(client):
+    """Test that the plain list response is unchanged"""
+    create_test_user(client)
+    token = get_auth_token(client)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    client.post("/todos", json={"text": "Todo 1"}, headers=headers)
+
+    response = client.get("/todos", headers=headers)
+    assert response.status_code == 200
+    assert len(response.json()) == 1
+    assert "X-Next-Cursor" not in response.headers
+
+
+def test_get_todos_invalid_cursor(client):
+    """Test that a malformed cursor is rejected"""
+    create_test_user(client)
+    token = get_auth_token(client)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    response = client.get("/todos?limit=2&cursor=not-a-cursor", headers=headers)
+    assert response.status_code == 400
+
+
+def test_get_todos_filtered(client):
+    """Test that query parameters filter todos on the server"""
+    create_test_user(client)
+    token = get_auth_token(client)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    client.post("/todos", json={"text": "Work high", "category": "work", "priority": "high"}, headers=headers)
+    client.post("/todos", json={"text": "Home low", "category": "home", "priority": "low"}, headers=headers)
+    done = client.post("/todos", json={"text": "Work done", "category": "work"}, headers=headers)
+    client.patch(f"/todos/{done.json()['id']}", json={"completed": True}, headers=headers)
+
+    response = client.get("/todos?category=work", headers=headers)
+    assert sorted(todo["text"] for todo in response.json()) == ["Work done", "Work high"]
+
+    response = client.get("/todos?category=work&completed=false", headers=headers)
+    assert [todo["text"] for todo in response.json()] == ["Work high"]
+
+    response = client.get("/todos?priority=low", headers=headers)
+    assert [todo["text"] for todo in response.json()] == ["Home low"]
+
+
+def test_get_todos_due_range_and_overdue(client):
+    """Test due date range and overdue filters"""
+    create_test_user(client)
+    token = get_auth_token(client)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    client.post("/todos", json={"text": "Past", "dueDate": 1000}, headers=headers)
+    client.post("/todos", json={"text": "Future", "dueDate": 4102444800000}, headers=headers)
+    client.post("/todos", json={"text": "No date"}, headers=headers)
+
+    response = client.get("/todos?overdue=true", headers=headers)
+    assert [todo["text"] for todo in response.json()] == ["Past"]
+
+    response = client.get("/todos?overdue=false", headers=headers)
+    assert sorted(todo["text"] for todo in response.json()) == ["Future", "No date"]
+
+    response = client.get("/todos?dueAfter=2000", headers=headers)
+    assert [todo["text"] for todo in response.json()] == ["Future"]
+
+    response = client.get("/todos?dueBefore=2000", headers=headers)
+    assert [todo["text"] for todo in response.json()] == ["Past"]
+
+
+def test_get_todos_sorted(client):
+    """Test server-side sort orders"""
+    create_test_user(client)
+    token = get_auth_token(client)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    client.post("/todos", json={"text": "Medium", "priority": "medium", "dueDate": 3000}, headers=headers)
+    client.post("/todos", json={"text": "None"}, headers=headers)
+    client.post("/todos", json={"text": "High", "priority": "high", "dueDate": 1000}, headers=headers)
+    client.post("/todos", json={"text": "Low", "priority": "low", "dueDate": 2000}, headers=headers)
+
+    response = client.get("/todos?sort=-priority", headers=headers)
+    assert [todo["text"] for todo in response.json()] == ["High", "Medium", "Low", "None"]
+
+    response = client.get("/todos?sort=dueDate", headers=headers)
+    assert [todo["text"] for todo in response.json()] == ["High", "Low", "Medium", "None"]
+
+    response = client.get("/todos?sort=dueDate&limit=2", headers=headers)
+    assert response.status_code == 400
+
+
+def test_current_user_is_cached(client):
+    """Test that repeated requests with one token skip the user lookup"""
+    from app.auth import principal_cache
+
+    create_test_user(client)
+    token = get_auth_token(client)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    client.get("/todos", headers=headers)
+    hits = principal_cache.hits
+    client.get("/todos", headers=headers)
+    assert principal_cache.hits == hits + 1
+
+
+def test_login_rehashes_outdated_password_hash(client):
+    """Test that logging in upgrades a hash made with old parameters"""
+    from app import database
+    from app.auth import pwd_context
+    from app.schema import User
+    from passlib.context import CryptContext
+
+    create_test_user(client)
+    old_context = CryptContext(
+        schemes=["argon2"], argon2__rounds=2, argon2__memory_cost=512, argon2__parallelism=1
+    )
+    session = database.SessionLocal()
+    try:
+        user = session.query(User).filter(User.email == "test@example.com").first()
+        user.password_hash = old_context.hash("password123")
+        session.commit()
+
+        get_auth_token(client)
+
+        session.expire_all()
+        user = session.query(User).filter(User.email == "test@example.com").first()
+        assert not pwd_context.needs_update(user.password_hash)
+    finally:
+        session.close()
+
+
+def test_batch_create_update_delete(client):
+    """Test the batch endpoints apply many changes with per-item results"""
+    create_test_user(client)
+    token = get_auth_token(client)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    response = client.post(
+        "/todos/batch",
+        json={"items": [{"text": "One"}, {"text": "Two", "priority": "high"}, {"text": "Three"}]},
+        headers=headers,
+    )
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [result["status"] for result in results] == [201, 201, 201]
+    ids = [result["id"] for result in results]
+    assert [todo["text"] for todo in client.get("/todos", headers=headers).json()] == ["One", "Two", "Three"]
+
+    response = client.patch(
+        "/todos/batch",
+        json={"items": [
+            {"id": ids[0], "completed": True},
+            {"id": ids[1], "category": "work", "text": "Two!"},
+            {"id": "missing", "completed": True},
+        ]},
+        headers=headers,
+    )
+    results = response.json()["results"]
+    assert [result["status"] for result in results] == [200, 200, 404]
+    assert results[0]["todo"]["completed"] is True
+    assert results[1]["todo"]["text"] == "Two!"
+    assert results[1]["todo"]["category"] == "work"
+    assert results[1]["todo"]["priority"] == "high"
+
+    response = client.request("DELETE", "/todos/batch", json={"ids": [ids[0], ids[2], "missing"]}, headers=headers)
+    assert [result["status"] for result in response.json()["results"]] == [204, 204, 404]
+    assert [todo["text"] for todo in client.get("/todos", headers=headers).json()] == ["Two!"]
+
+
+def test_batch_only_touches_own_todos(client):
+    """Test that batch updates and deletes ignore other users' todos"""
+    create_test_user(client)
+    token = get_auth_token(client)
+    headers1 = {"Authorization": f"Bearer {token}"}
+    todo_id = client.post("/todos", json={"text": "Mine"}, headers=headers1).json()["id"]
+
+    client.post("/register", json={"email": "user2@example.com", "password": "password123"})
+    response = client.post("/login", data={"username": "user2@example.com", "password": "password123"})
+    headers2 = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    response = client.patch("/todos/batch", json={"items": [{"id": todo_id, "text": "Stolen"}]}, headers=headers2)
+    assert response.json()["results"][0]["status"] == 404
+    response = client.request("DELETE", "/todos/batch", json={"ids": [todo_id]}, headers=headers2)
+    assert response.json()["results"][0]["status"] == 404
+
+    assert client.get("/todos", headers=headers1).json()[0]["text"] == "Mine"
+
+
+def test_batch_update_rejects_duplicate_ids(client):
+    create_test_user(client)
+    token = get_auth_token(client)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    response = client.patch(
+        "/todos/batch",
+        json={"items": [{"id": "a", "completed": True}, {"id": "a", "completed": False}]},
+        headers=headers,
+    )
+    assert response.status_code == 400
+
+
+def test_batch_accepts_ids_in_any_uuid_spelling(client):
+    """Test that uppercase or unhyphenated ids find their todos rather than a false 404"""
+    create_test_user(client)
+    token = get_auth_token(client)
+    headers = {"Authorization": f"Bearer {token}"}
+    first, second = (client.post("/todos", json={"text": text}, headers=headers).json()["id"] for text in "AB")
+
+    items = [{"id": first.upper(), "completed": True}, {"id": second.replace("-", ""), "text": "B!"}]
+    response = client.patch("/todos/batch", json={"items": items}, headers=headers)
+    assert [result["status"] for result in response.json()["results"]] == [200, 200]
+    assert [result["id"] for result in response.json()["results"]] == [first, second]
+
+    # The same todo in two spellings is still a duplicate
+    items = [{"id": first, "completed": False}, {"id": first.upper(), "completed": True}]
+    assert client.patch("/todos/batch", json={"items": items}, headers=headers).status_code == 400
+
+    response = client.request("DELETE", "/todos/batch", json={"ids": [first.upper(), second]}, headers=headers)
+    assert [result["status"] for result in response.json()["results"]] == [204, 204]
+    assert client.get("/todos", headers=headers).json() == []
+
+
+def test_get_todos_etag_not_modified(client):
+    """Test conditional GET answers 304 until the user's todos change"""
+    create_test_user(client)
+    token = get_auth_token(client)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    client.post("/todos", json={"text": "Todo 1"}, headers=headers)
+    response = client.get("/todos", headers=headers)
+    etag = response.headers["ETag"]
+
+    response = client.get("/todos", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+
+    client.post("/todos", json={"text": "Todo 2"}, headers=headers)
+    response = client.get("/todos", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert len(response.json()) == 2
+    assert response.headers["ETag"] != etag
+
+
+def test_get_single_todo_with_etag(client):
+    create_test_user(client)
+    token = get_auth_token(client)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    todo_id = client.post("/todos", json={"text": "Todo 1"}, headers=headers).json()["id"]
+    response = client.get(f"/todos/{todo_id}", headers=headers)
+    assert response.status_code == 200
+    assert response.json()["text"] == "Todo 1"
+
+    response = client.get(f"/todos/{todo_id}", headers={**headers, "If-None-Match": response.headers["ETag"]})
+    assert response.status_code == 304
+
+    assert client.get("/todos/missing", headers=headers).status_code == 404
+
+
+def test_update_todo_if_match(client):
+    """Test that If-Match prevents lost updates"""
+    create_test_user(client)
+    token = get_auth_token(client)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    todo_id = client.post("/todos", json={"text": "Original"}, headers=headers).json()["id"]
+    etag = client.get(f"/todos/{todo_id}", headers=headers).headers["ETag"]
+
+    response = client.patch(f"/todos/{todo_id}", json={"text": "First"}, headers={**headers, "If-Match": etag})
+    assert response.status_code == 200
+
+    # A second writer still holding the old ETag is rejected
+    response = client.patch(f"/todos/{todo_id}", json={"text": "Second"}, headers={**headers, "If-Match": etag})
+    assert response.status_code == 412
+    assert client.get(f"/todos/{todo_id}", headers=headers).json()["text"] == "First"
+
+
+def test_update_todo_weak_if_match(client):
+    """Test that a weakened copy of our ETag is compared rather than rejected"""
+    create_test_user(client)
+    token = get_auth_token(client)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    todo_id = client.post("/todos", json={"text": "Original"}, headers=headers).json()["id"]
+    etag = client.get(f"/todos/{todo_id}", headers=headers).headers["ETag"]
+
+    response = client.patch(f"/todos/{todo_id}", json={"text": "First"}, headers={**headers, "If-Match": f"W/{etag}"})
+    assert response.status_code == 200
+
+    response = client.patch(f"/todos/{todo_id}", json={"text": "Second"}, headers={**headers, "If-Match": f"W/{etag}"})
+    assert response.status_code == 412
+    assert client.get(f"/todos/{todo_id}", headers=headers).json()["text"] == "First"
+
+
+def test_todo_changes_since_revision(client):
+    """Test delta sync returns only rows changed or deleted since a revision"""
+    create_test_user(client)
+    token = get_auth_token(client)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    keep_id = client.post("/todos", json={"text": "Keep"}, headers=headers).json()["id"]
+    edit_id = client.post("/todos", json={"text": "Edit"}, headers=headers).json()["id"]
+    drop_id = client.post("/todos", json={"text": "Drop"}, headers=headers).json()["id"]
+
+    response = client.get("/todos/changes", headers=headers)
+    assert response.status_code == 200
+    full = response.json()
+    assert [todo["id"] for todo in full["changed"]] == [keep_id, edit_id, drop_id]
+    assert full["deleted"] == []
+
+    client.patch(f"/todos/{edit_id}", json={"text": "Edited"}, headers=headers)
+    client.delete(f"/todos/{drop_id}", headers=headers)
+
+    delta = client.get(f"/todos/changes?since={full['revision']}", headers=headers).json()
+    assert [todo["text"] for todo in delta["changed"]] == ["Edited"]
+    assert delta["deleted"] == [drop_id]
+    assert delta["revision"] > full["revision"]
+
+    nothing = client.get(f"/todos/changes?since={delta['revision']}", headers=headers).json()
+    assert nothing == {"changed": [], "deleted": [], "revision": delta["revision"]}
+
+
+def test_todo_changes_after_tombstones_purged(client):
+    """Test that a sync point older than purged tombstones must reload"""
+    from app import database, db
+
+    create_test_user(client)
+    token = get_auth_token(client)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    todo_id = client.post("/todos", json={"text": "Done"}, headers=headers).json()["id"]
+    client.patch(f"/todos/{todo_id}", json={"completed": True}, headers=headers)
+    client.delete("/todos/completed", headers=headers)
+    assert client.get("/todos/changes?since=1", headers=headers).json()["deleted"] == [todo_id]
+
+    session = database.SessionLocal()
+    try:
+        assert db.purge_tombstones(session, older_than=2**62, batch_size=1) == 1
+    finally:
+        session.close()
+
+    assert client.get("/todos/changes?since=1", headers=headers).status_code == 410
+    response = client.get("/todos/changes?since=3", headers=headers)
+    assert response.status_code == 200
+    assert response.json()["deleted"] == []
+
+
+def test_get_todos_fast_path_matches_model_serialization(client, monkeypatch):
+    """Test the streamed list is byte-for-byte the serialized List[Todo]"""
+    import json
+    from fastapi.encoders import jsonable_encoder
+    from app import database, db, encoding
+
+    create_test_user(client)
+    token = get_auth_token(client)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    client.post(
+        "/todos",
+        json={"text": "Café \"quoted\" \\ \x01 \U0001F600", "dueDate": 123, "priority": "high", "category": "ü"},
+        headers=headers,
+    )
+    for i in range(4):
+        client.post("/todos", json={"text": f"Todo {i}"}, headers=headers)
+
+    session = database.SessionLocal()
+    try:
+        user_id = session.query(database.Base.metadata.tables["users"]).first().id
+        expected = json.dumps(
+            jsonable_encoder(db.get_todos_page(session, user_id, limit=10)[0]), ensure_ascii=False, separators=(",", ":")
+        ).encode()
+        # Chunk boundaries must not change the output
+        assert b"".join(db.iter_todos(session, user_id, chunk_size=2)) == expected
+    finally:
+        session.close()
+
+    response = client.get("/todos", headers=headers)
+    assert response.headers["content-type"] == "application/json"
+    assert response.content == expected
+
+    # The stdlib fallback encoder produces the same bytes as orjson
+    monkeypatch.setattr(encoding, "orjson", None)
+    assert client.get("/todos", headers=headers).content == expected
+
+
+def test_get_todos_stream_needs_one_pooled_connection(client, tmp_path, monkeypatch):
+    """Test the request's session is released before the list is streamed on another"""
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from sqlalchemy.pool import QueuePool
+    from app import database
+
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'one-connection.db'}",
+        connect_args={"check_same_thread": False},
+        poolclass=QueuePool, pool_size=1, max_overflow=0, pool_timeout=1,
+    )
+    database.Base.metadata.create_all(bind=engine)
+    monkeypatch.setattr(database, "SessionLocal", sessionmaker(autocommit=False, autoflush=False, bind=engine))
+
+    create_test_user(client)
+    token = get_auth_token(client)
+    headers = {"Authorization": f"Bearer {token}"}
+    client.post("/todos", json={"text": "Only one connection"}, headers=headers)
+
+    response = client.get("/todos", headers=headers)
+    assert [todo["text"] for todo in response.json()] == ["Only one connection"]
+    engine.dispose()
+
+
+def _recount(todos):
+    """The stats /todos/stats should report for a list of todos"""
+    def counts(selected):
+        return {"open": sum(not t["completed"] for t in selected), "completed": sum(t["completed"] for t in selected)}
+
+    categories = sorted({t["category"] for t in todos}, key=lambda c: (c is None, c or ""))
+    priorities = [p for p in ("low", "medium", "high", None) if any(t["priority"] == p for t in todos)]
+    return {
+        "total": len(todos),
+        **counts(todos),
+        "byCategory": [{"category": c, **counts([t for t in todos if t["category"] == c])} for c in categories],
+        "byPriority": [{"priority": p, **counts([t for t in todos if t["priority"] == p])} for p in priorities],
+    }
+
+
+def test_todo_stats_follow_every_write(client):
+    """Test that the stats counters match a recount after each kind of write"""
+    create_test_user(client)
+    token = get_auth_token(client)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    def check():
+        stats = client.get("/todos/stats", headers=headers).json()
+        expected = _recount(client.get("/todos", headers=headers).json())
+        assert {key: value for key, value in stats.items() if key != "overdue"} == expected
+
+    first = client.post("/todos", json={"text": "One", "category": "work", "priority": "high"}, headers=headers).json()
+    second = client.post("/todos", json={"text": "Two"}, headers=headers).json()
+    check()
+    client.patch(f"/todos/{first['id']}", json={"completed": True, "category": "home"}, headers=headers)
+    check()
+    client.patch(f"/todos/{second['id']}", json={"priority": "low"}, headers=headers)
+    check()
+    client.delete(f"/todos/{second['id']}", headers=headers)
+    check()
+    client.delete("/todos/completed", headers=headers)
+    check()
+
+    results = client.post(
+        "/todos/batch",
+        json={"items": [{"text": "A", "category": "work"}, {"text": "B", "priority": "medium"}, {"text": "C"}]},
+        headers=headers,
+    ).json()["results"]
+    ids = [result["id"] for result in results]
+    check()
+    client.patch(
+        "/todos/batch",
+        json={"items": [{"id": ids[0], "completed": True}, {"id": ids[1], "category": "work", "priority": "high"}]},
+        headers=headers,
+    )
+    check()
+    client.request("DELETE", "/todos/batch", json={"ids": [ids[0], ids[2]]}, headers=headers)
+    check()
+    assert client.get("/todos/stats", headers=headers).json()["byCategory"] == [
+        {"category": "work", "open": 1, "completed": 0}
+    ]
+
+
+def test_todo_stats_overdue(client):
+    """Test that only open todos due in the past count as overdue"""
+    create_test_user(client)
+    token = get_auth_token(client)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    client.post("/todos", json={"text": "Late", "dueDate": 1000}, headers=headers)
+    done = client.post("/todos", json={"text": "Late but done", "dueDate": 1000}, headers=headers).json()
+    client.patch(f"/todos/{done['id']}", json={"completed": True}, headers=headers)
+    client.post("/todos", json={"text": "Future", "dueDate": 4102444800000}, headers=headers)
+    client.post("/todos", json={"text": "Whenever"}, headers=headers)
+
+    stats = client.get("/todos/stats", headers=headers).json()
+    assert (stats["total"], stats["open"], stats["completed"], stats["overdue"]) == (4, 3, 1, 1)
+
+
+def test_todo_stats_requires_auth(client):
+    assert client.get("/todos/stats").status_code == 401
+
+
+def test_todo_stats_reconcile_repairs_drift(client):
+    """Test that missing or corrupted counters are rebuilt from the todos"""
+    from sqlalchemy import event
+    from app import database, db
+    from app.schema import TodoStat
+
+    create_test_user(client)
+    token = get_auth_token(client)
+    headers = {"Authorization": f"Bearer {token}"}
+    client.post("/todos", json={"text": "One", "category": "work"}, headers=headers)
+    client.post("/todos", json={"text": "Two", "priority": "low"}, headers=headers)
+    expected = client.get("/todos/stats", headers=headers).json()
+
+    session = database.SessionLocal()
+    try:
+        session.query(TodoStat).filter(TodoStat.dimension == "category").update({"open_count": 7})
+        user_id = session.query(TodoStat.user_id).first()[0]
+        session.add(TodoStat(user_id=user_id, dimension="category", key="gone", open_count=3, completed_count=0))
+        session.commit()
+        assert db.reconcile_all_todo_stats(session) == 3
+
+        # Counts that agree are left alone without taking the user's row lock
+        writes = []
+        record_writes = lambda conn, cursor, statement, *args: writes.append(statement)
+        event.listen(database.engine, "before_cursor_execute", record_writes)
+        try:
+            assert db.reconcile_all_todo_stats(session) == 0
+        finally:
+            event.remove(database.engine, "before_cursor_execute", record_writes)
+        assert not [statement for statement in writes if not statement.lstrip().upper().startswith("SELECT")]
+    finally:
+        session.close()
+    assert client.get("/todos/stats", headers=headers).json() == expected
+
+    # Users whose todos predate the counters are backfilled on first read
+    session = database.SessionLocal()
+    try:
+        session.query(TodoStat).delete()
+        session.commit()
+    finally:
+        session.close()
+    assert client.get("/todos/stats", headers=headers).json() == expected
+
+
+def test_export_todos_ndjson_and_csv(client):
+    """Test that exports stream every todo, oldest first, in both formats"""
+    import csv
+    import json
+
+    create_test_user(client)
+    token = get_auth_token(client)
+    headers = {"Authorization": f"Bearer {token}"}
+    client.post("/todos", json={"text": "Plain"}, headers=headers)
+    client.post(
+        "/todos", json={"text": 'Say "hi",\nthen leave', "priority": "high", "category": "work", "dueDate": 5},
+        headers=headers,
+    )
+    todos = client.get("/todos", headers=headers).json()
+
+    response = client.get("/todos/export", headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert response.headers["content-disposition"] == 'attachment; filename="todos.ndjson"'
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert rows == [{key: value for key, value in todo.items() if key != "user_id"} for todo in todos]
+
+    response = client.get("/todos/export?format=csv", headers=headers)
+    assert response.headers["content-type"] == "text/csv; charset=utf-8"
+    records = list(csv.DictReader(response.text.splitlines(keepends=True)))
+    assert [record["text"] for record in records] == ["Plain", 'Say "hi",\nthen leave']
+    assert records[0]["priority"] == "" and records[0]["completed"] == "false"
+    assert records[1]["dueDate"] == "5" and records[1]["category"] == "work"
+
+    assert client.get("/todos/export?format=xml", headers=headers).status_code == 422
+    assert client.get("/todos/export").status_code == 401
+
+
+def test_import_todos_ndjson_reports_progress_and_errors(client, monkeypatch):
+    """Test that an NDJSON import inserts valid rows in chunks and reports bad ones"""
+    import json
+    from app import transfer
+
+    monkeypatch.setattr(transfer, "IMPORT_CHUNK_SIZE", 2)
+    create_test_user(client)
+    token = get_auth_token(client)
+    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/x-ndjson"}
+
+    def upload():
+        # Split mid-line to exercise reassembly of streamed chunks
+        yield b'{"text": "One", "completed": true, "createdAt": 10}\n{"text": "Tw'
+        yield b'o", "priority": "low"}\n\nnot json\n{"text": "Bad", "priority": "urgent"}\n'
+        yield b'{"text": "Three", "category": "home"}\n{"text": "Four"}'
+
+    response = client.post("/todos/import", content=upload(), headers=headers)
+    assert response.status_code == 200
+    assert [json.loads(line) for line in response.text.splitlines()] == [
+        {"imported": 2, "failed": 0},
+        {"line": 4, "error": "Invalid JSON"},
+        {"line": 5, "error": "priority: Input should be 'low', 'medium' or 'high'"},
+        {"imported": 4, "failed": 2},
+        {"imported": 4, "failed": 2, "done": True},
+    ]
+
+    todos = client.get("/todos", headers=headers).json()
+    assert [todo["text"] for todo in todos] == ["One", "Two", "Three", "Four"]
+    assert todos[0]["completed"] is True and todos[0]["createdAt"] == 10
+    stats = client.get("/todos/stats", headers=headers).json()
+    assert (stats["total"], stats["completed"]) == (4, 1)
+
+
+def test_import_todos_csv_round_trips_an_export(client):
+    """Test that a CSV export imports back as copies of the same todos"""
+    create_test_user(client)
+    token = get_auth_token(client)
+    headers = {"Authorization": f"Bearer {token}"}
+    client.post("/todos", json={"text": 'Quote "this",\nplease', "category": "work", "dueDate": 7}, headers=headers)
+    done = client.post("/todos", json={"text": "Done", "priority": "medium"}, headers=headers).json()
+    client.patch(f"/todos/{done['id']}", json={"completed": True}, headers=headers)
+    exported = client.get("/todos/export?format=csv", headers=headers).content
+
+    response = client.post(
+        "/todos/import", content=exported, headers={**headers, "Content-Type": "text/csv; charset=utf-8"}
+    )
+    assert response.text.splitlines()[-1] == '{"imported":2,"failed":0,"done":true}'
+    todos = client.get("/todos", headers=headers).json()
+    assert len({todo["id"] for todo in todos}) == 4
+    # Copies keep their original's createdAt, so the list holds them in pairs
+    fields = ("text", "completed", "createdAt", "dueDate", "priority", "category")
+    assert [{key: todo[key] for key in fields} for todo in todos[::2]] == [
+        {key: todo[key] for key in fields} for todo in todos[1::2]
+    ]
+
+
+def test_import_todos_rejects_unusable_uploads(client, monkeypatch):
+    """Test unsupported content types, missing CSV headers and overlong lines"""
+    import json
+    from app import transfer
+
+    create_test_user(client)
+    token = get_auth_token(client)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    assert client.post("/todos/import", content=b"{}", headers={**headers, "Content-Type": "application/json"}).status_code == 415
+    assert client.post("/todos/import", content=b"", headers={"Content-Type": "text/csv"}).status_code == 401
+
+    response = client.post("/todos/import", content=b"title\nx\n", headers={**headers, "Content-Type": "text/csv"})
+    assert json.loads(response.text) == {
+        "imported": 0, "failed": 0, "done": False, "error": "The CSV header has no text column",
+    }
+
+    monkeypatch.setattr(transfer, "IMPORT_MAX_LINE_BYTES", 100)
+    body = b'{"text": "Fine"}\n' + b'{"text": "' + b"x" * 200
+    response = client.post("/todos/import", content=body, headers={**headers, "Content-Type": "application/x-ndjson"})
+    assert json.loads(response.text.splitlines()[-1])["done"] is False
+    assert client.get("/todos", headers=headers).json() == []
+
+
+def _statements(client, method, url, **kwargs):
+    """Status of a request and the (verb, table) of every SQL statement it ran"""
+    import re
+    from sqlalchemy import event
+    from app import database
+
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        verb, table = re.match(r"\s*(\w+)\s+(?:INTO\s+|FROM\s+|.*?\sFROM\s+)?(\w+)", statement, re.S).groups()
+        # Transaction control differs with GROUP_COMMIT
+        if verb.upper() not in ("BEGIN", "SAVEPOINT", "RELEASE", "COMMIT", "ROLLBACK"):
+            statements.append((verb.upper(), table))
+
+    engine = database.SessionLocal.kw["bind"]
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        response = client.request(method, url, **kwargs)
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    return response.status_code, statements
+
+
+def test_write_endpoints_touch_each_table_once(client):
+    """Test that writes change each row set with one statement and read nothing back"""
+    create_test_user(client)
+    token = get_auth_token(client)
+    headers = {"Authorization": f"Bearer {token}"}
+    client.get("/todos/stats", headers=headers)  # caches the principal
+    bump = ("UPDATE", "users")
+    insert_stats = ("INSERT", "todo_stats")
+    delete_with_tombstones = [bump, ("INSERT", "todo_tombstones"), ("DELETE", "todos"), insert_stats]
+
+    status, statements = _statements(client, "POST", "/todos", json={"text": "One"}, headers=headers)
+    assert (status, statements) == (201, [bump, ("INSERT", "todos"), insert_stats])
+    todo_id = client.get("/todos", headers=headers).json()[0]["id"]
+
+    status, statements = _statements(client, "PATCH", f"/todos/{todo_id}", json={"text": "Two"}, headers=headers)
+    assert (status, statements) == (200, [bump, ("UPDATE", "todos")])
+    # Moving a todo between stats rows needs its old values
+    status, statements = _statements(
+        client, "PATCH", f"/todos/{todo_id}", json={"completed": True}, headers=headers
+    )
+    assert (status, statements) == (200, [bump, ("SELECT", "todos"), ("UPDATE", "todos"), insert_stats])
+    status, statements = _statements(client, "DELETE", "/todos/completed", headers=headers)
+    assert (status, statements) == (204, delete_with_tombstones)
+
+    batch = {"items": [{"text": "A"}, {"text": "B"}]}
+    status, statements = _statements(client, "POST", "/todos/batch", json=batch, headers=headers)
+    assert (status, statements) == (200, [bump, ("INSERT", "todos"), insert_stats])
+    ids = [todo["id"] for todo in client.get("/todos", headers=headers).json()]
+    status, statements = _statements(
+        client, "PATCH", "/todos/batch", json={"items": [{"id": id, "completed": True} for id in ids]}, headers=headers
+    )
+    assert (status, statements) == (200, [bump, ("SELECT", "todos"), ("UPDATE", "todos"), insert_stats])
+    status, statements = _statements(client, "DELETE", f"/todos/{ids[0]}", headers=headers)
+    assert (status, statements) == (204, delete_with_tombstones)
+    status, statements = _statements(client, "DELETE", "/todos/batch", json={"ids": ids}, headers=headers)
+    assert (status, statements) == (200, delete_with_tombstones)
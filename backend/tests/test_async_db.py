@@ -0,0 +1,67 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.pool import NullPool
+
+from app import auth, database, encoding
+from app.database import Base
+from app.main import app
+
+pytest.importorskip("aiosqlite")
+pytest.importorskip("greenlet")
+
+
+@pytest.fixture
+def async_client(tmp_path, monkeypatch):
+    """Test client serving requests through an AsyncSession on aiosqlite"""
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    db_file = tmp_path / "async.db"
+    sync_engine = create_engine(f"sqlite:///{db_file}")
+    Base.metadata.create_all(bind=sync_engine)
+    sync_engine.dispose()
+
+    monkeypatch.setattr(database, "USE_ASYNC_DB", True)
+    database.configure_async_db(create_async_engine(f"sqlite+aiosqlite:///{db_file}", poolclass=NullPool))
+    auth.principal_cache.clear()
+    try:
+        with TestClient(app) as test_client:
+            yield test_client
+    finally:
+        database.async_engine = None
+        database.AsyncSessionLocal = None
+        auth.principal_cache.clear()
+
+
+def test_to_async_url():
+    assert database.to_async_url("sqlite:///./todos.db") == "sqlite+aiosqlite:///./todos.db"
+    assert database.to_async_url("postgresql://u:p@db/x") == "postgresql+asyncpg://u:p@db/x"
+
+
+def test_async_todo_lifecycle(async_client):
+    """Test the todo routes end to end on the async session path"""
+    response = async_client.post("/register", json={"email": "async@example.com", "password": "password123"})
+    assert response.status_code == 201
+    response = async_client.post("/login", data={"username": "async@example.com", "password": "password123"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    todo_id = async_client.post("/todos", json={"text": "Async todo"}, headers=headers).json()["id"]
+    response = async_client.patch(f"/todos/{todo_id}", json={"completed": True}, headers=headers)
+    assert response.json()["completed"] is True
+
+    response = async_client.get("/todos", headers=headers)
+    assert [todo["text"] for todo in response.json()] == ["Async todo"]
+    response = async_client.get("/todos", headers={**headers, "Accept": encoding.COLUMNAR_JSON})
+    assert [dict(zip(response.json()["fields"], row))["text"] for row in response.json()["rows"]] == ["Async todo"]
+
+    assert async_client.get("/todos/stats", headers=headers).json()["completed"] == 1
+
+    assert async_client.delete("/todos/completed", headers=headers).status_code == 204
+    assert async_client.get("/todos", headers=headers).json() == []
+
+    response = async_client.post(
+        "/todos/import", content=b'{"text": "Imported"}\n', headers={**headers, "Content-Type": "application/x-ndjson"}
+    )
+    assert response.text.endswith('"done":true}\n')
+    response = async_client.get("/todos/export?format=csv", headers=headers)
+    assert [line.split(",")[1] for line in response.text.splitlines()] == ["text", "Imported"]
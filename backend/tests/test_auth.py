@@ -114,3 +114,144 @@ def test_empty_password():
     # Even empty password should be hashed
     assert hashed != empty_password
     assert verify_password(empty_password, hashed) is True
+
+
+def test_principal_cache_hit_and_miss():
+    """Test that cached principals are returned until invalidated"""
+    from app.auth import Principal, PrincipalCache
+    import time
+
+    cache = PrincipalCache(ttl_seconds=60, max_size=10)
+    principal = Principal(id="1", email="user@example.com")
+
+    assert cache.get("token") is None
+    cache.put("token", principal, token_expires_at=time.time() + 600)
+    assert cache.get("token") == principal
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    cache.invalidate_user("user@example.com")
+    assert cache.get("token") is None
+
+
+def test_principal_cache_respects_token_expiry_and_size():
+    """Test that expired tokens are not cached and the cache stays bounded"""
+    from app.auth import Principal, PrincipalCache
+    import time
+
+    cache = PrincipalCache(ttl_seconds=60, max_size=2)
+    cache.put("expired", Principal(id="0", email="a@example.com"), token_expires_at=time.time() - 1)
+    assert cache.get("expired") is None
+
+    for i in range(3):
+        cache.put(f"token{i}", Principal(id=str(i), email=f"{i}@example.com"), token_expires_at=time.time() + 600)
+    assert cache.get("token0") is None
+    assert cache.get("token2") is not None
+
+
+def test_verify_and_rehash_outdated_parameters():
+    """Test that hashes made with other Argon2 parameters are upgraded"""
+    from app.auth import pwd_context, verify_and_rehash_password
+    from passlib.context import CryptContext
+
+    old_context = CryptContext(
+        schemes=["argon2"], argon2__rounds=2, argon2__memory_cost=512, argon2__parallelism=1
+    )
+    old_hash = old_context.hash("password123")
+
+    assert verify_and_rehash_password("wrong", old_hash) == (False, None)
+    verified, new_hash = verify_and_rehash_password("password123", old_hash)
+    assert verified is True
+    assert new_hash is not None and not pwd_context.needs_update(new_hash)
+
+    assert verify_and_rehash_password("password123", new_hash) == (True, None)
+
+
+def test_password_hasher_runs_in_pool_and_rejects_when_full():
+    """Test hashing through the process pool and the pending-call limit"""
+    import asyncio
+    from app.auth import PasswordHasher, PasswordHasherBusyError, pwd_context
+
+    hasher = PasswordHasher(workers=1, max_pending=1)
+    try:
+        hashed = asyncio.run(hasher.hash("password123"))
+        assert verify_password("password123", hashed) is True
+        # The pool's processes are started fresh and read PASSWORD_HASH_PROFILE themselves
+        assert not pwd_context.needs_update(hashed)
+        assert asyncio.run(hasher.verify_and_rehash("password123", hashed)) == (True, None)
+    finally:
+        hasher.shutdown()
+
+    full = PasswordHasher(workers=0, max_pending=0)
+    with pytest.raises(PasswordHasherBusyError):
+        asyncio.run(full.hash("password123"))
+
+
+def test_rehash_on_login_drops_cached_tokens(client):
+    """Test that a credential change through db.update_password_hash invalidates the user's cached tokens"""
+    from passlib.context import CryptContext
+    from sqlalchemy import text
+    from app import auth, database
+    from tests.test_api import create_test_user, get_auth_token
+
+    create_test_user(client)
+    token = get_auth_token(client)
+    assert client.get("/todos", headers={"Authorization": f"Bearer {token}"}).status_code == 200
+    assert auth.principal_cache.get(token) is not None
+
+    # Store a hash with outdated parameters behind the ORM's back, so the next login rehashes it
+    old_hash = CryptContext(schemes=["argon2"], argon2__rounds=2, argon2__memory_cost=512).hash("password123")
+    with database.engine.begin() as connection:
+        connection.execute(text("UPDATE users SET password_hash = :hash"), {"hash": old_hash})
+    get_auth_token(client)
+    assert auth.principal_cache.get(token) is None
+
+
+def test_bulk_user_delete_drops_cached_tokens(client):
+    """Test that delete(User) statements invalidate the deleted users' cached tokens"""
+    from sqlalchemy import delete
+    from app import auth, database
+    from app.schema import User
+    from tests.test_api import create_test_user, get_auth_token
+
+    create_test_user(client)
+    token = get_auth_token(client)
+    headers = {"Authorization": f"Bearer {token}"}
+    assert client.get("/todos", headers=headers).status_code == 200
+    assert auth.principal_cache.get(token) is not None
+
+    session = database.SessionLocal()
+    try:
+        session.execute(delete(User).where(User.email == "test@example.com"))
+        session.commit()
+    finally:
+        session.close()
+    assert auth.principal_cache.get(token) is None
+    assert client.get("/todos", headers=headers).status_code == 401
+
+
+def test_orm_user_changes_drop_cached_tokens(client):
+    """Test the mapper event hooks: ORM updates of credentials and ORM deletes invalidate cached tokens"""
+    from app import auth, database
+    from app.schema import User
+    from tests.test_api import create_test_user, get_auth_token
+
+    create_test_user(client)
+    token = get_auth_token(client)
+    headers = {"Authorization": f"Bearer {token}"}
+    assert client.get("/todos", headers=headers).status_code == 200
+
+    session = database.SessionLocal()
+    try:
+        user = session.query(User).filter(User.email == "test@example.com").one()
+        user.password_hash = get_password_hash("new_password")
+        session.commit()
+        assert auth.principal_cache.get(token) is None
+
+        assert client.get("/todos", headers=headers).status_code == 200
+        assert auth.principal_cache.get(token) is not None
+        session.delete(user)
+        session.commit()
+    finally:
+        session.close()
+    assert auth.principal_cache.get(token) is None
+    assert client.get("/todos", headers=headers).status_code == 401
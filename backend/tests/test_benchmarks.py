@@ -0,0 +1,66 @@
+import asyncio
+
+from benchmarks import report, startup, suite
+
+
+def _result(endpoint, size=10, p95=10.0, rps=100.0, errors=0):
+    return {
+        "endpoint": endpoint, "size": size, "requests": 10, "errors": errors,
+        "throughput_rps": rps, "mean_ms": p95, "p50_ms": p95, "p95_ms": p95, "p99_ms": p95,
+    }
+
+
+def test_summarize_computes_percentiles():
+    latencies = [n / 1000 for n in range(1, 101)]
+    result = report.summarize("GET /todos", 10, latencies, errors=1, elapsed=2.0)
+    assert result["requests"] == 100
+    assert result["throughput_rps"] == 50.0
+    assert result["p50_ms"] == 50.0
+    assert result["p95_ms"] == 95.0
+    assert result["p99_ms"] == 99.0
+    assert result["errors"] == 1
+
+
+def test_compare_flags_regressions_beyond_threshold():
+    baseline = {"results": [
+        _result("GET /todos"),
+        _result("POST /todos"),
+        _result("GET /todos/{id}"),
+        _result("POST /login", size=None),
+    ]}
+    current = {"results": [
+        _result("GET /todos", p95=11.0),           # within threshold
+        _result("POST /todos", p95=15.0),          # slower
+        _result("GET /todos/{id}", rps=50.0),      # lower throughput
+        _result("POST /login", size=None, errors=3),
+        _result("DELETE /todos/{id}", p95=500.0),  # not in baseline
+    ]}
+    regressions = report.compare(baseline, current, threshold=0.2)
+    assert [r["key"] for r in regressions] == ["POST /todos [10]", "GET /todos/{id} [10]", "POST /login"]
+
+
+def test_suite_runs_against_the_app():
+    endpoints = ["GET /todos", "GET /todos (If-None-Match)", "POST /todos", "DELETE /todos/batch", "POST /login"]
+    results = asyncio.run(suite.run_suite([5], requests=3, concurrency=1, endpoints=endpoints))
+    assert [report.result_key(r) for r in results] == [
+        "GET /todos [5]", "GET /todos (If-None-Match) [5]", "POST /todos [5]", "DELETE /todos/batch [5]", "POST /login",
+    ]
+    for result in results:
+        assert result["requests"] == 3
+        assert result["errors"] == 0
+
+
+def test_startup_compare_flags_slower_startup_and_more_memory():
+    baseline = {"results": [
+        {"mode": "import app.main", "workers": None, "ready_s": 0.6},
+        {"mode": "app.serve (preload)", "workers": 4, "ready_s": 1.0, "pss_mb": 100.0},
+        {"mode": "uvicorn --workers", "workers": 4, "ready_s": 3.0, "pss_mb": 250.0},
+    ]}
+    current = {"results": [
+        {"mode": "import app.main", "workers": None, "ready_s": 0.65},
+        {"mode": "app.serve (preload)", "workers": 4, "ready_s": 1.0, "pss_mb": 150.0},
+        {"mode": "uvicorn --workers", "workers": 2, "ready_s": 9.0, "pss_mb": 250.0},  # not comparable
+    ]}
+    regressions = startup.compare(baseline, current, threshold=0.2)
+    assert regressions == [{"key": "app.serve (preload)", "reasons": ["PSS 100.0MB -> 150.0MB"]}]
+    assert "-" in startup.format_table(current).splitlines()[1]
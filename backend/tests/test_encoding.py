@@ -0,0 +1,149 @@
+import gzip
+import json
+
+import pytest
+
+from app import compression, encoding
+from tests.test_api import create_test_user, get_auth_token
+
+COLUMNAR = {"Accept": encoding.COLUMNAR_JSON}
+
+
+def _headers(client):
+    create_test_user(client)
+    return {"Authorization": f"Bearer {get_auth_token(client)}"}
+
+
+def _from_columns(data):
+    return [dict(zip(data["fields"], row)) for row in data["rows"]]
+
+
+def test_negotiate_prefers_the_highest_quality_offered_type():
+    assert encoding.negotiate(None) == encoding.JSON
+    assert encoding.negotiate("*/*") == encoding.JSON
+    assert encoding.negotiate("text/html, application/xml;q=0.9") == encoding.JSON
+    assert encoding.negotiate(f"{encoding.COLUMNAR_JSON}, application/json") == encoding.COLUMNAR_JSON
+    assert encoding.negotiate(f"application/json, {encoding.COLUMNAR_JSON}") == encoding.JSON
+    assert encoding.negotiate(f"application/json;q=0.5, {encoding.COLUMNAR_JSON};q=0.8") == encoding.COLUMNAR_JSON
+    assert encoding.negotiate(f"{encoding.COLUMNAR_JSON};q=0") == encoding.JSON
+
+
+def test_to_columns_sends_field_names_once_per_array():
+    data = {"results": [{"id": "a", "todo": {"text": "x"}}, {"id": "b", "error": "Not found"}], "ids": ["a"], "empty": []}
+    assert encoding.to_columns(data) == {
+        "results": {"fields": ["id", "todo", "error"], "rows": [["a", {"text": "x"}, None], ["b", None, "Not found"]]},
+        "ids": ["a"],
+        "empty": [],
+    }
+
+
+def test_get_todos_in_columnar_json(client):
+    headers = _headers(client)
+    for i in range(3):
+        client.post("/todos", json={"text": f"Todo {i}", "priority": "high"}, headers=headers)
+    todos = client.get("/todos", headers=headers).json()
+
+    for params in ({}, {"limit": 2}):
+        response = client.get("/todos", params=params, headers={**headers, **COLUMNAR})
+        assert response.headers["content-type"] == encoding.COLUMNAR_JSON
+        assert "Accept" in response.headers["vary"]
+        assert response.json()["fields"] == list(todos[0])
+        assert _from_columns(response.json()) == todos[:params.get("limit", 3)]
+    assert "x-next-cursor" in response.headers
+
+    for todo in todos:
+        client.delete(f"/todos/{todo['id']}", headers=headers)
+    assert client.get("/todos", headers={**headers, **COLUMNAR}).json() == []
+
+
+def test_write_endpoints_in_columnar_json(client):
+    headers = {**_headers(client), **COLUMNAR}
+    todo = client.post("/todos", json={"text": "One"}, headers=headers)
+    assert todo.status_code == 201
+    assert todo.headers["content-type"] == encoding.COLUMNAR_JSON
+    assert todo.json()["text"] == "One"
+
+    response = client.post("/todos/batch", json={"items": [{"text": "Two"}, {"text": "Three"}]}, headers=headers)
+    results = _from_columns(response.json()["results"])
+    assert [(result["status"], result["todo"]["text"]) for result in results] == [(201, "Two"), (201, "Three")]
+
+    # Errors stay JSON
+    response = client.patch("/todos/missing", json={"text": "x"}, headers=headers)
+    assert response.status_code == 404
+    assert response.headers["content-type"] == "application/json"
+
+
+def test_msgpack_responses(client):
+    msgpack = pytest.importorskip("msgpack")
+    headers = _headers(client)
+    for i in range(3):
+        client.post("/todos", json={"text": f"Todo {i}", "dueDate": 5}, headers=headers)
+    msgpack_headers = {**headers, "Accept": "application/msgpack, application/json;q=0.5"}
+
+    for params in ({}, {"limit": 2}):
+        expected = client.get("/todos", params=params, headers=headers).json()
+        response = client.get("/todos", params=params, headers=msgpack_headers)
+        assert response.headers["content-type"] == encoding.MSGPACK
+        assert msgpack.unpackb(response.content) == expected
+    todo = client.post("/todos", json={"text": "Packed"}, headers=msgpack_headers)
+    assert todo.status_code == 201
+    assert msgpack.unpackb(todo.content)["text"] == "Packed"
+
+
+def test_large_responses_are_compressed(client):
+    headers = _headers(client)
+    client.post("/todos/batch", json={"items": [{"text": f"Todo {i}"} for i in range(50)]}, headers=headers)
+
+    response = client.get("/todos", headers={**headers, "Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert len(response.json()) == 50
+    assert "Accept-Encoding" in response.headers["vary"]
+    # Below the threshold responses are sent as they are
+    small = client.get("/todos", params={"limit": 1}, headers={**headers, "Accept-Encoding": "gzip"})
+    assert "content-encoding" not in small.headers
+    assert len(small.content) < compression.RESPONSE_COMPRESSION_MIN_BYTES
+
+    if compression.brotli is not None:
+        response = client.get("/todos", headers={**headers, "Accept-Encoding": "gzip, br"})
+        assert response.headers["content-encoding"] == "br"
+        assert len(response.json()) == 50
+        response = client.get("/todos", headers={**headers, "Accept-Encoding": "gzip, br;q=0"})
+        assert response.headers["content-encoding"] == "gzip"
+
+
+def test_compressed_stream_decodes_to_the_same_list(client):
+    headers = _headers(client)
+    client.post("/todos/batch", json={"items": [{"text": f"Todo {i}"} for i in range(50)]}, headers=headers)
+    expected = client.get("/todos", headers={**headers, "Accept-Encoding": "identity"}).content
+    with client.stream("GET", "/todos", headers={**headers, "Accept-Encoding": "gzip"}) as response:
+        raw = b"".join(response.iter_raw())
+    assert json.loads(gzip.decompress(raw)) == json.loads(expected)
+
+
+def test_each_variant_has_its_own_etag(client):
+    headers = _headers(client)
+    client.post("/todos/batch", json={"items": [{"text": f"Todo {i}"} for i in range(50)]}, headers=headers)
+    identity = {**headers, "Accept-Encoding": "identity"}
+    variants = [
+        identity,
+        {**identity, **COLUMNAR},
+        {**headers, "Accept-Encoding": "gzip"},
+        {**headers, **COLUMNAR, "Accept-Encoding": "gzip"},
+    ]
+    etags = [client.get("/todos", headers=variant).headers["ETag"] for variant in variants]
+    assert len(set(etags)) == len(etags)
+    assert etags[2] == etags[0][:-1] + '-gzip"'
+
+    # Revalidating a stored variant echoes its own validator
+    for variant, etag in zip(variants, etags):
+        response = client.get("/todos", headers={**variant, "If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.headers["ETag"] == etag
+        assert {"Accept", "Accept-Encoding"} <= {field.strip() for field in response.headers["vary"].split(",")}
+    # but never confirms a variant of another media type
+    assert client.get("/todos", headers={**identity, "If-None-Match": etags[1]}).status_code == 200
+
+    # Any variant's ETag works as If-Match
+    todo_id = client.get("/todos", params={"limit": 1}, headers=headers).json()[0]["id"]
+    response = client.patch(f"/todos/{todo_id}", json={"text": "x"}, headers={**headers, "If-Match": etags[3]})
+    assert response.status_code == 200
@@ -0,0 +1,161 @@
+import asyncio
+import json
+import pytest
+
+from app import database, db, events
+from app.models import TodoCreate, UserCreate
+
+
+@pytest.fixture
+def user_id():
+    session = database.SessionLocal()
+    try:
+        return db.create_user(session, UserCreate(email="feed@example.com", password="x"), password_hash="x").id
+    finally:
+        session.close()
+
+
+def _create_todo(user_id, text):
+    session = database.SessionLocal()
+    try:
+        return db.create_todo(session, TodoCreate(text=text), user_id)
+    finally:
+        session.close()
+
+
+def _parse(chunk: bytes) -> dict:
+    fields = {}
+    for line in chunk.decode().strip().splitlines():
+        key, _, value = line.partition(": ")
+        fields[key] = value
+    return fields
+
+
+def test_broker_limits_connections_per_user():
+    broker = events.ChangeBroker(max_connections_per_user=2, relay_interval_seconds=0)
+
+    async def scenario():
+        first = broker.subscribe("u1")
+        broker.subscribe("u1")
+        with pytest.raises(events.TooManyConnectionsError):
+            broker.subscribe("u1")
+        broker.subscribe("u2")
+        broker.unsubscribe("u1", first)
+        broker.subscribe("u1")
+        assert broker.connection_count("u1") == 2
+
+    asyncio.run(scenario())
+
+
+def test_change_stream_pushes_committed_writes(user_id, monkeypatch):
+    monkeypatch.setattr(events.broker, "relay_interval_seconds", 0)
+
+    async def scenario():
+        wakeup = events.broker.subscribe(user_id)
+        stream = events.change_stream(user_id, None, wakeup)
+        try:
+            ready = _parse(await anext(stream))
+            assert ready["event"] == "ready"
+
+            pending = asyncio.ensure_future(anext(stream))
+            await asyncio.sleep(0.05)
+            assert not pending.done()
+
+            todo = await asyncio.to_thread(_create_todo, user_id, "Pushed")
+            changes = _parse(await asyncio.wait_for(pending, timeout=5))
+            assert changes["event"] == "changes"
+            assert int(changes["id"]) > int(ready["id"])
+            payload = json.loads(changes["data"])
+            assert [t["id"] for t in payload["changed"]] == [todo.id]
+        finally:
+            await stream.aclose()
+            events.broker.unsubscribe(user_id, wakeup)
+
+    asyncio.run(scenario())
+
+
+def test_change_stream_resumes_from_last_event_id(user_id, monkeypatch):
+    monkeypatch.setattr(events.broker, "relay_interval_seconds", 0)
+    monkeypatch.setattr(events, "CHANGE_FEED_HEARTBEAT_SECONDS", 0.01)
+    first = _create_todo(user_id, "Missed 1")
+    second = _create_todo(user_id, "Missed 2")
+
+    async def scenario():
+        stream = events.change_stream(user_id, 0, asyncio.Event())
+        try:
+            assert _parse(await anext(stream))["id"] == "0"
+            replay = _parse(await anext(stream))
+            assert [t["id"] for t in json.loads(replay["data"])["changed"]] == [first.id, second.id]
+            assert await anext(stream) == b": heartbeat\n\n"
+        finally:
+            await stream.aclose()
+
+    asyncio.run(scenario())
+
+
+def test_todo_events_requires_auth(client):
+    assert client.get("/todos/events").status_code == 401
+    assert client.get("/todos/events?access_token=invalid").status_code == 401
+
+
+def test_todo_events_answers_503_when_the_last_slot_is_taken_meanwhile(client, monkeypatch):
+    from tests.test_api import create_test_user, get_auth_token
+
+    create_test_user(client)
+    headers = {"Authorization": f"Bearer {get_auth_token(client)}"}
+    # The check passes, then another stream takes the slot before this one subscribes
+    monkeypatch.setattr(events.broker, "max_connections_per_user", 0)
+    monkeypatch.setattr(events.broker, "connection_count", lambda user_id: -1)
+    response = client.get("/todos/events", headers=headers)
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "5"
+
+
+def test_change_stream_response_releases_its_slot_on_early_disconnect():
+    from app.api import ChangeStreamResponse
+
+    released = []
+
+    async def forever():
+        while True:
+            await asyncio.sleep(1)
+            yield b": heartbeat\n\n"
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        pass
+
+    response = ChangeStreamResponse(forever(), release=lambda: released.append(True), media_type="text/event-stream")
+    asyncio.run(response({"type": "http"}, receive, send))
+    assert released == [True]
+
+
+def test_relay_notices_writes_from_other_workers(user_id):
+    """Writes that never pass through this process's broker still wake streams"""
+    from sqlalchemy import update
+    from app.schema import User
+
+    broker = events.ChangeBroker(max_connections_per_user=1, relay_interval_seconds=0.02)
+
+    def external_write():
+        session = database.SessionLocal()
+        try:
+            session.execute(update(User).where(User.id == user_id).values(todos_version=User.todos_version + 1))
+            session.commit()
+        finally:
+            session.close()
+
+    async def scenario():
+        wakeup = broker.subscribe(user_id)
+        try:
+            # First poll records the current version
+            await asyncio.wait_for(wakeup.wait(), timeout=5)
+            wakeup.clear()
+            await asyncio.to_thread(external_write)
+            await asyncio.wait_for(wakeup.wait(), timeout=5)
+        finally:
+            broker.unsubscribe(user_id, wakeup)
+
+    asyncio.run(scenario())
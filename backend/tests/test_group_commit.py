@@ -0,0 +1,129 @@
+import asyncio
+
+import pytest
+from sqlalchemy import event
+
+from app import database, db, db_async, events, group_commit
+from app.models import TodoCreate, TodoUpdate, UserCreate
+from tests.test_api import create_test_user, get_auth_token
+
+
+@pytest.fixture
+def committer(monkeypatch):
+    """Group commit switched on, with a window wide enough to catch every write of a test"""
+    new_committer = group_commit.GroupCommitter(max_delay=0.05, max_batch_size=100)
+    monkeypatch.setattr(group_commit, "GROUP_COMMIT", True)
+    monkeypatch.setattr(group_commit, "committer", new_committer)
+    yield new_committer
+    new_committer.stop()
+
+
+@pytest.fixture
+def commits():
+    """Number of database COMMITs issued while the test runs"""
+    engine = database.SessionLocal.kw["bind"]
+    count = [0]
+
+    def on_commit(conn):
+        count[0] += 1
+
+    event.listen(engine, "commit", on_commit)
+    yield count
+    event.remove(engine, "commit", on_commit)
+
+
+def _user_id():
+    session = database.SessionLocal()
+    try:
+        return db.create_user(session, UserCreate(email="group@example.com", password="x"), password_hash="x").id
+    finally:
+        session.close()
+
+
+def test_concurrent_writes_share_one_commit(committer, commits):
+    user_id = _user_id()
+
+    async def write_many():
+        session = database.SessionLocal()
+        try:
+            return await asyncio.gather(*(
+                db_async.create_todo(session, TodoCreate(text=f"Todo {i}"), user_id=user_id) for i in range(20)
+            ))
+        finally:
+            session.close()
+
+    todos = asyncio.run(write_many())
+    assert commits[0] == 2  # the user and the batch
+    assert sorted(todo.text for todo in todos) == sorted(f"Todo {i}" for i in range(20))
+    session = database.SessionLocal()
+    try:
+        assert len(db.get_todos_page(session, user_id, limit=100)[0]) == 20
+        assert db.get_todos_version(session, user_id) == 20
+    finally:
+        session.close()
+
+
+def test_failed_write_does_not_affect_its_batch(committer, commits):
+    user_id = _user_id()
+    session = database.SessionLocal()
+    try:
+        todo = db.create_todo(session, TodoCreate(text="Original"), user_id)
+    finally:
+        session.close()
+
+    async def mixed_batch():
+        session = database.SessionLocal()
+        try:
+            return await asyncio.gather(
+                db_async.update_todo(session, todo.id, TodoUpdate(text="Stale"), user_id=user_id, expected_version=0),
+                db_async.create_todo(session, TodoCreate(text="Kept"), user_id=user_id),
+                db_async.update_todo(session, todo.id, TodoUpdate(completed=True), user_id=user_id),
+                return_exceptions=True,
+            )
+        finally:
+            session.close()
+
+    stale, created, updated = asyncio.run(mixed_batch())
+    assert isinstance(stale, db.VersionConflictError)
+    assert created.text == "Kept"
+    assert updated.completed is True and updated.text == "Original"
+    assert commits[0] == 3  # the user, the todo and the batch
+
+
+def test_change_feed_is_notified_once_the_batch_commits(committer, monkeypatch):
+    user_id = _user_id()
+    published = []
+
+    def publish(published_user_id):
+        # Every write of the batch must be visible by the time streams are woken
+        session = database.SessionLocal()
+        try:
+            published.append((published_user_id, len(db.get_todos_page(session, published_user_id, limit=100)[0])))
+        finally:
+            session.close()
+
+    monkeypatch.setattr(events.broker, "publish", publish)
+
+    async def write_two():
+        session = database.SessionLocal()
+        try:
+            await asyncio.gather(*(
+                db_async.create_todo(session, TodoCreate(text=text), user_id=user_id) for text in ("A", "B")
+            ))
+        finally:
+            session.close()
+
+    asyncio.run(write_two())
+    assert published == [(user_id, 2)]
+
+
+def test_api_writes_through_group_commit(client, committer):
+    create_test_user(client)
+    headers = {"Authorization": f"Bearer {get_auth_token(client)}"}
+
+    todo = client.post("/todos", json={"text": "Grouped"}, headers=headers).json()
+    response = client.patch(f"/todos/{todo['id']}", json={"completed": True}, headers={**headers, "If-Match": '"0"'})
+    assert response.status_code == 412
+    assert client.patch(f"/todos/{todo['id']}", json={"completed": True}, headers=headers).json()["completed"] is True
+    assert client.delete("/todos/completed", headers=headers).status_code == 204
+    assert client.get("/todos", headers=headers).json() == []
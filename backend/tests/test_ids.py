@@ -0,0 +1,47 @@
+import time
+import uuid
+
+from sqlalchemy import text
+
+from app import database
+from app.ids import new_id
+from tests.test_api import create_test_user, get_auth_token
+
+
+def test_new_ids_are_time_ordered_uuid7():
+    ids = []
+    for _ in range(5):
+        ids.append(new_id())
+        time.sleep(0.002)
+    assert ids == sorted(ids)
+    assert len(set(ids)) == len(ids)
+    for id in ids:
+        parsed = uuid.UUID(id)
+        assert parsed.version == 7 and parsed.variant == uuid.RFC_4122
+        assert str(parsed) == id
+
+
+def test_ids_are_stored_in_16_bytes(client):
+    user_id = create_test_user(client)["id"]
+    headers = {"Authorization": f"Bearer {get_auth_token(client)}"}
+    todo = client.post("/todos", json={"text": "Compact"}, headers=headers).json()
+
+    assert todo["user_id"] == user_id
+    assert uuid.UUID(todo["id"]).version == 7
+    with database.SessionLocal.kw["bind"].connect() as conn:
+        row = conn.execute(text("SELECT typeof(id), length(id), typeof(user_id) FROM todos")).one()
+    assert tuple(row) == ("blob", 16, "blob")
+    assert client.get(f"/todos/{todo['id']}", headers=headers).json() == todo
+    # Other spellings of the same UUID find the same todo
+    assert client.get(f"/todos/{todo['id'].upper()}", headers=headers).json() == todo
+
+
+def test_malformed_ids_match_nothing(client):
+    create_test_user(client)
+    headers = {"Authorization": f"Bearer {get_auth_token(client)}"}
+
+    assert client.get("/todos/not-a-uuid", headers=headers).status_code == 404
+    assert client.patch("/todos/not-a-uuid", json={"text": "x"}, headers=headers).status_code == 404
+    assert client.delete("/todos/not-a-uuid", headers=headers).status_code == 404
+    response = client.request("DELETE", "/todos/batch", json={"ids": ["not-a-uuid"]}, headers=headers)
+    assert response.json()["results"][0]["status"] == 404
@@ -0,0 +1,66 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+from prometheus_client import REGISTRY
+
+from tests.test_api import create_test_user, get_auth_token
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+
+
+def _sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def test_requests_are_counted_per_route_template(client):
+    create_test_user(client)
+    token = get_auth_token(client)
+    headers = {"Authorization": f"Bearer {token}"}
+    todo_id = client.post("/todos", json={"text": "Measure me"}, headers=headers).json()["id"]
+
+    before = _sample("http_requests_total", method="GET", route="/todos/{id}", status="200")
+    queries_before = _sample("db_queries_per_request_count", route="/todos/{id}")
+    client.get(f"/todos/{todo_id}", headers=headers)
+    client.get("/todos/missing", headers=headers)
+
+    assert _sample("http_requests_total", method="GET", route="/todos/{id}", status="200") == before + 1
+    assert _sample("http_requests_total", method="GET", route="/todos/{id}", status="404") >= 1
+    assert _sample("db_queries_per_request_count", route="/todos/{id}") == queries_before + 2
+    assert _sample("db_queries_per_request_sum", route="/todos/{id}") > 0
+    assert _sample("http_requests_in_progress", method="GET", route="/todos/{id}") == 0
+    assert _sample("password_hash_duration_seconds_count", operation="hash") >= 1
+    assert _sample("password_hash_duration_seconds_count", operation="verify") >= 1
+
+
+def test_unknown_paths_share_one_label(client):
+    before = _sample("http_requests_total", method="GET", route="<unmatched>", status="404")
+    client.get("/no/such/path")
+    client.get("/another/unknown")
+    assert _sample("http_requests_total", method="GET", route="<unmatched>", status="404") == before + 2
+
+
+def test_metrics_endpoint_serves_prometheus_text(client):
+    client.get("/todos")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'http_requests_total{method="GET",route="/todos",status="401"}' in response.text
+    assert "db_query_duration_seconds_bucket" in response.text
+
+
+def test_metrics_aggregate_across_worker_processes(tmp_path):
+    env = {**os.environ, "PROMETHEUS_MULTIPROC_DIR": str(tmp_path)}
+    record = (
+        "import sys; from app import metrics; "
+        "metrics.HTTP_REQUESTS.labels('GET', '/todos', '200').inc(int(sys.argv[1]))"
+    )
+    for count in ("2", "3"):
+        subprocess.run([sys.executable, "-c", record, count], env=env, cwd=BACKEND_DIR, check=True)
+
+    render = "from app import metrics; print(metrics.render_metrics().decode())"
+    output = subprocess.run(
+        [sys.executable, "-c", render], env=env, cwd=BACKEND_DIR, check=True, capture_output=True, text=True
+    ).stdout
+    assert 'http_requests_total{method="GET",route="/todos",status="200"} 5.0' in output
@@ -0,0 +1,177 @@
+import threading
+import uuid
+
+import pytest
+from sqlalchemy import Column, Index, Integer, MetaData, String, Table, create_engine, event, inspect, insert, select, text
+from sqlalchemy.orm import sessionmaker
+
+from app import db, migrations
+from app.database import create_db_engine
+from app.ids import CompactUUID
+from app.models import TodoCreate
+from app.schema import Base, TodoModel, TodoStat, User
+
+
+def test_new_database_is_created_at_head(tmp_path):
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'new.db'}")
+    try:
+        with pytest.raises(RuntimeError, match="init_db_script.py"):
+            migrations.check_schema(engine)
+        assert migrations.upgrade(engine) == 0
+        assert migrations.upgrade(engine) == 0
+        migrations.check_schema(engine)
+        with engine.connect() as conn:
+            assert migrations.current_version(conn) == migrations.HEAD
+            assert set(Base.metadata.tables) <= set(inspect(conn).get_table_names())
+    finally:
+        engine.dispose()
+
+
+def test_check_schema_refuses_a_database_behind_this_release(tmp_path):
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'behind.db'}")
+    try:
+        migrations.upgrade(engine)
+        with engine.begin() as conn:
+            conn.execute(migrations.schema_version.update().values(version=migrations.HEAD - 1))
+        with pytest.raises(RuntimeError, match=f"version {migrations.HEAD - 1}"):
+            migrations.check_schema(engine)
+        with engine.begin() as conn:
+            conn.execute(migrations.schema_version.update().values(version=migrations.HEAD + 1))
+        migrations.check_schema(engine)
+    finally:
+        engine.dispose()
+
+
+def test_concurrent_upgrades_create_the_schema_once(tmp_path):
+    url = f"sqlite:///{tmp_path / 'race.db'}"
+    engines = [create_db_engine(url) for _ in range(4)]
+    results, errors = [], []
+
+    def run(engine):
+        try:
+            results.append(migrations.upgrade(engine))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(engine,)) for engine in engines]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    try:
+        assert errors == [] and results == [0, 0, 0, 0]
+        with engines[0].connect() as conn:
+            assert conn.execute(select(migrations.schema_version.c.version)).scalars().all() == [migrations.HEAD]
+    finally:
+        for engine in engines:
+            engine.dispose()
+
+
+def test_backfill_commits_every_batch(tmp_path):
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'backfill.db'}")
+    table = Table("items", MetaData(), Column("id", Integer, primary_key=True), Column("done", Integer))
+    table.create(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(table), [{"id": id, "done": 0} for id in range(1, 6)])
+    batches, commits = [], []
+    event.listen(engine, "commit", lambda conn: commits.append(len(batches)))
+
+    def apply(conn, ids):
+        batches.append(ids)
+        conn.execute(table.update().where(table.c.id.in_(ids)).values(done=1))
+
+    try:
+        with engine.connect() as conn:
+            conn.begin()
+            migrations.backfill(conn, table.c.id, apply, batch_size=2)
+            conn.commit()
+            assert conn.execute(select(table.c.done)).scalars().all() == [1] * 5
+    finally:
+        engine.dispose()
+    assert batches == [[1, 2], [3, 4], [5]]
+    assert commits[:3] == [1, 2, 3]
+
+
+def _legacy_metadata():
+    """The schema as create_all made it before ids were compact, todo_stats existed, users had
+    purged_revision or ix_todos_user_open_due replaced ix_todos_user_completed"""
+    legacy = MetaData()
+    for table in Base.metadata.sorted_tables:
+        if table.name != TodoStat.__tablename__:
+            table.to_metadata(legacy)
+    users = legacy.tables["users"]
+    users._columns.remove(users.c.purged_revision)
+    todos = legacy.tables["todos"]
+    todos.indexes.discard(next(index for index in todos.indexes if index.name == "ix_todos_user_open_due"))
+    Index("ix_todos_user_completed", todos.c.user_id, todos.c.completed)
+    for table in legacy.tables.values():
+        for column in table.columns:
+            if isinstance(column.type, CompactUUID):
+                column.type = String()
+    return legacy
+
+
+def test_legacy_database_is_migrated_keeping_its_ids(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    legacy = _legacy_metadata()
+    legacy.create_all(engine)
+    user_id, idle_id = str(uuid.uuid4()), str(uuid.uuid4())
+    todo_id, work_id = str(uuid.uuid4()), str(uuid.uuid4())
+    with engine.begin() as conn:
+        conn.execute(insert(legacy.tables["users"]), [{"id": user_id, "email": "old@example.com", "password_hash": "x"}])
+        conn.execute(insert(legacy.tables["users"]), [{"id": idle_id, "email": "idle@example.com", "password_hash": "x"}])
+        conn.execute(insert(legacy.tables["todos"]), [
+            {"id": todo_id, "text": "Old", "completed": True, "created_at": 1, "user_id": user_id, "revision": 1},
+            {"id": work_id, "text": "Work", "completed": False, "created_at": 2, "user_id": user_id,
+             "category": "work", "priority": "high", "revision": 1},
+        ])
+        conn.execute(insert(legacy.tables["todo_tombstones"]), [
+            {"id": str(uuid.uuid4()), "user_id": user_id, "revision": 1, "deleted_at": 1}
+        ])
+
+    assert migrations.upgrade(engine) == len(migrations.MIGRATIONS)
+    migrations.check_schema(engine)
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT DISTINCT typeof(id), typeof(user_id) FROM todos")).one() == ("blob", "blob")
+        assert conn.execute(text("SELECT count(*) FROM todo_tombstones")).scalar() == 1
+        assert conn.execute(text("SELECT purged_revision FROM users")).scalar() == 0
+        inspector = inspect(conn)
+        indexes = {table: {index["name"] for index in inspector.get_indexes(table)} for table in Base.metadata.tables}
+    assert indexes == {table.name: {index.name for index in table.indexes} for table in Base.metadata.sorted_tables}
+
+    session = sessionmaker(bind=engine)()
+    try:
+        assert session.get(User, user_id).email == "old@example.com"
+        # Counted by the backfill, not on this first read, and the same way the app counts
+        stats = session.query(TodoStat).filter(TodoStat.user_id == user_id, TodoStat.dimension == "all").one()
+        assert (stats.open_count, stats.completed_count) == (1, 1)
+        assert db.reconcile_todo_stats(session, user_id) == 0
+        assert db.reconcile_todo_stats(session, idle_id) == 0
+        assert db.get_todo_stats(session, user_id).completed == 1
+        new_todo = db.create_todo(session, TodoCreate(text="New"), user_id)
+        assert session.get(TodoModel, new_todo.id).text == "New"
+        assert [todo.id for todo in db.get_todos_page(session, user_id, limit=10)[0]] == [todo_id, work_id, new_todo.id]
+    finally:
+        session.close()
+        engine.dispose()
+
+
+def test_legacy_migrations_do_not_follow_the_models(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    _legacy_metadata().create_all(engine)
+    # A later release adds a column to the models along with a migration adding it
+    notes = Column("notes", String)
+    TodoModel.__table__.append_column(notes)
+    add_notes = migrations.Migration(
+        migrations.HEAD + 1, "Add todos.notes",
+        lambda conn: conn.exec_driver_sql("ALTER TABLE todos ADD COLUMN notes VARCHAR"),
+    )
+    monkeypatch.setattr(migrations, "MIGRATIONS", [*migrations.MIGRATIONS, add_notes])
+    monkeypatch.setattr(migrations, "HEAD", add_notes.version)
+    try:
+        assert migrations.upgrade(engine) == len(migrations.MIGRATIONS)
+        with engine.connect() as conn:
+            assert "notes" in {column["name"] for column in inspect(conn).get_columns("todos")}
+    finally:
+        TodoModel.__table__._columns.remove(notes)
+        engine.dispose()
@@ -0,0 +1,63 @@
+import json
+import os
+
+import pytest
+
+from app import profiling
+from tests.test_api import create_test_user, get_auth_token
+
+
+@pytest.fixture
+def profile_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path))
+    monkeypatch.setattr(profiling, "PROFILING_TOKEN", "let-me-profile")
+    monkeypatch.setattr(profiling, "PROFILE_INTERVAL_SECONDS", 0.001)
+    return tmp_path
+
+
+def _profile_ids(directory):
+    return sorted(name[:-len(".json")] for name in os.listdir(directory) if name.endswith(".json"))
+
+
+def test_profile_header_writes_stacks_and_sql(client, profile_dir):
+    create_test_user(client)
+    headers = {"Authorization": f"Bearer {get_auth_token(client)}"}
+    client.post("/todos", json={"text": "Profile me"}, headers=headers)
+
+    response = client.get("/todos", headers={**headers, "X-Profile": "let-me-profile"})
+
+    assert response.status_code == 200
+    profile_id = response.headers["X-Profile-Id"]
+    assert _profile_ids(profile_dir) == [profile_id]
+    with open(profile_dir / f"{profile_id}.json") as f:
+        report = json.load(f)
+    assert report["method"] == "GET"
+    assert report["path"] == "/todos"
+    assert report["status"] == 200
+    assert any("FROM todos" in statement["sql"] for statement in report["statements"])
+    with open(profile_dir / f"{profile_id}.folded") as f:
+        for line in f:
+            stack, count = line.rsplit(" ", 1)
+            assert ";" in stack and int(count) > 0
+
+
+def test_requests_without_valid_header_are_not_profiled(client, profile_dir):
+    assert "X-Profile-Id" not in client.get("/todos").headers
+    assert "X-Profile-Id" not in client.get("/todos", headers={"X-Profile": "guess"}).headers
+    assert _profile_ids(profile_dir) == []
+
+
+def test_sampling_profiles_every_nth_request(client, profile_dir, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_SAMPLE_EVERY", 3)
+    profiled = [("X-Profile-Id" in client.get("/todos").headers) for _ in range(9)]
+    assert profiled.count(True) == 3
+    assert len(_profile_ids(profile_dir)) == 3
+
+
+def test_old_profiles_are_pruned(client, profile_dir, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_MAX_PROFILES", 2)
+    ids = [client.get("/todos", headers={"X-Profile": "let-me-profile"}).headers["X-Profile-Id"] for _ in range(4)]
+    remaining = _profile_ids(profile_dir)
+    assert len(remaining) == 2
+    assert remaining == sorted(ids[-2:])
+    assert len(os.listdir(profile_dir)) == 4
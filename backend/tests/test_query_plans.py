@@ -0,0 +1,138 @@
+"""
+Query plan regression tests.
+
+Every statement issued by the functions in app/db.py is run through
+EXPLAIN QUERY PLAN on SQLite (and EXPLAIN on Postgres when TEST_POSTGRES_URL
+is set) and must be answered from an index rather than a full table scan.
+"""
+import os
+import re
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app import db
+from app.database import Base
+from app.models import (
+    ExportFormat, Priority, TodoBatchUpdateItem, TodoCreate, TodoFilter, TodoImportItem, TodoSort, TodoUpdate,
+    UserCreate
+)
+
+POSTGRES_URL = os.getenv("TEST_POSTGRES_URL")
+
+FILTERS = (
+    TodoFilter(completed=False),
+    TodoFilter(category="work"),
+    TodoFilter(priority=Priority.high),
+    TodoFilter(dueAfter=0, dueBefore=10),
+    TodoFilter(overdue=True),
+    TodoFilter(completed=False, category="work", priority=Priority.high, dueAfter=0, dueBefore=10),
+)
+
+
+def _sqlite_engine():
+    return create_engine(
+        "sqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+
+
+def _engines():
+    engines = [pytest.param(_sqlite_engine, id="sqlite")]
+    engines.append(
+        pytest.param(
+            lambda: create_engine(POSTGRES_URL),
+            id="postgres",
+            marks=pytest.mark.skipif(not POSTGRES_URL, reason="TEST_POSTGRES_URL not set"),
+        )
+    )
+    return engines
+
+
+def _run_db_functions(session):
+    """Exercise every read/write query in app.db"""
+    user = db.create_user(session, UserCreate(email="plan@example.com", password="password123"))
+    db.get_user_by_email(session, "plan@example.com")
+    todo = db.create_todo(session, TodoCreate(text="Plan", category="work", priority=Priority.high), user.id)
+
+    # The full list of GET /todos, under every sort and filter it accepts
+    for sort in TodoSort:
+        list(db.iter_todos(session, user.id, sort=sort))
+    for filters in FILTERS:
+        for sort in TodoSort:
+            list(db.iter_todos(session, user.id, filters=filters, sort=sort))
+        db.get_todos_page(session, user.id, limit=1, filters=filters)
+        db.get_todos_page(session, user.id, limit=1, cursor=db.encode_cursor(0, ""), filters=filters)
+    db.get_todos_page(session, user.id, limit=1)
+    db.get_todos_page(session, user.id, limit=1, cursor=db.encode_cursor(0, ""))
+    list(db.iter_todos_export(session, user.id, ExportFormat.csv))
+
+    db.get_todo(session, todo.id, user.id)
+    db.update_todo(session, todo.id, TodoUpdate(completed=True), user.id)
+    db.delete_completed_todos(session, user.id)
+    db.delete_todo(session, todo.id, user.id)
+
+    todos = db.create_todos(session, [TodoCreate(text="A"), TodoCreate(text="B")], user.id)
+    db.update_todos(session, [TodoBatchUpdateItem(id=todo.id, completed=True) for todo in todos], user.id)
+    db.delete_todos(session, [todo.id for todo in todos], user.id)
+    db.import_todos(session, [TodoImportItem(text="Imported", completed=True)], user.id)
+
+    db.get_changes(session, user.id, since=0)
+    db.get_todo_stats(session, user.id)
+    db.reconcile_all_todo_stats(session)
+    db.purge_tombstones(session, older_than=2**62)
+
+
+def _capture_statements(engine):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        keyword = statement.lstrip().upper()
+        # INSERT ... VALUES reads nothing, but INSERT ... SELECT has a plan to check
+        if keyword.startswith("INSERT") and not re.search(r"\bSELECT\b", keyword):
+            return
+        if not keyword.startswith(("SAVEPOINT", "RELEASE")):
+            # One parameter set is enough to plan an executemany statement
+            statements.append((statement, parameters[0] if executemany else parameters))
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    session = sessionmaker(bind=engine)()
+    try:
+        _run_db_functions(session)
+    finally:
+        session.close()
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    return statements
+
+
+def _full_scans(conn, statement, parameters):
+    if conn.dialect.name == "sqlite":
+        rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).all()
+        # "SCAN todos" is a full scan; "SEARCH todos USING INDEX ..." is fine
+        return [row[-1] for row in rows if row[-1].startswith("SCAN ")]
+    rows = conn.exec_driver_sql(f"EXPLAIN {statement}", parameters).all()
+    return [row[0] for row in rows if "Seq Scan" in row[0]]
+
+
+@pytest.mark.parametrize("make_engine", _engines())
+def test_db_queries_use_indexes(make_engine):
+    engine = make_engine()
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    try:
+        statements = _capture_statements(engine)
+        assert statements
+        # The tombstones written by deletes are planned too
+        assert any(statement.lstrip().upper().startswith("INSERT") for statement, _ in statements)
+
+        with engine.connect() as conn:
+            if conn.dialect.name == "postgresql":
+                # Tiny tables make a sequential scan cheapest; only fail if no index applies
+                conn.exec_driver_sql("SET enable_seqscan = off")
+            for statement, parameters in statements:
+                assert _full_scans(conn, statement, parameters) == [], statement
+    finally:
+        Base.metadata.drop_all(bind=engine)
+        engine.dispose()
@@ -0,0 +1,112 @@
+import pytest
+from sqlalchemy import delete, insert, select
+from sqlalchemy.orm import sessionmaker
+
+from app import auth, database, migrations, replicas
+from app.database import Base, create_db_engine
+from tests.test_api import create_test_user, get_auth_token
+
+
+@pytest.fixture
+def primary_and_replica(tmp_path, monkeypatch):
+    """A primary and a replica in two SQLite files; the replica only changes when replicate() is called"""
+    primary = create_db_engine(f"sqlite:///{tmp_path / 'primary.db'}")
+    replica = create_db_engine(f"sqlite:///{tmp_path / 'replica.db'}")
+    for engine in (primary, replica):
+        migrations.upgrade(engine)
+    replica_set = replicas.ReplicaSet([replica], read_your_writes_seconds=5)
+    monkeypatch.setattr(database, "engine", primary)
+    monkeypatch.setattr(database, "SessionLocal", sessionmaker(autocommit=False, autoflush=False, bind=primary))
+    monkeypatch.setattr(database, "replicas", replica_set)
+    auth.principal_cache.clear()
+
+    def replicate():
+        with primary.connect() as source, replica.begin() as target:
+            for table in reversed(Base.metadata.sorted_tables):
+                target.execute(delete(table))
+            for table in Base.metadata.sorted_tables:
+                rows = [row._asdict() for row in source.execute(select(table))]
+                if rows:
+                    target.execute(insert(table), rows)
+
+    yield replica_set, replicate
+    auth.principal_cache.clear()
+    primary.dispose()
+    replica.dispose()
+
+
+def _texts(client, headers):
+    return [todo["text"] for todo in client.get("/todos", headers=headers).json()]
+
+
+def test_reads_go_to_the_replica_except_right_after_the_users_own_writes(client, primary_and_replica, monkeypatch):
+    replica_set, replicate = primary_and_replica
+    create_test_user(client)
+    headers = {"Authorization": f"Bearer {get_auth_token(client)}"}
+    replicate()
+
+    client.post("/todos", json={"text": "Not replicated yet"}, headers=headers)
+    # Read your writes: the primary serves this user until the window passes
+    assert _texts(client, headers) == ["Not replicated yet"]
+    todo_id = client.get("/todos", params={"limit": 1}, headers=headers).json()[0]["id"]
+    assert client.get(f"/todos/{todo_id}", headers=headers).status_code == 200
+
+    monkeypatch.setattr(replica_set, "read_your_writes_seconds", 0)
+    assert _texts(client, headers) == []
+    assert client.get(f"/todos/{todo_id}", headers=headers).status_code == 404
+    assert client.get("/todos/changes", headers=headers).json()["changed"] == []
+    assert client.get("/todos/export", headers=headers).text == ""
+    replicate()
+    assert _texts(client, headers) == ["Not replicated yet"]
+
+    # Writes always go to the primary
+    assert client.post("/todos", json={"text": "Second"}, headers=headers).status_code == 201
+    monkeypatch.setattr(replica_set, "read_your_writes_seconds", 5)
+    assert _texts(client, headers) == ["Not replicated yet", "Second"]
+
+
+def test_unhealthy_replicas_are_skipped(client, primary_and_replica, monkeypatch):
+    replica_set, replicate = primary_and_replica
+    create_test_user(client)
+    headers = {"Authorization": f"Bearer {get_auth_token(client)}"}
+    client.post("/todos", json={"text": "On the primary"}, headers=headers)
+    monkeypatch.setattr(replica_set, "read_your_writes_seconds", 0)
+    assert _texts(client, headers) == []
+
+    replica = replica_set.replicas[0]
+    monkeypatch.setattr(replicas, "replication_lag_seconds", lambda engine: 60.0)
+    replica_set.check_health()
+    assert not replica.healthy
+    assert _texts(client, headers) == ["On the primary"]
+
+    monkeypatch.setattr(replicas, "replication_lag_seconds", lambda engine: 0.0)
+    replica_set.check_health()
+    assert replica.healthy
+    assert _texts(client, headers) == []
+
+
+def test_user_lookup_falls_back_to_the_primary_for_new_accounts(client, primary_and_replica):
+    replica_set, replicate = primary_and_replica
+    create_test_user(client)
+    token = get_auth_token(client)
+    # Not on the replica yet, but the token still authenticates
+    assert client.get("/todos", headers={"Authorization": f"Bearer {token}"}).status_code == 200
+
+
+def test_replicas_are_chosen_round_robin(tmp_path):
+    engines = [create_db_engine(f"sqlite:///{tmp_path / f'replica{i}.db'}") for i in range(3)]
+    replica_set = replicas.ReplicaSet(engines, read_your_writes_seconds=5)
+    assert [replica_set.choose().engine for _ in range(6)] == engines * 2
+
+    replica_set.replicas[1].healthy = False
+    assert {replica_set.choose().engine for _ in range(4)} == {engines[0], engines[2]}
+
+    replica_set.mark_write("user-1")
+    assert replica_set.choose("user-1") is None
+    assert replica_set.choose("user-2") is not None
+    assert replicas.ReplicaSet([], read_your_writes_seconds=5).choose() is None
+
+    # SQLite can't open a directory, so this replica fails its check
+    (tmp_path / "replica0.db").mkdir()
+    replica_set.check_health()
+    assert [replica.healthy for replica in replica_set.replicas] == [False, True, True]
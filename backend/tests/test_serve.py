@@ -0,0 +1,72 @@
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import httpx
+
+from app import migrations
+from app.database import create_db_engine
+from benchmarks import startup
+
+
+def _wait_for(condition, timeout=20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        result = condition()
+        if result:
+            return result
+        time.sleep(0.1)
+    raise AssertionError("timed out")
+
+
+def test_app_import_skips_unused_database_dialects():
+    script = "import sys, app.main; print(sorted(m for m in sys.modules if 'postgres' in m or 'psycopg' in m))"
+    output = subprocess.run(
+        [sys.executable, "-c", script], cwd=startup.BACKEND_DIR, capture_output=True, text=True, check=True,
+        env={**os.environ, "DATABASE_URL": "sqlite:///:memory:"},
+    ).stdout
+    assert output.strip() == "[]"
+
+
+def test_forked_workers_serve_requests_and_are_replaced(tmp_path):
+    database_url = f"sqlite:///{tmp_path / 'serve.db'}"
+    engine = create_db_engine(database_url)
+    migrations.upgrade(engine)
+    engine.dispose()
+    port = startup._free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "app.serve", "--workers", "2", "--port", str(port)],
+        cwd=startup.BACKEND_DIR, env={**os.environ, "DATABASE_URL": database_url},
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+    )
+    try:
+        workers = _wait_for(lambda: len(startup._children(server.pid)) == 2 and startup._children(server.pid))
+
+        def metrics_status():
+            try:
+                return httpx.get(f"http://127.0.0.1:{port}/metrics").status_code
+            except httpx.TransportError:
+                return None
+
+        assert _wait_for(metrics_status) == 200
+        os.kill(workers[0], signal.SIGKILL)
+        _wait_for(lambda: len(startup._children(server.pid)) == 2 and workers[0] not in startup._children(server.pid))
+        server.send_signal(signal.SIGTERM)
+        assert server.wait(timeout=20) == 0
+    finally:
+        if server.poll() is None:
+            server.kill()
+            server.wait()
+    assert f"Worker {workers[0]} exited (exit code -9), forking a new one" in server.stderr.read()
+
+
+def test_forking_server_refuses_a_database_behind_this_release(tmp_path):
+    result = subprocess.run(
+        [sys.executable, "-m", "app.serve", "--port", str(startup._free_port())],
+        cwd=startup.BACKEND_DIR, env={**os.environ, "DATABASE_URL": f"sqlite:///{tmp_path / 'empty.db'}"},
+        capture_output=True, text=True, timeout=30,
+    )
+    assert result.returncode != 0
+    assert "init_db_script.py" in result.stderr
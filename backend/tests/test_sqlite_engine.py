@@ -0,0 +1,87 @@
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool, StaticPool
+
+from app import db
+from app.database import Base, create_db_engine
+from app.models import TodoCreate, TodoUpdate, UserCreate
+from app.schema import TodoModel
+
+
+def test_sqlite_file_engine_pragmas(tmp_path):
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'pragmas.db'}")
+    try:
+        assert isinstance(engine.pool, QueuePool)
+        with engine.connect() as conn:
+            assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+            # NORMAL
+            assert conn.execute(text("PRAGMA synchronous")).scalar() == 1
+            assert conn.execute(text("PRAGMA busy_timeout")).scalar() == 5000
+            # MEMORY
+            assert conn.execute(text("PRAGMA temp_store")).scalar() == 2
+    finally:
+        engine.dispose()
+
+
+def test_sqlite_memory_engine_shares_one_connection():
+    engine = create_db_engine("sqlite:///:memory:")
+    assert isinstance(engine.pool, StaticPool)
+    Base.metadata.create_all(bind=engine)
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT count(*) FROM todos")).scalar() == 0
+
+
+def test_sqlite_concurrent_writers(tmp_path):
+    """Many concurrent writers on one file must all succeed without lock errors"""
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'writers.db'}")
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    setup = Session()
+    user_id = db.create_user(setup, UserCreate(email="w@example.com", password="x"), password_hash="x").id
+    setup.close()
+
+    writers, writes_per_writer = 8, 25
+
+    def write(worker):
+        session = Session()
+        try:
+            for i in range(writes_per_writer):
+                todo = db.create_todo(session, TodoCreate(text=f"{worker}-{i}"), user_id)
+                db.update_todo(session, todo.id, TodoUpdate(completed=True), user_id)
+        finally:
+            session.close()
+
+    try:
+        with ThreadPoolExecutor(max_workers=writers) as pool:
+            for future in [pool.submit(write, worker) for worker in range(writers)]:
+                future.result()
+
+        check = Session()
+        try:
+            assert check.query(TodoModel).filter(TodoModel.completed == True).count() == writers * writes_per_writer
+            # Two version bumps per iteration
+            assert db.get_todos_version(check, user_id) == 2 * writers * writes_per_writer
+        finally:
+            check.close()
+    finally:
+        engine.dispose()
+
+
+def test_worker_lease_is_held_by_one_worker_at_a_time(tmp_path, monkeypatch):
+    from app import database, tasks
+
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'lease.db'}")
+    monkeypatch.setattr(database, "engine", engine)
+    workers = [tasks.WorkerLease("reconcile", postgres_key=1) for _ in range(2)]
+    try:
+        assert [lease.held() for lease in workers] == [True, False]
+        # The holder keeps it across runs
+        assert [lease.held() for lease in workers] == [True, False]
+        workers[0].release()
+        assert [lease.held() for lease in reversed(workers)] == [True, False]
+    finally:
+        for lease in workers:
+            lease.release()
+        engine.dispose()